@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import random
+import typing
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import lxml.etree as etree
+
+from PyWSD import wsd_common, \
+    wsd_discovery__structures, \
+    wsd_eventing__operations, \
+    wsd_scan__images, \
+    wsd_scan__operations, \
+    wsd_scan__parsers, \
+    wsd_scan__schema, \
+    wsd_scan__structures, \
+    wsd_transfer__operations, \
+    wsd_transfer__structures, \
+    wsd_globals
+
+
+async def read_chunked(reader: asyncio.StreamReader) \
+        -> bytes:
+    body = bytearray()
+    while True:
+        size = int((await reader.readline()).split(b";")[0].strip(), 16)
+        if size == 0:
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            return bytes(body)
+        body += await reader.readexactly(size)
+        await reader.readline()
+
+
+async def http_post(addr: str,
+                    data: bytes,
+                    headers: typing.Dict[str, str]) \
+        -> typing.Tuple[int, typing.Dict[str, str], bytes]:
+    """
+    Send an HTTP/1.1 POST request using asyncio streams, and read the whole reply.
+
+    :param addr: the address to send the message to
+    :type addr: str
+    :param data: the request body
+    :type data: bytes
+    :param headers: the HTTP headers of the request
+    :type headers: {str: str}
+    :return: the status code, the reply headers (with lowercase names) and the reply body
+    :rtype: (int, {str: str}, bytes)
+    """
+    u = urlsplit(addr)
+    https = u.scheme == "https"
+    port = u.port if u.port is not None else (443 if https else 80)
+    path = u.path if u.path else "/"
+    if u.query:
+        path += "?" + u.query
+
+    reader, writer = await asyncio.open_connection(u.hostname, port, ssl=True if https else None)
+    try:
+        head = "POST %s HTTP/1.1\r\n" % path
+        head += "Host: %s\r\n" % u.netloc
+        head += "Content-Length: %d\r\n" % len(data)
+        head += "Connection: close\r\n"
+        for k, v in headers.items():
+            head += "%s: %s\r\n" % (k, v)
+        writer.write(head.encode("latin-1") + b"\r\n" + data)
+        await writer.drain()
+
+        status = 100
+        reply_headers = {}
+        while status == 100:
+            status = int((await reader.readline()).split()[1])
+            reply_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                k, _, v = line.decode("latin-1").partition(":")
+                reply_headers[k.strip().lower()] = v.strip()
+
+        if "chunked" in reply_headers.get("transfer-encoding", "").lower():
+            body = await read_chunked(reader)
+        elif "content-length" in reply_headers:
+            body = await reader.readexactly(int(reply_headers["content-length"]))
+        else:
+            body = await reader.read()
+        return status, reply_headers, body
+    finally:
+        writer.close()
+
+
+class AsyncClient:
+    """
+    Asynchronous counterpart of the transfer, scan and eventing operations. Each method builds the same request
+    as its synchronous twin and returns the same structures, parsed by the same parsers. Requests are sent over
+    asyncio streams, so thousands of them can be kept in flight from a single thread; max_in_flight bounds the
+    number of simultaneously open connections.
+    """
+
+    def __init__(self,
+                 max_in_flight: int = 1024,
+                 timeout: float = 2.0):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.semaphore = None
+
+    async def post(self,
+                   addr: str,
+                   data: bytes,
+                   timeout: typing.Union[float, None]) \
+            -> typing.Tuple[int, typing.Dict[str, str], bytes]:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        async with self.semaphore:
+            return await asyncio.wait_for(http_post(addr, data, wsd_common.headers), timeout)
+
+    async def soap_post_unicast(self,
+                                addr: str,
+                                data: bytes) \
+            -> typing.Union[bytes, None]:
+        """
+        Send a SOAP message as an HTTP POST request, with the same retry policy of wsd_common.soap_post_unicast().
+
+        :param addr: the address to send the message to
+        :type addr: str
+        :param data: the message content
+        :type data: bytes
+        :return: the reply message, if any
+        :rtype: bytes | None
+        """
+        min_delay = 50
+        max_delay = 250
+        upper_delay = 500
+        try:
+            repeat = 2
+            t = random.uniform(min_delay, max_delay)
+            while repeat:
+                try:
+                    return (await self.post(addr, data, self.timeout))[2]
+                except asyncio.TimeoutError:
+                    await asyncio.sleep(t / 1000.0)
+                    t = t * 2 if t * 2 < upper_delay else upper_delay
+                    repeat -= 1
+            return None
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            return None
+
+    async def submit_request(self,
+                             addrs: typing.Set[str],
+                             xml_template: str,
+                             fields_map: typing.Dict[str, typing.Any]) \
+            -> etree.ElementTree:
+        """
+        Asynchronous version of wsd_common.submit_request().
+        Raises TimeoutError instead of StopIteration if no address replies, since coroutines can't raise the latter.
+
+        :param addrs: the addresses of the wsd service
+        :type addrs: {str}
+        :param xml_template: the *name* of the template file to use as payload
+        :type xml_template: str
+        :param fields_map: the dictionary containing the values needed to fill the loaded XML template
+        :type fields_map: {str: any}
+        :return: the full XML response message
+        :rtype: lxml.etree.ElementTree
+        """
+        op_name = " ".join(xml_template.split("__")[1].split(".")[0].split("_")).upper()
+        data = wsd_common.render_template(xml_template, fields_map)
+
+        if wsd_globals.debug:
+            r = etree.fromstring(data, parser=wsd_common.parser)
+            print('##\n## %s REQUEST\n##\n' % op_name)
+            wsd_common.log_xml(r)
+            print(etree.tostring(r, pretty_print=True, xml_declaration=True).decode("ASCII"))
+
+        for addr in addrs:
+            r = await self.soap_post_unicast(addr, data)
+            if r is None:
+                continue
+
+            x = etree.fromstring(r)
+
+            if wsd_globals.debug:
+                print('##\n## %s RESPONSE\n##\n' % op_name)
+                wsd_common.log_xml(x)
+                print(etree.tostring(x, pretty_print=True, xml_declaration=True).decode("ASCII"))
+
+            return x
+
+        raise TimeoutError
+
+    async def wsd_get(self,
+                      target_service: wsd_discovery__structures.TargetService):
+        """
+        See wsd_transfer__operations.wsd_get()
+        """
+        # the cache may read from and write to the database, which would block the event loop
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(None, wsd_transfer__operations.cached_get_response, target_service)
+        if result is not None:
+            return result
+        fields = {"FROM": wsd_globals.urn,
+                  "TO": target_service.ep_ref_addr}
+        x = await self.submit_request(target_service.xaddrs,
+                                      "ws-transfer__get.xml",
+                                      fields)
+        return await loop.run_in_executor(None, wsd_transfer__operations.store_get_response, target_service, x)
+
+    async def wsd_get_scanner_elements(self,
+                                       hosted_scan_service: wsd_transfer__structures.HostedService):
+        """
+        See wsd_scan__operations.wsd_get_scanner_elements()
+        """
+        fields = {"FROM": wsd_globals.urn,
+                  "TO": hosted_scan_service.ep_ref_addr}
+        x = await self.submit_request({hosted_scan_service.ep_ref_addr},
+                                      "ws-scan__get_scanner_elements.xml",
+                                      fields)
+        return wsd_scan__operations.scanner_elements_parser(x)
+
+    async def wsd_validate_scan_ticket(self,
+                                       hosted_scan_service: wsd_transfer__structures.HostedService,
+                                       tkt: wsd_scan__structures.ScanTicket) \
+            -> typing.Tuple[bool, wsd_scan__structures.ScanTicket]:
+        """
+        See wsd_scan__operations.wsd_validate_scan_ticket()
+        """
+        fields = {"FROM": wsd_globals.urn,
+                  "TO": hosted_scan_service.ep_ref_addr}
+        x = await self.submit_request({hosted_scan_service.ep_ref_addr},
+                                      "ws-scan__validate_scan_ticket.xml",
+                                      {**fields, "SCAN_TICKET": wsd_scan__schema.serialize_scan_ticket(tkt)})
+        return wsd_scan__parsers.parse_validate_scan_ticket_response(x, tkt)
+
+    async def wsd_create_scan_job(self,
+                                  hosted_scan_service: wsd_transfer__structures.HostedService,
+                                  tkt: wsd_scan__structures.ScanTicket,
+                                  scan_identifier: str = "",
+                                  dest_token: str = "") \
+            -> wsd_scan__structures.ScanJob:
+        """
+        See wsd_scan__operations.wsd_create_scan_job()
+        """
+        fields = {"FROM": wsd_globals.urn,
+                  "TO": hosted_scan_service.ep_ref_addr,
+                  "SCAN_ID": scan_identifier,
+                  "DEST_TOKEN": dest_token}
+        x = await self.submit_request({hosted_scan_service.ep_ref_addr},
+                                      "ws-scan__create_scan_job.xml",
+                                      {**fields, "SCAN_TICKET": wsd_scan__schema.serialize_scan_ticket(tkt)})
+        return wsd_scan__parsers.parse_create_scan_job_response(x)
+
+    async def wsd_cancel_job(self,
+                             hosted_scan_service: wsd_transfer__structures.HostedService,
+                             job: wsd_scan__structures.ScanJob) \
+            -> bool:
+        """
+        See wsd_scan__operations.wsd_cancel_job()
+        """
+        fields = {"FROM": wsd_globals.urn,
+                  "TO": hosted_scan_service.ep_ref_addr,
+                  "JOB_ID": job.id}
+        x = await self.submit_request({hosted_scan_service.ep_ref_addr},
+                                      "ws-scan__cancel_job.xml",
+                                      fields)
+        return wsd_scan__parsers.parse_cancel_job_response(x)
+
+    async def wsd_get_job_elements(self,
+                                   hosted_scan_service: wsd_transfer__structures.HostedService,
+                                   job: wsd_scan__structures.ScanJob):
+        """
+        See wsd_scan__operations.wsd_get_job_elements()
+        """
+        fields = {"FROM": wsd_globals.urn,
+                  "TO": hosted_scan_service.ep_ref_addr,
+                  "JOB_ID": job.id}
+        x = await self.submit_request({hosted_scan_service.ep_ref_addr},
+                                      "ws-scan__get_job_elements.xml",
+                                      fields)
+        return wsd_scan__parsers.parse_job_elements(x)
+
+    async def wsd_get_active_jobs(self,
+                                  hosted_scan_service: wsd_transfer__structures.HostedService) \
+            -> typing.List[wsd_scan__structures.JobSummary]:
+        """
+        See wsd_scan__operations.wsd_get_active_jobs()
+        """
+        fields = {"FROM": wsd_globals.urn,
+                  "TO": hosted_scan_service.ep_ref_addr}
+        x = await self.submit_request({hosted_scan_service.ep_ref_addr},
+                                      "ws-scan__get_active_jobs.xml",
+                                      fields)
+        return wsd_scan__parsers.parse_job_summaries(x)
+
+    async def wsd_get_job_history(self,
+                                  hosted_scan_service: wsd_transfer__structures.HostedService) \
+            -> typing.List[wsd_scan__structures.JobSummary]:
+        """
+        See wsd_scan__operations.wsd_get_job_history()
+        """
+        fields = {"FROM": wsd_globals.urn,
+                  "TO": hosted_scan_service.ep_ref_addr}
+        x = await self.submit_request({hosted_scan_service.ep_ref_addr},
+                                      "ws-scan__get_job_history.xml",
+                                      fields)
+        return wsd_scan__parsers.parse_job_summaries(x)
+
+    async def wsd_retrieve_image(self,
+                                 hosted_scan_service: wsd_transfer__structures.HostedService,
+                                 job: wsd_scan__structures.ScanJob,
+                                 docname: str) \
+            -> typing.Tuple[int, wsd_scan__images.PageSequence]:
+        """
+        See wsd_scan__operations.wsd_retrieve_image()
+        """
+        data = wsd_scan__operations.retrieve_image_request(hosted_scan_service, job, docname)
+        _, headers, body = await self.post(hosted_scan_service.ep_ref_addr, data, None)
+        return wsd_scan__operations.parse_retrieve_image_response(headers.get("content-type", ""), body)
+
+    async def wsd_retrieve_image_raw(self,
+                                     hosted_scan_service: wsd_transfer__structures.HostedService,
+                                     job: wsd_scan__structures.ScanJob,
+                                     docname: str) \
+            -> typing.Union[wsd_scan__images.RawImage, None]:
+        """
+        See wsd_scan__operations.wsd_retrieve_image_raw()
+        """
+        data = wsd_scan__operations.retrieve_image_request(hosted_scan_service, job, docname)
+        _, headers, body = await self.post(hosted_scan_service.ep_ref_addr, data, None)
+        return wsd_scan__operations.parse_retrieve_image_raw(headers.get("content-type", ""), body)
+
+    async def wsd_subscribe(self,
+                            hosted_service: wsd_transfer__structures.HostedService,
+                            event_uri: str,
+                            notify_addr: str,
+                            expiration: typing.Union[datetime, timedelta] = None) \
+            -> typing.Union[etree.ElementTree, bool]:
+        """
+        See wsd_eventing__operations.wsd_subscribe()
+        """
+        fields_map = {"FROM": wsd_globals.urn,
+                      "TO": hosted_service.ep_ref_addr,
+                      "NOTIFY_ADDR": notify_addr,
+                      "FILTER_DIALECT": "http://schemas.xmlsoap.org/ws/2006/02/devprof/Action",
+                      "EVENT": event_uri,
+                      **wsd_eventing__operations.expiration_fields(expiration)}
+        x = await self.submit_request({hosted_service.ep_ref_addr},
+                                      "ws-eventing__subscribe.xml",
+                                      fields_map)
+        return wsd_eventing__operations.parse_subscribe_response(x)
+
+    async def wsd_unsubscribe(self,
+                              hosted_service: wsd_transfer__structures.HostedService,
+                              subscription_id: str) \
+            -> bool:
+        """
+        See wsd_eventing__operations.wsd_unsubscribe()
+        """
+        fields_map = {"FROM": wsd_globals.urn,
+                      "TO": hosted_service.ep_ref_addr,
+                      "SUBSCRIPTION_ID": subscription_id}
+        x = await self.submit_request({hosted_service.ep_ref_addr},
+                                      "ws-eventing__unsubscribe.xml",
+                                      fields_map)
+        return False if wsd_common.check_fault(x) else True
+
+    async def wsd_renew(self,
+                        hosted_service: wsd_transfer__structures.HostedService,
+                        subscription_id: str,
+                        expiration: typing.Union[datetime, timedelta] = None) \
+            -> bool:
+        """
+        See wsd_eventing__operations.wsd_renew()
+        """
+        fields_map = {"FROM": wsd_globals.urn,
+                      "TO": hosted_service.ep_ref_addr,
+                      "SUBSCRIPTION_ID": subscription_id,
+                      "EXPIRES": expiration}
+        x = await self.submit_request({hosted_service.ep_ref_addr},
+                                      "ws-eventing__renew.xml",
+                                      fields_map)
+        return False if wsd_common.check_fault(x) else True
+
+    async def wsd_get_status(self,
+                             hosted_service: wsd_transfer__structures.HostedService,
+                             subscription_id: str) \
+            -> typing.Union[None, bool, datetime]:
+        """
+        See wsd_eventing__operations.wsd_get_status()
+        """
+        fields_map = {"FROM": wsd_globals.urn,
+                      "TO": hosted_service.ep_ref_addr,
+                      "SUBSCRIPTION_ID": subscription_id}
+        x = await self.submit_request({hosted_service.ep_ref_addr},
+                                      "ws-eventing__get_status.xml",
+                                      fields_map)
+        return wsd_eventing__operations.parse_get_status_response(x)
+
+
+def __demo():
+    from PyWSD import wsd_discovery__operations
+
+    async def query_all(targets):
+        client = AsyncClient()
+        results = await asyncio.gather(*[client.wsd_get(t) for t in targets], return_exceptions=True)
+        for t, res in zip(targets, results):
+            print(t)
+            if isinstance(res, Exception):
+                print("The target did not reply")
+            else:
+                print(res[0])
+
+    tsl = list(wsd_discovery__operations.get_devices())
+    asyncio.get_event_loop().run_until_complete(query_all(tsl))
+
+
+if __name__ == "__main__":
+    __demo()
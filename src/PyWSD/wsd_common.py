@@ -4,6 +4,7 @@
 import datetime
 import os
 import random
+import threading
 import time
 import typing
 import uuid
@@ -11,7 +12,10 @@ import uuid
 import lxml.etree as etree
 import requests
 
-from PyWSD import wsd_globals
+from PyWSD import wsd_dedup, \
+    wsd_globals, \
+    wsd_templates, \
+    wsd_transport
 
 NSMAP = {"soap": "http://www.w3.org/2003/05/soap-envelope",
          "mex": "http://schemas.xmlsoap.org/ws/2004/09/mex",
@@ -42,12 +46,12 @@ def gen_urn() \
     return "urn:uuid:" + str(uuid.uuid4())
 
 
-# TODO: replace dumb text substitution with xml tree manipulation
 def message_from_file(fname: str,
                       **kwargs) \
         -> str:
     """
     Loads an XML template file, minifies it, and fills it with values passed in the kwargs map.
+    Templates are compiled once and cached, see wsd_templates.load_template().
 
     :param fname: the path of the file to load
     :type fname: str
@@ -55,13 +59,27 @@ def message_from_file(fname: str,
     :return: a string representation of the processed xml file
     :rtype: str
     """
-    req = ''.join([l.strip() + ' ' for l in open(fname).readlines()]) \
-        .replace('\n', '') \
-        .replace('\r', '')
-    for k in kwargs:
-        req = req.replace('{{' + k + '}}', str(kwargs[k]))
-    req = req.replace('{{MSG_ID}}', gen_urn())
-    return req
+    return wsd_templates.load_template(fname).render({**kwargs, "MSG_ID": gen_urn()}).decode("UTF-8")
+
+
+def render_template(xml_template: str,
+                    fields_map: typing.Dict[str, typing.Any]) \
+        -> bytes:
+    """
+    Fills one of the XML templates shipped with the library, and returns the message ready to be sent.
+    A fresh message id is generated, unless one is provided in the fields map as MSG_ID.
+
+    :param xml_template: the *name* of the template file to use, as found in the templates folder
+    :type xml_template: str
+    :param fields_map: the dictionary containing the values needed to fill the loaded XML template
+    :type fields_map: {str: any}
+    :return: the encoded message
+    :rtype: bytes
+    """
+    t = wsd_templates.load_template(abs_path("templates/%s" % xml_template))
+    if "MSG_ID" not in fields_map:
+        fields_map = {**fields_map, "MSG_ID": gen_urn()}
+    return t.render(fields_map)
 
 
 def indent(text: str) \
@@ -90,17 +108,17 @@ def abs_path(relpath: str) \
 
 
 def soap_post_unicast(addr: str,
-                      data: str) \
-        -> typing.Union[str, None]:
+                      data: bytes) \
+        -> typing.Union[bytes, None]:
     """
-    Send a SOAP message as an HTTP POST request.
+    Send a SOAP message as an HTTP POST request, over a persistent connection to the device.
     Implements the retry mechanism specified in the SOAP-over-UDP specification.
     :param addr: the address to send the message to
     :type addr: str
     :param data: the message content
-    :type data: str
+    :type data: bytes
     :return: the reply message, if any
-    :rtype: str | None
+    :rtype: bytes | None
     """
     min_delay = 50
     max_delay = 250
@@ -110,7 +128,7 @@ def soap_post_unicast(addr: str,
         t = random.uniform(min_delay, max_delay)
         while repeat:
             try:
-                return requests.post(addr, headers=headers, data=data, timeout=2).content
+                return wsd_transport.post(addr, data, headers=headers, timeout=2).content
             except requests.Timeout:
                 time.sleep(t / 1000.0)
                 t = t * 2 if t * 2 < upper_delay else upper_delay
@@ -127,7 +145,7 @@ def submit_request(addrs: typing.Set[str],
     """
     Send a wsd xml/soap request to the specified device, and wait for response.
     Multiple addresses could be provided: the message will be sent to each one until
-    the device replies.
+    the device replies, or raced across all of them (see wsd_transport.set_dispatch_mode()).
 
     :param addrs: the addresses of the wsd service
     :type addrs: {str}
@@ -140,18 +158,22 @@ def submit_request(addrs: typing.Set[str],
     :rtype: lxml.etree.ElementTree
     """
     op_name = " ".join(xml_template.split("__")[1].split(".")[0].split("_")).upper()
-    data = message_from_file(abs_path("templates/%s" % xml_template), **fields_map)
+    data = render_template(xml_template, fields_map)
 
     if wsd_globals.debug:
-        r = etree.fromstring(data.encode("ASCII"), parser=parser)
+        r = etree.fromstring(data, parser=parser)
         print('##\n## %s REQUEST\n##\n' % op_name)
         log_xml(r)
         print(etree.tostring(r, pretty_print=True, xml_declaration=True).decode("ASCII"))
 
-    for addr in addrs:
-        # TODO: handle ipv6 link-local addresses, remember to specify interface in URI
-        # requests.post('http://[fe80::4aba:4eff:fec9:3d84%wlp3s0]:3911/', ...)
-        r = soap_post_unicast(addr, data)
+    # TODO: handle ipv6 link-local addresses, remember to specify interface in URI
+    # requests.post('http://[fe80::4aba:4eff:fec9:3d84%wlp3s0]:3911/', ...)
+    if wsd_transport.dispatcher is not None:
+        replies = [wsd_transport.dispatcher.dispatch(addrs, lambda a: soap_post_unicast(a, data))]
+    else:
+        replies = (soap_post_unicast(addr, data) for addr in addrs)
+
+    for r in replies:
         if r is None:
             continue
 
@@ -193,12 +215,94 @@ def check_fault(x: etree.ElementTree) \
         return False
 
 
+class QueryRegistry:
+    """
+    Compiles the XPath queries used by xml_find() and xml_findall() once, instead of parsing the path again
+    on every lookup. Compiled queries are kept per thread, since lxml XPath objects shouldn't be shared.
+    When profiling is enabled, the number of executions and the time spent are recorded for each query.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.profiling = False
+        self.stats = {}  # query -> [hits, seconds]
+        self.lock = threading.Lock()
+
+    def compile(self,
+                query: str) \
+            -> etree.XPath:
+        """
+        :param query: the XPath query, using the prefixes in NSMAP
+        :type query: str
+        :return: the compiled query
+        :rtype: lxml.etree.XPath
+        """
+        try:
+            compiled = self.local.compiled
+        except AttributeError:
+            compiled = self.local.compiled = {}
+        xp = compiled.get(query)
+        if xp is None:
+            xp = compiled[query] = etree.XPath(query, namespaces=NSMAP)
+        return xp
+
+    def run(self,
+            xml_tree: etree.ElementTree,
+            query: str) \
+            -> typing.List[etree.ElementTree]:
+        """
+        Execute a query against an element.
+
+        :param xml_tree: the etree element to search in
+        :type xml_tree: lxml.etree.ElementTree
+        :param query: the XPath query
+        :type query: str
+        :return: the list of matching elements
+        :rtype: [lxml.etree.ElementTree]
+        """
+        xp = self.compile(query)
+        if not self.profiling:
+            return xp(xml_tree)
+        start = time.perf_counter()
+        r = xp(xml_tree)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            st = self.stats.setdefault(query, [0, 0.0])
+            st[0] += 1
+            st[1] += elapsed
+        return r
+
+    def enable_profiling(self,
+                         status: bool = True) \
+            -> None:
+        self.profiling = status
+
+    def reset_stats(self) \
+            -> None:
+        with self.lock:
+            self.stats.clear()
+
+    def report(self) \
+            -> typing.List[typing.Tuple[str, int, float]]:
+        """
+        :return: a (query, hits, seconds) tuple for each query executed while profiling, slowest first
+        :rtype: [(str, int, float)]
+        """
+        with self.lock:
+            r = [(q, st[0], st[1]) for q, st in self.stats.items()]
+        return sorted(r, key=lambda e: e[2], reverse=True)
+
+
+queries = QueryRegistry()
+
+
 def xml_find(xml_tree: etree.ElementTree,
              query: str) \
         -> typing.Union[etree.ElementTree, None]:
     """
     Wrapper for etree.find() method. When parsing wsd xml/soap messages, you should use this wrapper,
     because it encapsulates all the xml namespaces needed and avoids coding errors.
+    Queries are compiled once, see QueryRegistry.
 
     :param xml_tree: the etree element to search in
     :type xml_tree: lxml.etree.ElementTree
@@ -207,7 +311,8 @@ def xml_find(xml_tree: etree.ElementTree,
     :return: the searched etree if found, or None otherwise
     :rtype: lxml.etree.ElementTree | None
     """
-    return xml_tree.find(query, NSMAP)
+    r = queries.run(xml_tree, query)
+    return r[0] if r else None
 
 
 def xml_findall(xml_tree: etree.ElementTree,
@@ -216,6 +321,7 @@ def xml_findall(xml_tree: etree.ElementTree,
     """
     Wrapper for etree.findall() method. When parsing wsd xml/soap messages, you should use this wrapper,
     because it encapsulates all the xml namespaces needed and avoids coding errors.
+    Queries are compiled once, see QueryRegistry.
 
     :param xml_tree: the etree element to search in
     :type xml_tree: lxml.etree.ElementTree
@@ -224,7 +330,7 @@ def xml_findall(xml_tree: etree.ElementTree,
     :return: a list of searched etrees if found, or None otherwise
     :rtype: lxml.etree.ElementTree | None
     """
-    return xml_tree.findall(query, NSMAP)
+    return queries.run(xml_tree, query)
 
 
 def get_xml_str(xml_tree: etree.ElementTree,
@@ -384,12 +490,7 @@ def record_message_id(msg_id: str) \
     :return: True if the message is not a duplicate, False otherwise.
     :rtype: bool
     """
-    if msg_id in wsd_globals.last_msg_ids:
-        return False
-    wsd_globals.last_msg_ids[wsd_globals.last_msg_idx] = msg_id
-    wsd_globals.last_msg_idx += 1
-    wsd_globals.last_msg_idx %= len(wsd_globals.last_msg_ids)
-    return True
+    return wsd_dedup.message_ids.record(msg_id)
 
 
 def log_xml(xml_tree: etree.ElementTree) \
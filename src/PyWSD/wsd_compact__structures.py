@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Memory-compact variants of the structure classes, meant for registries holding tens of thousands of targets.
+# Instances use __slots__ instead of a __dict__, store their collections as frozensets or tuples, and share
+# both the URI strings and the collections themselves through an interning table, since most targets on a
+# network publish the very same types and scopes.
+# They expose the same attributes, so they can be printed, compared, hashed and pickled like the originals;
+# collections are read-only, but can be replaced by assigning a new iterable.
+
+import threading
+import typing
+
+from PyWSD import wsd_discovery__structures, \
+    wsd_scan__structures, \
+    wsd_transfer__structures
+
+
+class InternTable:
+    """
+    Maps every string, frozenset or tuple to a single shared instance equal to it.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self,
+               value: typing.Hashable) \
+            -> typing.Hashable:
+        v = self.values.get(value)
+        if v is None:
+            with self.lock:
+                v = self.values.setdefault(value, value)
+        return v
+
+    def frozenset(self,
+                  items: typing.Iterable[str]) \
+            -> typing.FrozenSet[str]:
+        return self.intern(frozenset(self.intern(i) for i in items))
+
+    def tuple(self,
+              items: typing.Iterable[str]) \
+            -> typing.Tuple[str, ...]:
+        return self.intern(tuple(self.intern(i) for i in items))
+
+    def clear(self) \
+            -> None:
+        with self.lock:
+            self.values.clear()
+
+
+uris = InternTable()
+
+
+class Slotted:
+    """
+    Base class providing pickling support for the slotted structures below.
+    Subclasses list their public attributes in fields; collection attributes are properties backed by
+    an underscore-prefixed slot, and are converted when assigned.
+    """
+
+    __slots__ = ()
+    fields = ()
+
+    def __getstate__(self):
+        return {f: getattr(self, f) for f in self.fields}
+
+    def __setstate__(self, state):
+        for f, v in state.items():
+            setattr(self, f, v)
+
+
+def interned_frozenset(name: str) \
+        -> property:
+    slot = "_" + name
+
+    def getter(self):
+        return getattr(self, slot)
+
+    def setter(self, value):
+        object.__setattr__(self, slot, uris.frozenset(value))
+
+    return property(getter, setter)
+
+
+def frozen_set(name: str) \
+        -> property:
+    """
+    Like interned_frozenset(), for values unique to each instance, such as transport addresses, which would
+    only grow the interning table.
+    """
+    slot = "_" + name
+
+    def getter(self):
+        return getattr(self, slot)
+
+    def setter(self, value):
+        object.__setattr__(self, slot, frozenset(value))
+
+    return property(getter, setter)
+
+
+def interned_tuple(name: str) \
+        -> property:
+    slot = "_" + name
+
+    def getter(self):
+        return getattr(self, slot)
+
+    def setter(self, value):
+        object.__setattr__(self, slot, uris.tuple(value))
+
+    return property(getter, setter)
+
+
+def interned_str(name: str) \
+        -> property:
+    slot = "_" + name
+
+    def getter(self):
+        return getattr(self, slot)
+
+    def setter(self, value):
+        object.__setattr__(self, slot, uris.intern(value) if value is not None else None)
+
+    return property(getter, setter)
+
+
+class TargetService(Slotted):
+    """
+    Compact counterpart of wsd_discovery__structures.TargetService.
+    """
+
+    __slots__ = ("ep_ref_addr", "_types", "_scopes", "_xaddrs", "meta_ver")
+    fields = ("ep_ref_addr", "types", "scopes", "xaddrs", "meta_ver")
+
+    types = interned_frozenset("types")
+    scopes = interned_frozenset("scopes")
+    xaddrs = frozen_set("xaddrs")
+
+    def __init__(self):
+        self.ep_ref_addr = ""
+        self.types = ()
+        self.scopes = ()
+        self.xaddrs = ()
+        self.meta_ver = 0
+
+    __str__ = wsd_discovery__structures.TargetService.__str__
+    __eq__ = wsd_discovery__structures.TargetService.__eq__
+    __hash__ = wsd_discovery__structures.TargetService.__hash__
+
+
+class TargetInfo(Slotted):
+    """
+    Compact counterpart of wsd_transfer__structures.TargetInfo.
+    """
+
+    __slots__ = ("_manufacturer", "manufacturer_url", "_model_name", "model_number", "model_url",
+                 "presentation_url", "_device_cat", "friendly_name", "fw_ver", "serial_num")
+    fields = ("manufacturer", "manufacturer_url", "model_name", "model_number", "model_url",
+              "presentation_url", "device_cat", "friendly_name", "fw_ver", "serial_num")
+
+    manufacturer = interned_str("manufacturer")
+    model_name = interned_str("model_name")
+    device_cat = interned_tuple("device_cat")
+
+    def __init__(self):
+        self.manufacturer = ""
+        self.manufacturer_url = ""
+        self.model_name = ""
+        self.model_number = ""
+        self.model_url = ""
+        self.presentation_url = ""
+        self.device_cat = ()
+        self.friendly_name = ""
+        self.fw_ver = ""
+        self.serial_num = ""
+
+    __str__ = wsd_transfer__structures.TargetInfo.__str__
+
+
+class HostedService(Slotted):
+    """
+    Compact counterpart of wsd_transfer__structures.HostedService.
+    """
+
+    __slots__ = ("_types", "service_id", "hardware_id", "compatible_id", "service_address", "ep_ref_addr")
+    fields = ("types", "service_id", "hardware_id", "compatible_id", "service_address", "ep_ref_addr")
+
+    types = interned_tuple("types")
+
+    def __init__(self):
+        self.types = ()
+        self.service_id = ""
+        self.hardware_id = ""
+        self.compatible_id = ""
+        self.service_address = ""
+        self.ep_ref_addr = ""
+
+    __str__ = wsd_transfer__structures.HostedService.__str__
+
+
+class ScanJob(Slotted):
+    """
+    Compact counterpart of wsd_scan__structures.ScanJob.
+    """
+
+    __slots__ = ("id", "token", "f_pixel_line", "f_num_lines", "f_byte_line",
+                 "b_pixel_line", "b_num_lines", "b_byte_line", "doc_params")
+    fields = __slots__
+
+    def __init__(self):
+        self.id = 0
+        self.token = ""
+        self.f_pixel_line = 0
+        self.f_num_lines = 0
+        self.f_byte_line = 0
+        self.b_pixel_line = None
+        self.b_num_lines = None
+        self.b_byte_line = None
+        self.doc_params = None
+
+    __str__ = wsd_scan__structures.ScanJob.__str__
+
+
+class JobStatus(Slotted):
+    """
+    Compact counterpart of wsd_scan__structures.JobStatus.
+    """
+
+    __slots__ = ("id", "_state", "_reasons", "scans_completed", "creation_time", "completed_time")
+    fields = ("id", "state", "reasons", "scans_completed", "creation_time", "completed_time")
+
+    state = interned_str("state")
+    reasons = interned_tuple("reasons")
+
+    def __init__(self):
+        self.id = 0
+        self.state = ""
+        self.reasons = ()
+        self.scans_completed = 0
+        self.creation_time = ""
+        self.completed_time = ""
+
+    __str__ = wsd_scan__structures.JobStatus.__str__
+
+
+counterparts = {wsd_discovery__structures.TargetService: TargetService,
+                wsd_transfer__structures.TargetInfo: TargetInfo,
+                wsd_transfer__structures.HostedService: HostedService,
+                wsd_scan__structures.ScanJob: ScanJob,
+                wsd_scan__structures.JobStatus: JobStatus}
+
+
+def compact(obj):
+    """
+    Build the compact counterpart of a structure instance, copying all of its attributes.
+
+    :param obj: an instance of one of the supported structure classes, or an already compact one
+    :return: the compact instance
+    :raises TypeError: if the class of the object has no compact counterpart
+    """
+    if isinstance(obj, Slotted):
+        return obj
+    cls = counterparts.get(type(obj))
+    if cls is None:
+        raise TypeError("no compact variant for %s" % type(obj).__name__)
+    o = cls.__new__(cls)
+    for f in cls.fields:
+        setattr(o, f, getattr(obj, f))
+    return o
+
+
+def __benchmark():
+    import gc
+    import tracemalloc
+    import uuid
+
+    type_pool = [["wsdp:Device", "wscn:ScanDeviceType", "wprt:PrintDeviceType"],
+                 ["wsdp:Device", "wprt:PrintDeviceType"],
+                 ["wsdp:Device", "wscn:ScanDeviceType"]]
+    scope_pool = [["http://schemas.microsoft.com/windows/2006/08/wdp/print/default",
+                   "http://schemas.xmlsoap.org/ws/2005/04/discovery/ldap:///ou=floor%d,o=example" % i]
+                  for i in range(20)]
+
+    def make(i: int):
+        o = wsd_discovery__structures.TargetService()
+        o.ep_ref_addr = "urn:uuid:" + str(uuid.UUID(int=i))
+        # strings are built at runtime, as a parser would produce them, so none of them is shared yet
+        o.types = set("".join(list(t)) for t in type_pool[i % len(type_pool)])
+        o.scopes = set("".join(list(s)) for s in scope_pool[i % len(scope_pool)])
+        o.xaddrs = {"http://10.%d.%d.%d:5357/%s" % (i >> 16 & 255, i >> 8 & 255, i & 255, o.ep_ref_addr[9:])}
+        o.meta_ver = 1
+        return o
+
+    def measure(n: int, build):
+        gc.collect()
+        tracemalloc.start()
+        registry = build(n)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(registry) == n
+        return size
+
+    for n in (10000, 100000):
+        uris.clear()
+        plain = measure(n, lambda k: {make(i) for i in range(k)})
+        uris.clear()
+        small = measure(n, lambda k: {compact(make(i)) for i in range(k)})
+        print("%6d targets: plain %7.1f MiB, compact %7.1f MiB (%.0f%%), %d interned values"
+              % (n, plain / 2 ** 20, small / 2 ** 20, 100 * small / plain, len(uris)))
+
+
+if __name__ == "__main__":
+    __benchmark()
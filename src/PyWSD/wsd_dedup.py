@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Detection of duplicate and out-of-date messages. Multicast messages are repeated on purpose by SOAP-over-UDP,
+# and travel through different interfaces, so the same message can be received several times, and late.
+
+import collections
+import threading
+import typing
+
+
+class MessageIdFilter:
+    """
+    Remembers the last capacity message ids received, evicting the oldest first.
+    Lookups and updates take constant time, and are safe to perform from many threads.
+    """
+
+    def __init__(self,
+                 capacity: int = 4096):
+        self.capacity = capacity
+        self.ids = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, msg_id):
+        return msg_id in self.ids
+
+    def record(self,
+               msg_id: str) \
+            -> bool:
+        """
+        Checks if the specified message is a duplicate, and records the id if not.
+
+        :param msg_id: the WSA message id to check
+        :type msg_id: str
+        :return: True if the message is not a duplicate, False otherwise.
+        :rtype: bool
+        """
+        with self.lock:
+            if msg_id in self.ids:
+                return False
+            self.ids[msg_id] = None
+            if len(self.ids) > self.capacity:
+                self.ids.popitem(last=False)
+            return True
+
+    def clear(self) \
+            -> None:
+        with self.lock:
+            self.ids.clear()
+
+
+class AppSequenceTracker:
+    """
+    Keeps the last AppSequence seen from each endpoint, to drop messages older than one already processed.
+    A message is current if its InstanceId is greater than the recorded one (the device restarted), or if it
+    has the same InstanceId and a greater MessageNumber within the same SequenceId.
+    The least recently updated endpoints are forgotten first when more than capacity are tracked.
+    """
+
+    def __init__(self,
+                 capacity: int = 65536):
+        self.capacity = capacity
+        self.endpoints = collections.OrderedDict()  # endpoint -> (InstanceId, {SequenceId: MessageNumber})
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def accept(self,
+               endpoint: str,
+               app_sequence: typing.Sequence[int]) \
+            -> bool:
+        """
+        Checks if a message is more recent than the ones already received from the same endpoint,
+        and records its sequence if so.
+
+        :param endpoint: the endpoint reference address of the sender
+        :type endpoint: str
+        :param app_sequence: the [InstanceId, SequenceId, MessageNumber] of the message, \
+        as returned by wsd_discovery__parsers.get_sequence()
+        :type app_sequence: [int]
+        :return: True if the message is current, False if it is stale, repeated or reordered.
+        :rtype: bool
+        """
+        instance, sequence, number = app_sequence
+        with self.lock:
+            known = self.endpoints.get(endpoint)
+            if known is None or instance > known[0]:
+                known = (instance, {})
+                self.endpoints[endpoint] = known
+            elif instance < known[0]:
+                return False
+            else:
+                last = known[1].get(sequence)
+                if last is not None and number <= last:
+                    return False
+            known[1][sequence] = number
+            self.endpoints.move_to_end(endpoint)
+            if len(self.endpoints) > self.capacity:
+                self.endpoints.popitem(last=False)
+            return True
+
+    def forget(self,
+               endpoint: str) \
+            -> None:
+        with self.lock:
+            self.endpoints.pop(endpoint, None)
+
+    def clear(self) \
+            -> None:
+        with self.lock:
+            self.endpoints.clear()
+
+
+message_ids = MessageIdFilter()
+sequences = AppSequenceTracker()
+
+
+def configure(capacity: int = 4096,
+              endpoints: int = 65536) \
+        -> None:
+    """
+    Replace the shared filters with empty ones of the given sizes.
+
+    :param capacity: the number of message ids remembered
+    :type capacity: int
+    :param endpoints: the number of endpoints whose AppSequence is tracked
+    :type endpoints: int
+    """
+    global message_ids, sequences
+    message_ids = MessageIdFilter(capacity)
+    sequences = AppSequenceTracker(endpoints)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Inverted indexes over discovered targets, answering type and scope queries without scanning every target.
+# Each type maps to the targets implementing it. Each scope maps to the targets it matches according to the
+# matching rules of WS-Discovery (section 5.1):
+#  - strcmp0: the probe scope is equal to a target scope, compared case-sensitively;
+#  - RFC 3986: scheme and authority are equal, case-insensitively, and the segments of the probe scope path
+#    are a prefix of the segments of a target scope path. A target scope is therefore indexed under
+#    every prefix of its path, so that a probe scope is looked up in a single step.
+# Types are compared as the QName labels reported by the devices, as in the rest of the library.
+
+import threading
+import typing
+import urllib.parse
+
+from PyWSD import wsd_discovery__structures
+
+MATCH_BY_RFC3986 = "http://schemas.xmlsoap.org/ws/2005/04/discovery/rfc3986"
+MATCH_BY_STRCMP0 = "http://schemas.xmlsoap.org/ws/2005/04/discovery/strcmp0"
+
+
+def rfc3986_key(scope: str) \
+        -> typing.Union[typing.Tuple[str, str, typing.Tuple[str, ...]], None]:
+    """
+    :param scope: a scope URI
+    :type scope: str
+    :return: the (scheme, authority, path segments) of the scope, normalized for comparison, \
+    or None if it is not a valid absolute URI or has a query or fragment
+    :rtype: (str, str, (str, ...)) | None
+    """
+    try:
+        u = urllib.parse.urlsplit(scope)
+    except ValueError:
+        return None
+    if not u.scheme or u.query or u.fragment:
+        return None
+    segments = tuple(urllib.parse.unquote(s) for s in u.path.split("/") if s)
+    if "." in segments or ".." in segments:
+        return None
+    return u.scheme.lower(), u.netloc.lower(), segments
+
+
+def rfc3986_prefixes(scope: str) \
+        -> typing.List[typing.Tuple[str, str, typing.Tuple[str, ...]]]:
+    """
+    :return: the keys of every probe scope matching the scope, according to the RFC 3986 rule
+    :rtype: [(str, str, (str, ...))]
+    """
+    key = rfc3986_key(scope)
+    if key is None:
+        return []
+    scheme, authority, segments = key
+    return [(scheme, authority, segments[:i]) for i in range(len(segments) + 1)]
+
+
+class TargetIndex:
+    """
+    Targets indexed by type and scope, updated incrementally as announcements and probe matches arrive.
+    Lookups cost one dictionary access per type or scope queried, plus the intersection of the results.
+    """
+
+    def __init__(self):
+        self.targets = {}  # endpoint address -> TargetService
+        self.by_type = {}  # type -> {endpoint address}
+        self.by_scope = {}  # strcmp0 scope -> {endpoint address}
+        self.by_scope_prefix = {}  # RFC 3986 key -> {endpoint address}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __contains__(self, addr):
+        return addr in self.targets
+
+    def get(self,
+            addr: str) \
+            -> typing.Union[wsd_discovery__structures.TargetService, None]:
+        return self.targets.get(addr)
+
+    def add(self,
+            t: wsd_discovery__structures.TargetService) \
+            -> typing.Union[wsd_discovery__structures.TargetService, None]:
+        """
+        Index a target, replacing the one with the same endpoint address, if any.
+
+        :param t: the target to index
+        :type t: wsd_discovery__structures.TargetService
+        :return: the target replaced, if any
+        :rtype: wsd_discovery__structures.TargetService | None
+        """
+        with self.lock:
+            old = self.remove(t.ep_ref_addr)
+            addr = t.ep_ref_addr
+            self.targets[addr] = t
+            # the types and scopes of a target are optional, and may be None rather than empty
+            for k in t.types or ():
+                self.by_type.setdefault(k, set()).add(addr)
+            for scope in t.scopes or ():
+                self.by_scope.setdefault(scope, set()).add(addr)
+                for k in rfc3986_prefixes(scope):
+                    self.by_scope_prefix.setdefault(k, set()).add(addr)
+            return old
+
+    def update(self,
+               targets: typing.Iterable[wsd_discovery__structures.TargetService]) \
+            -> None:
+        with self.lock:
+            for t in targets:
+                self.add(t)
+
+    def remove(self,
+               addr: str) \
+            -> typing.Union[wsd_discovery__structures.TargetService, None]:
+        """
+        :param addr: the endpoint address of the target to drop
+        :type addr: str
+        :return: the target removed, if any
+        :rtype: wsd_discovery__structures.TargetService | None
+        """
+        with self.lock:
+            t = self.targets.pop(addr, None)
+            if t is None:
+                return None
+            self.discard(self.by_type, t.types or (), addr)
+            self.discard(self.by_scope, t.scopes or (), addr)
+            self.discard(self.by_scope_prefix, [k for s in t.scopes or () for k in rfc3986_prefixes(s)], addr)
+            return t
+
+    @staticmethod
+    def discard(index: dict,
+                keys: typing.Iterable,
+                addr: str) \
+            -> None:
+        for k in keys:
+            addrs = index.get(k)
+            if addrs is not None:
+                addrs.discard(addr)
+                if not addrs:
+                    del index[k]
+
+    def clear(self) \
+            -> None:
+        with self.lock:
+            self.targets.clear()
+            self.by_type.clear()
+            self.by_scope.clear()
+            self.by_scope_prefix.clear()
+
+    def lookup_addrs(self,
+                     types: typing.Iterable[str] = None,
+                     scopes: typing.Iterable[str] = None,
+                     match_by: str = MATCH_BY_RFC3986,
+                     any_type: bool = False) \
+            -> typing.Set[str]:
+        """
+        :return: the endpoint addresses of the targets matching, see lookup()
+        :rtype: {str}
+        """
+        with self.lock:
+            sets = []
+            if types:
+                if any_type:
+                    matching = set()
+                    for k in types:
+                        matching |= self.by_type.get(k, set())
+                    sets.append(matching)
+                else:
+                    sets.extend(self.by_type.get(k, set()) for k in types)
+            if scopes:
+                if match_by == MATCH_BY_STRCMP0:
+                    sets.extend(self.by_scope.get(s, set()) for s in scopes)
+                elif match_by == MATCH_BY_RFC3986:
+                    for s in scopes:
+                        k = rfc3986_key(s)
+                        sets.append(self.by_scope_prefix.get(k, set()) if k is not None else set())
+                else:
+                    raise ValueError("unsupported scope matching rule %s" % match_by)
+            if not sets:
+                return set(self.targets)
+            # intersect starting from the smallest set
+            sets.sort(key=len)
+            result = set(sets[0])
+            for s in sets[1:]:
+                if not result:
+                    break
+                result &= s
+            return result
+
+    def lookup(self,
+               types: typing.Iterable[str] = None,
+               scopes: typing.Iterable[str] = None,
+               match_by: str = MATCH_BY_RFC3986,
+               any_type: bool = False) \
+            -> typing.Set[wsd_discovery__structures.TargetService]:
+        """
+        Find the targets matching a probe, as a device would decide whether to reply to it.
+
+        :param types: the types to match: a target must implement all of them, or any of them if any_type is True
+        :type types: iterable of str
+        :param scopes: the scopes a target must match, all of them
+        :type scopes: iterable of str
+        :param match_by: the scope matching rule, MATCH_BY_RFC3986 or MATCH_BY_STRCMP0
+        :type match_by: str
+        :param any_type: True to match targets implementing at least one of the types
+        :type any_type: bool
+        :return: the targets matching
+        :rtype: {wsd_discovery__structures.TargetService}
+        :raises ValueError: if the matching rule is not supported
+        """
+        with self.lock:
+            return {self.targets[a] for a in self.lookup_addrs(types, scopes, match_by, any_type)}
+
+
+def __benchmark():
+    import random
+    import time
+
+    index = TargetIndex()
+    types = ["wscn:ScanDeviceType", "wprt:PrintDeviceType", "wsdp:Device"]
+    for i in range(50000):
+        t = wsd_discovery__structures.TargetService()
+        t.ep_ref_addr = "urn:uuid:%08d" % i
+        t.types = {"wsdp:Device", random.choice(types[:2])}
+        t.scopes = {"ldap:///ou=site%d/ou=floor%d" % (i % 50, i % 7), "urn:building-%d" % (i % 20)}
+        index.add(t)
+    # devices may announce no scope, or no type at all
+    for i in range(50000, 50010):
+        t = wsd_discovery__structures.TargetService()
+        t.ep_ref_addr = "urn:uuid:%08d" % i
+        t.types = {"wscn:ScanDeviceType"}
+        t.scopes = None if i % 2 else set()
+        index.add(t)
+
+    def run(name, f, n=2000):
+        start = time.perf_counter()
+        for _ in range(n):
+            r = f()
+        print("%-40s %8.1f us, %d targets" % (name, (time.perf_counter() - start) / n * 1e6, len(r)))
+
+    run("type + scope prefix (addresses)", lambda: index.lookup_addrs(["wscn:ScanDeviceType"],
+                                                                      ["ldap:///ou=site3/ou=floor3"]))
+    run("two scopes, strcmp0 (addresses)", lambda: index.lookup_addrs(None, ["urn:building-3",
+                                                                             "ldap:///ou=site3/ou=floor3"],
+                                                                      MATCH_BY_STRCMP0))
+    run("scope prefix (targets)", lambda: index.lookup(None, ["ldap:///ou=site3"]))
+    run("linear scan, type + scope prefix",
+        lambda: {t for t in index.targets.values()
+                 if "wscn:ScanDeviceType" in t.types and "ldap:///ou=site3/ou=floor3" in (t.scopes or ())}, 20)
+
+
+if __name__ == "__main__":
+    __benchmark()
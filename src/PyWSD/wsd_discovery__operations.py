@@ -1,17 +1,23 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
 
+import concurrent.futures
 import os
 import pickle
+import random
 import select
 import socket
 import sqlite3
 import struct
+import time
 import typing
+import urllib.parse
 
 import lxml.etree as etree
 
 from PyWSD import wsd_common, \
+    wsd_dedup, \
+    wsd_discovery__index, \
     wsd_discovery__structures, \
     wsd_transfer__operations, \
     wsd_globals
@@ -24,6 +30,18 @@ wsd_udp_port = 3702
 
 db_path = os.environ.get("WSD_CACHE_PATH", "")
 
+DB_SCHEMA_VERSION = 2
+# the cache needs SQLite 3.24 for upserts; RETURNING, which saves a query per target, came with 3.35
+DB_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+last_probe_stats = None  # ProbeStats of the last wsd_probe()
+
+# retransmission parameters of multicast messages, from the SOAP-over-UDP specification (seconds)
+MULTICAST_UDP_REPEAT = 4
+UDP_MIN_DELAY = 0.050
+UDP_MAX_DELAY = 0.250
+UDP_UPPER_DELAY = 0.500
+
 
 def send_multicast_soap_msg(xml_template: str,
                             fields_map: typing.Dict[str, str],
@@ -41,24 +59,52 @@ def send_multicast_soap_msg(xml_template: str,
     :return: the socket use for message delivery
     :rtype: socket.socket
     """
-    message = wsd_common.message_from_file(wsd_common.abs_path("templates/%s" % xml_template),
-                                           **fields_map)
+    sock = open_multicast_send_socket(timeout)
+    send_multicast_message(sock, xml_template, fields_map)
+    return sock
 
-    op_name = " ".join(xml_template.split("__")[1].split(".")[0].split("_")).upper()
 
+def open_multicast_send_socket(timeout: typing.Union[float, None]) \
+        -> socket.socket:
+    """
+    Open a socket suitable to send multicast requests and receive their replies.
+
+    :param timeout: the timeout of the socket
+    :type timeout: float | None
+    :return: the socket opened
+    :rtype: socket.socket
+    """
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.settimeout(timeout)
     ttl = struct.pack('b', 1)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    return sock
+
+
+def send_multicast_message(sock: socket.socket,
+                           xml_template: str,
+                           fields_map: typing.Dict[str, str]) \
+        -> None:
+    """
+    Fill a wsd xml/soap template and send it to the multicast group through an open socket.
+
+    :param sock: the socket to send the message from
+    :type sock: socket.socket
+    :param xml_template: the name of the xml template to fill and send
+    :type xml_template: str
+    :param fields_map: the map of placeholders and strings to substitute inside the template
+    :type fields_map: {str: str}
+    """
+    message = wsd_common.render_template(xml_template, fields_map)
 
     if wsd_globals.debug:
-        r = etree.fromstring(message.encode("ASCII"), parser=wsd_common.parser)
+        op_name = " ".join(xml_template.split("__")[1].split(".")[0].split("_")).upper()
+        r = etree.fromstring(message, parser=wsd_common.parser)
         print('##\n## %s\n##\n' % op_name)
         wsd_common.log_xml(r)
         print(etree.tostring(r, pretty_print=True, xml_declaration=True).decode("ASCII"))
-    sock.sendto(message.encode("UTF-8"), (wsd_mcast_v4, wsd_udp_port))
-    return sock
+    sock.sendto(message, (wsd_mcast_v4, wsd_udp_port))
 
 
 # FIXME Check if this update mechanism is still needed
@@ -139,32 +185,229 @@ def deinit_multicast_listener(sockets: typing.List[socket.socket]) -> None:
 def listen_multicast_announcements(sockets: typing.List[socket.socket]) \
         -> typing.Tuple[bool, wsd_discovery__structures.TargetService]:
     """
+    Wait for the next Hello or Bye announcement received on the multicast sockets.
+    Duplicates, and announcements older than one already received from the same device, are skipped.
 
+    :param sockets: the sockets returned by init_multicast_listener()
+    :type sockets: [socket.socket]
+    :return: a tuple (True, target) for a Hello, or (False, target) for a Bye
+    :rtype: (bool, wsd_discovery__structures.TargetService)
     """
     empty = []
-    readable = []
-    action = ""
-    while action not in ["http://schemas.xmlsoap.org/ws/2005/04/discovery/Hello",
-                         "http://schemas.xmlsoap.org/ws/2005/04/discovery/Bye"]:
-        while not readable:
-            readable, writable, exceptional = select.select(sockets, empty, empty)
-
+    while True:
+        readable, writable, exceptional = select.select(sockets, empty, empty)
         data, server = readable[0].recvfrom(4096)
+        announcement = parse_announcement(data, server)
+        if announcement is not None:
+            return announcement
+
+
+def parse_announcement(data: bytes,
+                       server: typing.Tuple[str, int]) \
+        -> typing.Union[typing.Tuple[bool, wsd_discovery__structures.TargetService], None]:
+    """
+    Parse a datagram received on a multicast socket.
+
+    :param data: the datagram
+    :type data: bytes
+    :param server: the address of the sender
+    :type server: (str, int)
+    :return: a tuple (True, target) for a Hello, (False, target) for a Bye, or None if the datagram is not \
+    an announcement, or a duplicate, or older than an announcement already received from the same device
+    :rtype: (bool, wsd_discovery__structures.TargetService) | None
+    """
+    try:
         x = etree.fromstring(data)
-        action = wsd_common.get_action_id(x)
-        readable = []
-        if not wsd_common.record_message_id(wsd_common.get_message_id(x)):
-            continue
+    except etree.XMLSyntaxError:
+        return None
+    action = wsd_common.get_action_id(x)
+    if action not in ["http://schemas.xmlsoap.org/ws/2005/04/discovery/Hello",
+                      "http://schemas.xmlsoap.org/ws/2005/04/discovery/Bye"]:
+        return None
+    if not wsd_common.record_message_id(wsd_common.get_message_id(x)):
+        return None
+    msg = wsd_common.parse(x)
+    # drop announcements older than one already received from the same device
+    if not wsd_dedup.sequences.accept(msg.ts.ep_ref_addr, msg.app_sequence):
+        return None
 
     if wsd_globals.debug:
         print('##\n## %s MATCH\n## %s\n##\n' % (action.split("/")[-1].upper(), server[0]))
         wsd_common.log_xml(x)
         print(etree.tostring(x, pretty_print=True, xml_declaration=True).decode("ASCII"))
 
-    if action == "http://schemas.xmlsoap.org/ws/2005/04/discovery/Hello":
-        return True, wsd_common.parse(x).get_target_service()
-    if action == "http://schemas.xmlsoap.org/ws/2005/04/discovery/Bye":
-        return False, wsd_common.parse(x).get_target_service()
+    return action == "http://schemas.xmlsoap.org/ws/2005/04/discovery/Hello", msg.get_target_service()
+
+
+class ProbeStats:
+    """
+    Figures about a probe: how many times it was sent, the replies received and their latencies,
+    measured from the first transmission of the probe.
+    """
+
+    def __init__(self):
+        self.transmissions = 0
+        self.replies = 0
+        self.duplicates = 0
+        self.latencies = []
+        self.elapsed = 0.0
+        self.quiesced = False  # True if collection stopped before the deadline because replies ceased
+
+    def percentile(self,
+                   p: float) \
+            -> typing.Union[float, None]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def __str__(self):
+        s = ""
+        s += "Transmissions:        %d\n" % self.transmissions
+        s += "Replies:              %d (%d duplicates)\n" % (self.replies, self.duplicates)
+        if self.latencies:
+            s += "Latency min/50/95/max: %.3f / %.3f / %.3f / %.3f s\n" % (min(self.latencies),
+                                                                         self.percentile(0.5),
+                                                                         self.percentile(0.95),
+                                                                         max(self.latencies))
+        s += "Elapsed time:         %.3f s%s\n" % (self.elapsed, " (quiesced)" if self.quiesced else "")
+        return s
+
+
+class ProbeCollector:
+    """
+    Sends a Probe, repeating it as SOAP-over-UDP prescribes for multicast messages (the first repetition after
+    a random delay between UDP_MIN_DELAY and UDP_MAX_DELAY, then doubling the delay up to UDP_UPPER_DELAY),
+    and collects the ProbeMatches until the deadline.
+
+    Collection ends earlier once no new target has replied for a quiet period, after the last repetition. The
+    quiet period adapts to the replies seen: it is quiet_factor times the longest gap between the arrival of two
+    consecutive new targets, and never shorter than min_quiet. Without any reply, the whole timeout is waited.
+
+    :param timeout: the number of seconds to wait for replies at most
+    :param type_filter: a set of legal strings, each representing a device class
+    :param min_quiet: the shortest quiet period, in seconds
+    :param quiet_factor: the multiple of the longest gap between replies that makes the quiet period
+    :param repeat: the number of repetitions of the probe after its first transmission
+    :param index: if given, the targets replying are added to this index as they are found
+    """
+
+    def __init__(self,
+                 timeout: float = 3,
+                 type_filter: typing.Set[str] = None,
+                 min_quiet: float = 0.5,
+                 quiet_factor: float = 3.0,
+                 repeat: int = MULTICAST_UDP_REPEAT,
+                 index: wsd_discovery__index.TargetIndex = None):
+        self.index = index
+        self.timeout = timeout
+        self.type_filter = type_filter
+        self.min_quiet = min_quiet
+        self.quiet_factor = quiet_factor
+        self.repeat = repeat
+        self.msg_id = wsd_common.gen_urn()
+        self.targets = {}  # endpoint address -> TargetService
+        self.stats = ProbeStats()
+
+    def send(self,
+             sock: socket.socket) \
+            -> None:
+        opt_types = "" if self.type_filter is None else "<wsd:Types>%s</wsd:Types>" % ' '.join(self.type_filter)
+        # repetitions carry the same message id, so that devices reply only once
+        send_multicast_message(sock,
+                               "ws-discovery__probe.xml",
+                               {"FROM": wsd_globals.urn,
+                                "OPT_TYPES": opt_types,
+                                "MSG_ID": self.msg_id})
+        self.stats.transmissions += 1
+
+    def handle(self,
+               data: bytes,
+               server: typing.Tuple[str, int],
+               latency: float) \
+            -> bool:
+        """
+        :return: True if the datagram made a new target known
+        :rtype: bool
+        """
+        try:
+            x = etree.fromstring(data)
+        except etree.XMLSyntaxError:
+            return False
+        if wsd_common.get_action_id(x) != "http://schemas.xmlsoap.org/ws/2005/04/discovery/ProbeMatches":
+            return False
+        if not wsd_common.record_message_id(wsd_common.get_message_id(x)):
+            self.stats.duplicates += 1
+            return False
+
+        if wsd_globals.debug:
+            print('##\n## PROBEMATCHES MATCH\n## %s\n##\n' % server[0])
+            wsd_common.log_xml(x)
+            print(etree.tostring(x, pretty_print=True, xml_declaration=True).decode("ASCII"))
+
+        msg = wsd_common.parse(x)
+        if msg.relates_to is not None and msg.relates_to != self.msg_id:
+            return False
+        self.stats.replies += 1
+        self.stats.latencies.append(latency)
+        new = False
+        for ts in msg.get_target_services():  # TODO handle replies from discovery proxies
+            if ts.ep_ref_addr not in self.targets:
+                self.targets[ts.ep_ref_addr] = ts
+                if self.index is not None:
+                    self.index.add(ts)
+                discovery_log("FOUND          " + ts.ep_ref_addr)
+                new = True
+        return new
+
+    def run(self) \
+            -> typing.Set[wsd_discovery__structures.TargetService]:
+        """
+        :return: the targets that replied
+        :rtype: {wsd_discovery__structures.TargetService}
+        """
+        sock = open_multicast_send_socket(None)
+        try:
+            start = time.monotonic()
+            deadline = start + self.timeout
+            self.send(sock)
+            delay = random.uniform(UDP_MIN_DELAY, UDP_MAX_DELAY)
+            next_send = start + delay
+            repeats_left = self.repeat
+            last_new = None
+            longest_gap = 0.0
+
+            while True:
+                now = time.monotonic()
+                if repeats_left and now >= next_send:
+                    self.send(sock)
+                    repeats_left -= 1
+                    delay = min(delay * 2, UDP_UPPER_DELAY)
+                    next_send = now + delay
+                wake = deadline
+                if repeats_left:
+                    wake = min(wake, next_send)
+                elif last_new is not None:
+                    quiet = max(self.min_quiet, self.quiet_factor * longest_gap)
+                    if last_new + quiet < deadline:
+                        wake = last_new + quiet
+                if now >= wake:
+                    self.stats.quiesced = wake < deadline and not repeats_left
+                    break
+
+                readable, _, _ = select.select([sock], [], [], wake - now)
+                if not readable:
+                    continue
+                data, server = sock.recvfrom(65536)
+                arrival = time.monotonic()
+                if self.handle(data, server, arrival - start):
+                    if last_new is not None:
+                        longest_gap = max(longest_gap, arrival - last_new)
+                    last_new = arrival
+            self.stats.elapsed = time.monotonic() - start
+        finally:
+            sock.close()
+        return set(self.targets.values())
 
 
 def wsd_probe(probe_timeout: int = 3,
@@ -172,34 +415,21 @@ def wsd_probe(probe_timeout: int = 3,
         -> typing.Set[wsd_discovery__structures.TargetService]:
     """
     Send a multicast discovery probe message, and wait for wsd-enabled devices to respond.
+    See ProbeCollector for the retransmission and early termination policies.
 
-    :param probe_timeout: the number of seconds to wait for probe replies
+    :param probe_timeout: the number of seconds to wait for probe replies at most
     :type probe_timeout: int
     :param type_filter: a set of legal strings, each representing a device class
     :type type_filter: {str}
     :return: a set of wsd targets
     :rtype: {wsd_discovery__structures.TargetService}
     """
-
-    opt_types = "" if type_filter is None else "<d:Types>%s</d:Types>" % ' '.join(type_filter)
-
-    fields = {"FROM": wsd_globals.urn,
-              "OPT_TYPES": opt_types}
-    sock = send_multicast_soap_msg("ws-discovery__probe.xml",
-                                   fields,
-                                   probe_timeout)
-
-    target_services_list = set()
-
-    while True:
-        is_proxy, ts = read_discovery_multicast_reply(sock, wsd_discovery__structures.TargetService())
-        if not ts:
-            break
-        target_services_list.add(ts[0])  # TODO handle is_proxy
-        discovery_log("FOUND          " + ts[0].ep_ref_addr)
-
-    sock.close()
-    return target_services_list
+    global last_probe_stats
+    collector = ProbeCollector(probe_timeout, type_filter)
+    targets = collector.run()
+    last_probe_stats = collector.stats
+    discovery_log(str(collector.stats), 2)
+    return targets
 
 
 def wsd_resolve(target_service: wsd_discovery__structures.TargetService) \
@@ -230,10 +460,86 @@ def wsd_resolve(target_service: wsd_discovery__structures.TargetService) \
         return True, ts
 
 
+def wsd_resolve_batch(target_services: typing.Iterable[wsd_discovery__structures.TargetService],
+                      timeout: float = 2) \
+        -> typing.List[typing.Tuple[bool, wsd_discovery__structures.TargetService]]:
+    """
+    Resolve many targets at once. Every Resolve message is sent from the same socket, and the replies are
+    matched to the requests by their RelatesTo header as they arrive, so that resolving any number of targets
+    takes at most one timeout.
+
+    :param target_services: the wsd targets to resolve
+    :type target_services: iterable of wsd_discovery__structures.TargetService
+    :param timeout: the number of seconds to wait for all the replies
+    :type timeout: float
+    :return: for each target, in order, a tuple (True, the resolved TargetService) or (False, the target itself)
+    :rtype: [(bool, wsd_discovery__structures.TargetService)]
+    """
+    results = [(False, t) for t in target_services]
+    if not results:
+        return results
+
+    pending = {}  # message id -> index of the target
+    sock = open_multicast_send_socket(None)
+    try:
+        for i, (_, t) in enumerate(results):
+            msg_id = wsd_common.gen_urn()
+            pending[msg_id] = i
+            send_multicast_message(sock,
+                                   "ws-discovery__resolve.xml",
+                                   {"FROM": wsd_globals.urn,
+                                    "EP_ADDR": t.ep_ref_addr,
+                                    "MSG_ID": msg_id})
+        # replies lacking RelatesTo are matched by endpoint address
+        by_addr = {t.ep_ref_addr: msg_id for msg_id, (_, t) in zip(pending, results)}
+
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                break
+            data, server = sock.recvfrom(4096)
+            try:
+                x = etree.fromstring(data)
+            except etree.XMLSyntaxError:
+                continue
+            if wsd_common.get_action_id(x) != "http://schemas.xmlsoap.org/ws/2005/04/discovery/ResolveMatches":
+                continue
+            if not wsd_common.record_message_id(wsd_common.get_message_id(x)):
+                continue
+
+            if wsd_globals.debug:
+                print('##\n## RESOLVEMATCHES MATCH\n## %s\n##\n' % server[0])
+                wsd_common.log_xml(x)
+                print(etree.tostring(x, pretty_print=True, xml_declaration=True).decode("ASCII"))
+
+            msg = wsd_common.parse(x)
+            ts = msg.get_target_service()
+            if ts is None:
+                continue
+            msg_id = msg.relates_to if msg.relates_to in pending else by_addr.get(ts.ep_ref_addr)
+            i = pending.pop(msg_id, None)
+            if i is None:
+                continue
+            results[i] = (True, ts)
+    finally:
+        sock.close()
+
+    for ok, t in results:
+        discovery_log(("RESOLVED       " if ok else "UNRESOLVED     ") + t.ep_ref_addr)
+    return results
+
+
 def get_devices(cache: bool = True,
                 discovery: bool = True,
                 probe_timeout: int = 3,
-                type_filter: typing.Set[str] = None) \
+                type_filter: typing.Set[str] = None,
+                verify_workers: int = 32,
+                scope_filter: typing.Set[str] = None,
+                match_by: str = wsd_discovery__index.MATCH_BY_RFC3986) \
         -> typing.Set[wsd_discovery__structures.TargetService]:
     """
     Get a list of available wsd-enabled devices
@@ -247,6 +553,12 @@ def get_devices(cache: bool = True,
     :type probe_timeout: int
     :param type_filter: a set of device types (as strings)
     :type type_filter: {str}
+    :param verify_workers: the number of cached targets verified at the same time
+    :type verify_workers: int
+    :param scope_filter: a set of scopes, all of which the targets returned must match
+    :type scope_filter: {str}
+    :param match_by: the scope matching rule, see wsd_discovery__index
+    :type match_by: str
     :return: a list of wsd targets as TargetService instances
     :rtype: {wsd_discovery__structures.TargetService}
     """
@@ -256,96 +568,281 @@ def get_devices(cache: bool = True,
     if discovery is True:
         d = wsd_probe(probe_timeout, type_filter)
 
-        for t in d:
-            ok, t = wsd_resolve(t)
+        for ok, t in wsd_resolve_batch(d):
             if ok:
                 d_resolved.add(t)
 
     if cache is True:
-        db = sqlite3.connect(db_path)
-
-        create_table_if_not_exists(db)
+        db = open_db()
 
-        c = read_targets_from_db(db)
+        c = read_targets_from_db(db, type_filter)
 
         # Discard not-reachable targets
-        for t in c:
-            s = check_target_status(t)
+        for t, s in verify_targets(c, verify_workers):
             if s:
                 c_ok.add(t)
             else:
-                remove_target_from_db(db, t)
+                remove_target_from_db(db, t, commit=False)
 
         # Add discovered entries to DB
         for i in d_resolved:
-            add_target_to_db(db, i)
+            add_target_to_db(db, i, commit=False)
 
+        # all the changes of this pass are written in a single transaction
+        db.commit()
         db.close()
 
-    result = set()
-    for elem in set.union(c_ok, d_resolved):
-        if not type_filter or not elem.types.isdisjoint(type_filter):
-            result.add(elem)
-    return result
+    index = wsd_discovery__index.TargetIndex()
+    index.update(c_ok)
+    # discovered targets take precedence over the cached ones
+    index.update(d_resolved)
+    return index.lookup(type_filter, scope_filter, match_by, any_type=True)
 
 
 def create_table_if_not_exists(db: sqlite3.Connection) -> None:
-    cursor = db.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS WsdCache ("
-                   "EpRefAddr TEXT PRIMARY KEY, "
-                   "MetadataVersion INT NOT NULL, "
-                   "SerializedTarget TEXT);")
-    db.commit()
+    """
+    Create the tables of the cache, and move the targets of a cache created by an older version into them.
+
+    Targets are stored in normalized form: one row per target in WsdTargets, and one row per type, scope
+    and transport address in the related tables, indexed by value so that filters are evaluated by SQLite.
+    WsdMetadata keeps the last Get response of each target, see wsd_transfer__operations.wsd_get().
+    """
+    if db.execute("PRAGMA user_version").fetchone()[0] >= DB_SCHEMA_VERSION:
+        return
+    with db:
+        db.executescript("BEGIN;"
+                         "CREATE TABLE IF NOT EXISTS WsdTargets ("
+                         "Id INTEGER PRIMARY KEY, "
+                         "EpRefAddr TEXT NOT NULL UNIQUE, "
+                         "MetadataVersion INT NOT NULL);"
+                         "CREATE TABLE IF NOT EXISTS WsdTargetTypes ("
+                         "TargetId INTEGER NOT NULL REFERENCES WsdTargets(Id) ON DELETE CASCADE, "
+                         "Type TEXT NOT NULL, "
+                         "PRIMARY KEY (TargetId, Type)) WITHOUT ROWID;"
+                         "CREATE INDEX IF NOT EXISTS WsdTargetTypesByType ON WsdTargetTypes (Type);"
+                         "CREATE TABLE IF NOT EXISTS WsdTargetScopes ("
+                         "TargetId INTEGER NOT NULL REFERENCES WsdTargets(Id) ON DELETE CASCADE, "
+                         "Scope TEXT NOT NULL, "
+                         "PRIMARY KEY (TargetId, Scope)) WITHOUT ROWID;"
+                         "CREATE INDEX IF NOT EXISTS WsdTargetScopesByScope ON WsdTargetScopes (Scope);"
+                         "CREATE TABLE IF NOT EXISTS WsdTargetXAddrs ("
+                         "TargetId INTEGER NOT NULL REFERENCES WsdTargets(Id) ON DELETE CASCADE, "
+                         "XAddr TEXT NOT NULL, "
+                         "PRIMARY KEY (TargetId, XAddr)) WITHOUT ROWID;"
+                         "CREATE TABLE IF NOT EXISTS WsdMetadata ("
+                         "EpRefAddr TEXT PRIMARY KEY, "
+                         "MetadataVersion INT NOT NULL, "
+                         "GetResponse BLOB NOT NULL);")
+        migrate_pickled_targets(db)
+        db.execute("PRAGMA user_version = %d" % DB_SCHEMA_VERSION)
+
+
+def migrate_pickled_targets(db: sqlite3.Connection) -> None:
+    """
+    Move the targets of the WsdCache table, where they were stored pickled, into the normalized tables,
+    and drop it. Must be called inside a transaction.
+    """
+    if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'WsdCache'").fetchone() is None:
+        return
+    for (blob,) in db.execute("SELECT SerializedTarget FROM WsdCache").fetchall():
+        try:
+            t = pickle.loads(blob.encode())
+        except Exception:
+            continue
+        add_target_to_db(db, t, commit=False)
+    db.execute("DROP TABLE WsdCache")
 
 
 def check_target_status(t: wsd_discovery__structures.TargetService) -> bool:
     try:
-        wsd_transfer__operations.wsd_get(t)
+        # a liveness check needs a real request: the cached metadata is refreshed instead of used
+        wsd_transfer__operations.wsd_get(t, use_cache=False)
         discovery_log("VERIFIED       " + t.ep_ref_addr)
         return True
     except (TimeoutError, StopIteration):
         return False
 
 
-def read_targets_from_db(db: sqlite3.Connection) -> typing.Set[wsd_discovery__structures.TargetService]:
-    cursor = db.cursor()
-    c = set()
-    cursor.execute('SELECT DISTINCT EpRefAddr, SerializedTarget FROM WsdCache')
-    for row in cursor:
-        c.add(pickle.loads(row[1].encode()))
-    return c
+def check_target_liveness(t: wsd_discovery__structures.TargetService,
+                          timeout: float = 1.0) \
+        -> typing.Union[bool, None]:
+    """
+    Check if a target is reachable by opening a TCP connection to its transport addresses, without sending
+    any request.
+
+    :param t: the target to check
+    :type t: wsd_discovery__structures.TargetService
+    :param timeout: the number of seconds to wait for each connection
+    :type timeout: float
+    :return: True if a connection succeeded, False if every address refused it, \
+    None if the outcome is inconclusive (no usable address, timeouts, unreachable networks)
+    :rtype: bool | None
+    """
+    refused = 0
+    for xaddr in t.xaddrs:
+        try:
+            u = urllib.parse.urlsplit(xaddr)
+            host, port = u.hostname, u.port or (443 if u.scheme == "https" else 80)
+        except ValueError:
+            continue
+        if host is None:
+            continue
+        try:
+            socket.create_connection((host, port), timeout).close()
+            return True
+        except ConnectionRefusedError:
+            refused += 1
+        except OSError:
+            pass
+    return False if refused and refused == len(t.xaddrs) else None
+
+
+def verify_targets(targets: typing.Iterable[wsd_discovery__structures.TargetService],
+                   workers: int = 32,
+                   timeout: float = 1.0) \
+        -> typing.List[typing.Tuple[wsd_discovery__structures.TargetService, bool]]:
+    """
+    Check which targets are still reachable, many at a time. A TCP connection to the target is attempted first,
+    see check_target_liveness(); the full Get of check_target_status() is issued only if it is inconclusive.
+
+    :param targets: the targets to check
+    :type targets: iterable of wsd_discovery__structures.TargetService
+    :param workers: the number of targets checked at the same time
+    :type workers: int
+    :param timeout: the number of seconds to wait for each TCP connection
+    :type timeout: float
+    :return: each target along with True if it is reachable, False otherwise
+    :rtype: [(wsd_discovery__structures.TargetService, bool)]
+    """
+
+    def verify(t: wsd_discovery__structures.TargetService) \
+            -> bool:
+        alive = check_target_liveness(t, timeout)
+        if alive is None:
+            return check_target_status(t)
+        if alive:
+            discovery_log("VERIFIED       " + t.ep_ref_addr)
+        return alive
+
+    targets = list(targets)
+    if not targets:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(targets))) as executor:
+        return list(zip(targets, executor.map(verify, targets)))
+
+
+def read_targets_from_db(db: sqlite3.Connection,
+                         type_filter: typing.Set[str] = None,
+                         scope_filter: typing.Set[str] = None) \
+        -> typing.Set[wsd_discovery__structures.TargetService]:
+    """
+    Load the cached targets, optionally filtered by SQLite.
+
+    :param db: the cache database
+    :type db: sqlite3.Connection
+    :param type_filter: if given, only targets implementing at least one of these types are loaded
+    :type type_filter: {str}
+    :param scope_filter: if given, only targets assigned every one of these scopes are loaded
+    :type scope_filter: {str}
+    :return: the targets found
+    :rtype: {wsd_discovery__structures.TargetService}
+    """
+    where = []
+    args = []
+    if type_filter:
+        where.append("Id IN (SELECT TargetId FROM WsdTargetTypes WHERE Type IN (%s))"
+                     % ", ".join("?" * len(type_filter)))
+        args.extend(type_filter)
+    if scope_filter:
+        where.append("Id IN (SELECT TargetId FROM WsdTargetScopes WHERE Scope IN (%s) "
+                     "GROUP BY TargetId HAVING COUNT(*) = ?)" % ", ".join("?" * len(scope_filter)))
+        args.extend(scope_filter)
+        args.append(len(scope_filter))
+    selection = "SELECT Id FROM WsdTargets" + (" WHERE " + " AND ".join(where) if where else "")
+
+    targets = {}
+    for target_id, addr, meta_ver in db.execute("SELECT Id, EpRefAddr, MetadataVersion FROM WsdTargets "
+                                                "WHERE Id IN (%s)" % selection, args):
+        t = wsd_discovery__structures.TargetService()
+        t.ep_ref_addr = addr
+        t.meta_ver = meta_ver
+        targets[target_id] = t
+    for table, column, attr in (("WsdTargetTypes", "Type", "types"),
+                                ("WsdTargetScopes", "Scope", "scopes"),
+                                ("WsdTargetXAddrs", "XAddr", "xaddrs")):
+        for target_id, value in db.execute("SELECT TargetId, %s FROM %s WHERE TargetId IN (%s)"
+                                           % (column, table, selection), args):
+            getattr(targets[target_id], attr).add(value)
+    return set(targets.values())
 
 
 def add_target_to_db(db: sqlite3.Connection,
-                     t: wsd_discovery__structures.TargetService) -> None:
-    cursor = db.cursor()
-    cursor.execute('UPDATE WsdCache '
-                   'SET    EpRefAddr = :a, '
-                   '       MetadataVersion = :b, '
-                   '       SerializedTarget = :c '
-                   'WHERE  EpRefAddr = :a '
-                   'AND MetadataVersion > :b',
-                   {"a": t.ep_ref_addr,
-                    "b": t.meta_ver,
-                    "c": pickle.dumps(t, 0).decode()})
-    if not cursor.rowcount:
-        cursor.execute('INSERT OR IGNORE '
-                       'INTO WsdCache '
-                       '(EpRefAddr, MetadataVersion, SerializedTarget) '
-                       'VALUES (:a,:b,:c)',
-                       {"a": t.ep_ref_addr,
-                        "b": t.meta_ver,
-                        "c": pickle.dumps(t, 0).decode()})
+                     t: wsd_discovery__structures.TargetService,
+                     commit: bool = True) \
+        -> None:
+    """
+    Store a target, replacing the cached one unless the latter has a greater metadata version.
+    Requires SQLite 3.24 or later.
+
+    :param commit: False to leave the change in the current transaction, to commit many of them at once
+    :type commit: bool
+    """
+    upsert = "INSERT INTO WsdTargets (EpRefAddr, MetadataVersion) VALUES (?, ?) " \
+             "ON CONFLICT (EpRefAddr) DO UPDATE SET MetadataVersion = excluded.MetadataVersion " \
+             "WHERE excluded.MetadataVersion >= MetadataVersion"
+    if DB_HAS_RETURNING:
+        cursor = db.execute(upsert + " RETURNING Id", (t.ep_ref_addr, t.meta_ver))
+        row = cursor.fetchone()
+        cursor.close()
+    else:
+        row = None
+        if db.execute(upsert, (t.ep_ref_addr, t.meta_ver)).rowcount > 0:
+            row = db.execute("SELECT Id FROM WsdTargets WHERE EpRefAddr = ?", (t.ep_ref_addr,)).fetchone()
+    if row is not None:
+        target_id = row[0]
+        for table, column, values in (("WsdTargetTypes", "Type", t.types),
+                                      ("WsdTargetScopes", "Scope", t.scopes),
+                                      ("WsdTargetXAddrs", "XAddr", t.xaddrs)):
+            db.execute("DELETE FROM %s WHERE TargetId = ?" % table, (target_id,))
+            db.executemany("INSERT INTO %s (TargetId, %s) VALUES (?, ?)" % (table, column),
+                           [(target_id, v) for v in values or ()])
     discovery_log("REGISTERED     " + t.ep_ref_addr)
-    db.commit()
+    if commit:
+        db.commit()
 
 
 def remove_target_from_db(db: sqlite3.Connection,
-                          t: wsd_discovery__structures.TargetService) -> None:
-    cursor = db.cursor()
-    cursor.execute('DELETE FROM WsdCache WHERE EpRefAddr=?', (t.ep_ref_addr,))
+                          t: wsd_discovery__structures.TargetService,
+                          commit: bool = True) \
+        -> None:
+    db.execute("DELETE FROM WsdTargets WHERE EpRefAddr = ?", (t.ep_ref_addr,))
+    db.execute("DELETE FROM WsdMetadata WHERE EpRefAddr = ?", (t.ep_ref_addr,))
     discovery_log("UNREGISTERED   " + t.ep_ref_addr)
-    db.commit()
+    if commit:
+        db.commit()
+
+
+def read_metadata_from_db(db: sqlite3.Connection,
+                          t: wsd_discovery__structures.TargetService) \
+        -> typing.Union[bytes, None]:
+    """
+    :return: the Get response stored for the target, if it was obtained with the same metadata version
+    :rtype: bytes | None
+    """
+    row = db.execute("SELECT GetResponse FROM WsdMetadata WHERE EpRefAddr = ? AND MetadataVersion = ?",
+                     (t.ep_ref_addr, t.meta_ver)).fetchone()
+    return row[0] if row is not None else None
+
+
+def add_metadata_to_db(db: sqlite3.Connection,
+                       t: wsd_discovery__structures.TargetService,
+                       response: bytes,
+                       commit: bool = True) \
+        -> None:
+    db.execute("INSERT OR REPLACE INTO WsdMetadata (EpRefAddr, MetadataVersion, GetResponse) VALUES (?, ?, ?)",
+               (t.ep_ref_addr, t.meta_ver, response))
+    if commit:
+        db.commit()
 
 
 def set_discovery_verbosity(lvl: int):
@@ -358,7 +855,17 @@ def discovery_log(text: str, lvl: int = 1):
 
 
 def open_db() -> sqlite3.Connection:
-    return sqlite3.connect(db_path)
+    """
+    Open the cache database, in write-ahead logging mode so that readers do not wait for writers,
+    and with the deletion of targets cascading to their types, scopes and addresses.
+    The tables are created, or upgraded, if needed.
+    """
+    db = sqlite3.connect(db_path)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.execute("PRAGMA foreign_keys = ON")
+    create_table_if_not_exists(db)
+    return db
 
 
 #######################
@@ -19,10 +19,11 @@ def get_sequence(xml_tree: etree.ElementTree) -> typing.List[int]:
 def parser_target(xml_tree: etree.ElementTree) -> wsd_discovery__structures.TargetService:
     o = wsd_discovery__structures.TargetService()
     o.ep_ref_addr = wsd_common.get_xml_str(xml_tree, ".//wsa:EndpointReference/wsa:Address")
-    o.types = wsd_common.get_xml_str_set(xml_tree, ".//wsd:Types")
-    o.scopes = wsd_common.get_xml_str_set(xml_tree, ".//wsd:Scopes")
-    o.xaddrs = wsd_common.get_xml_str_set(xml_tree, ".//wsd:XAddrs")
-    o.metadata_version = wsd_common.get_xml_int(xml_tree, ".//wsd:MetadataVersion")
+    # Types, Scopes and XAddrs are all optional: a missing element stands for an empty set
+    o.types = wsd_common.get_xml_str_set(xml_tree, ".//wsd:Types") or set()
+    o.scopes = wsd_common.get_xml_str_set(xml_tree, ".//wsd:Scopes") or set()
+    o.xaddrs = wsd_common.get_xml_str_set(xml_tree, ".//wsd:XAddrs") or set()
+    o.meta_ver = wsd_common.get_xml_int(xml_tree, ".//wsd:MetadataVersion") or 0
     return o
 
 
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# A live registry of the devices present on the network, kept in memory and updated by the Hello and Bye
+# announcements they multicast. Queries are answered from indexes by type and scope, without any network
+# traffic. Announcements are read by a listener thread, while the slow work they trigger (resolving
+# the transport addresses of a device, fetching its metadata) runs in a pool of workers.
+
+import concurrent.futures
+import select
+import socket
+import threading
+import typing
+
+from PyWSD import wsd_discovery__index, \
+    wsd_discovery__operations, \
+    wsd_discovery__structures, \
+    wsd_transfer__operations, \
+    wsd_transfer__structures
+
+ADDED = "added"
+UPDATED = "updated"
+REMOVED = "removed"
+METADATA = "metadata"
+
+
+class DeviceRegistry:
+    """
+    Tracks the devices announcing themselves, and notifies subscribers of every change.
+
+    Subscribers are called, from the listener or worker threads, with an event name (ADDED, UPDATED, REMOVED,
+    METADATA) and the TargetService concerned. They must return quickly, handing slow work to another thread.
+
+    :param workers: the number of threads resolving targets and fetching their metadata
+    :param prefetch: True to fetch the metadata (wsd_get) of every device as soon as it is known
+    """
+
+    def __init__(self,
+                 workers: int = 8,
+                 prefetch: bool = True):
+        self.workers = workers
+        self.prefetch = prefetch
+        self.index = wsd_discovery__index.TargetIndex()
+        self.metadata = {}  # endpoint address -> (TargetInfo, [HostedService])
+        self.subscribers = []
+        self.lock = threading.RLock()
+        self.executor = None  # created by start(), since stop() shuts it down
+        self.sockets = []
+        self.wakeup = None
+        self.thread = None
+
+    def subscribe(self,
+                  callback: typing.Callable[[str, wsd_discovery__structures.TargetService], typing.Any]) \
+            -> None:
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self,
+                    callback: typing.Callable[[str, wsd_discovery__structures.TargetService], typing.Any]) \
+            -> None:
+        with self.lock:
+            self.subscribers.remove(callback)
+
+    def notify(self,
+               event: str,
+               t: wsd_discovery__structures.TargetService) \
+            -> None:
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(event, t)
+            except Exception as e:
+                wsd_discovery__operations.discovery_log("SUBSCRIBER ERROR %r" % e)
+
+    def start(self,
+              seed: bool = True,
+              probe_timeout: int = 3) \
+            -> None:
+        """
+        Start listening to announcements.
+
+        :param seed: True to fill the registry with the devices found by get_devices() first, \
+        since devices already running do not announce themselves again
+        :type seed: bool
+        :param probe_timeout: the number of seconds to wait for probe replies when seeding
+        :type probe_timeout: int
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        self.sockets = wsd_discovery__operations.init_multicast_listener()
+        # written to by stop(), to interrupt the select() of the listener
+        self.wakeup = socket.socketpair()
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+        if seed:
+            for t in wsd_discovery__operations.get_devices(probe_timeout=probe_timeout):
+                self.add(t)
+
+    def stop(self) \
+            -> None:
+        if self.thread is not None:
+            self.wakeup[1].send(b"\0")
+            self.thread.join()
+            self.thread = None
+            for s in self.wakeup:
+                s.close()
+        wsd_discovery__operations.deinit_multicast_listener(self.sockets)
+        self.sockets = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def listen(self) \
+            -> None:
+        while True:
+            readable, _, _ = select.select(self.sockets + [self.wakeup[0]], [], [])
+            for sock in readable:
+                if sock is self.wakeup[0]:
+                    return
+                data, server = sock.recvfrom(4096)
+                # an announcement failing to be handled must not end the listener
+                try:
+                    self.handle(data, server)
+                except Exception as e:
+                    wsd_discovery__operations.discovery_log("ERROR          %s %r" % (server[0], e))
+
+    def handle(self,
+               data: bytes,
+               server: typing.Tuple) \
+            -> None:
+        announcement = wsd_discovery__operations.parse_announcement(data, server)
+        if announcement is None:
+            return
+        hello, t = announcement
+        if not hello:
+            self.remove(t.ep_ref_addr)
+        elif t.xaddrs:
+            self.add(t)
+        else:
+            # a Hello may omit the transport addresses, which a Resolve provides
+            self.executor.submit(self.resolve, t)
+
+    def resolve(self,
+                t: wsd_discovery__structures.TargetService) \
+            -> None:
+        (ok, t), = wsd_discovery__operations.wsd_resolve_batch([t])
+        if ok:
+            self.add(t)
+
+    def add(self,
+            t: wsd_discovery__structures.TargetService) \
+            -> None:
+        """
+        Add a target to the registry, or update the known one.
+        """
+        with self.lock:
+            old = self.index.get(t.ep_ref_addr)
+            if old is not None:
+                if (t.meta_ver or 0) < (old.meta_ver or 0):
+                    return
+                if (t.meta_ver == old.meta_ver and t.types == old.types and t.scopes == old.scopes
+                        and t.xaddrs == old.xaddrs):
+                    return
+                if t.meta_ver != old.meta_ver:
+                    self.metadata.pop(t.ep_ref_addr, None)
+            self.index.add(t)
+            fetch = self.prefetch and t.ep_ref_addr not in self.metadata
+        wsd_discovery__operations.discovery_log(("UPDATED        " if old else "ADDED          ") + t.ep_ref_addr)
+        self.notify(UPDATED if old else ADDED, t)
+        if fetch and self.executor is not None:
+            self.executor.submit(self.fetch_metadata, t)
+
+    def remove(self,
+               addr: str) \
+            -> None:
+        with self.lock:
+            t = self.index.remove(addr)
+            if t is None:
+                return
+            self.metadata.pop(addr, None)
+        wsd_discovery__operations.discovery_log("REMOVED        " + addr)
+        self.notify(REMOVED, t)
+
+    def fetch_metadata(self,
+                       t: wsd_discovery__structures.TargetService) \
+            -> None:
+        try:
+            result = wsd_transfer__operations.wsd_get(t)
+        except Exception as e:
+            wsd_discovery__operations.discovery_log("NO METADATA    %s %r" % (t.ep_ref_addr, e))
+            return
+        if result is False:
+            return
+        with self.lock:
+            # the device may have left, or announced a new version, in the meantime
+            if self.index.get(t.ep_ref_addr) is not t:
+                return
+            self.metadata[t.ep_ref_addr] = result
+        self.notify(METADATA, t)
+
+    def get_devices(self,
+                    type_filter: typing.Set[str] = None,
+                    scope_filter: typing.Set[str] = None,
+                    match_by: str = wsd_discovery__index.MATCH_BY_RFC3986) \
+            -> typing.Set[wsd_discovery__structures.TargetService]:
+        """
+        The devices currently known, as wsd_discovery__operations.get_devices() would return them.
+
+        :param type_filter: if given, only targets implementing at least one of these types are returned
+        :type type_filter: {str}
+        :param scope_filter: if given, only targets matching every one of these scopes are returned
+        :type scope_filter: {str}
+        :param match_by: the scope matching rule, see wsd_discovery__index
+        :type match_by: str
+        :return: the targets found
+        :rtype: {wsd_discovery__structures.TargetService}
+        """
+        return self.index.lookup(type_filter, scope_filter, match_by, any_type=True)
+
+    def get_metadata(self,
+                     addr: str) \
+            -> typing.Union[typing.Tuple[wsd_transfer__structures.TargetInfo,
+                                         typing.List[wsd_transfer__structures.HostedService]], None]:
+        """
+        :return: the metadata of a device, if already fetched
+        """
+        with self.lock:
+            return self.metadata.get(addr)
+
+
+def __demo():
+    import queue
+
+    events = queue.Queue()
+    wsd_discovery__operations.set_discovery_verbosity(1)
+    registry = DeviceRegistry()
+    registry.subscribe(lambda event, t: events.put((event, t)))
+    registry.start()
+    try:
+        while True:
+            event, t = events.get()
+            print(event, t.ep_ref_addr, "- %d devices known" % len(registry.get_devices()))
+    except KeyboardInterrupt:
+        pass
+    registry.stop()
+
+
+if __name__ == "__main__":
+    __demo()
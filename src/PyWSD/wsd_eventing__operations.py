@@ -34,6 +34,29 @@ def wsd_subscribe(hosted_service: wsd_transfer__structures.HostedService,
     :rtype: lxml.etree.ElementTree | False
     """
 
+    fields_map = {"FROM": wsd_globals.urn,
+                  "TO": hosted_service.ep_ref_addr,
+                  "NOTIFY_ADDR": notify_addr,
+                  "FILTER_DIALECT": "http://schemas.xmlsoap.org/ws/2006/02/devprof/Action",
+                  "EVENT": event_uri,
+                  **expiration_fields(expiration)}
+    x = wsd_common.submit_request({hosted_service.ep_ref_addr},
+                                  "ws-eventing__subscribe.xml",
+                                  fields_map)
+
+    return parse_subscribe_response(x)
+
+
+def expiration_fields(expiration: typing.Union[datetime, timedelta, None]) \
+        -> typing.Dict[str, typing.Union[str, None]]:
+    """
+    Format a subscription expiration time as the EXPIRES and OPT_EXPIRATION template fields.
+
+    :param expiration: Expiration time, as a datetime or timedelta object
+    :type expiration: datetime | timedelta | None
+    :return: the template fields describing the expiration
+    :rtype: {str: str | None}
+    """
     if expiration is None:
         pass
     elif isinstance(expiration, datetime):
@@ -47,17 +70,18 @@ def wsd_subscribe(hosted_service: wsd_transfer__structures.HostedService,
     if expiration is not None:
         expiration_tag = "<wse:Expires>%s</wse:Expires>" % expiration
 
-    fields_map = {"FROM": wsd_globals.urn,
-                  "TO": hosted_service.ep_ref_addr,
-                  "NOTIFY_ADDR": notify_addr,
-                  "EXPIRES": expiration,
-                  "FILTER_DIALECT": "http://schemas.xmlsoap.org/ws/2006/02/devprof/Action",
-                  "EVENT": event_uri,
-                  "OPT_EXPIRATION": expiration_tag}
-    x = wsd_common.submit_request({hosted_service.ep_ref_addr},
-                                  "ws-eventing__subscribe.xml",
-                                  fields_map)
+    return {"EXPIRES": expiration,
+            "OPT_EXPIRATION": expiration_tag}
 
+
+def parse_subscribe_response(x: etree.ElementTree) \
+        -> typing.Union[etree.ElementTree, bool]:
+    """
+    :param x: the reply to a Subscribe request
+    :type x: lxml.etree.ElementTree
+    :return: the xml SubscribeResponse, or False if a fault message is received instead
+    :rtype: lxml.etree.ElementTree | False
+    """
     if wsd_common.check_fault(x):
         return False
 
@@ -137,6 +161,19 @@ def wsd_get_status(hosted_service: wsd_transfer__structures.HostedService,
                                   "ws-eventing__get_status.xml",
                                   fields_map)
 
+    return parse_get_status_response(x)
+
+
+def parse_get_status_response(x: etree.ElementTree) \
+        -> typing.Union[None, bool, datetime]:
+    """
+    :param x: the reply to a GetStatus request
+    :type x: lxml.etree.ElementTree
+    :return: False if a fault message is received instead, \
+             none if the subscription has no expiration set, \
+             the expiration date otherwise
+    :rtype: None | False | datetime
+    """
     if wsd_common.check_fault(x):
         return False
     e = wsd_common.xml_find(x, ".//wse:Expires")
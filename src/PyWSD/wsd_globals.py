@@ -1,5 +1,3 @@
 message_parsers = dict()
 debug = False
 urn = ""
-last_msg_ids = ["" for i in range(0, 40)]
-last_msg_idx = 0
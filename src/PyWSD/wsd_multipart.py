@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Incremental parser for MIME multipart bodies, as used by the MTOM replies to RetrieveImage requests.
+# Data is fed as it arrives from the network, and the body of each part is written to a sink chosen when
+# its headers have been read, so that the memory used stays bounded by the chunk size whatever the image size.
+
+import base64
+import email.message
+import email.parser
+import io
+import typing
+
+MAX_HEADERS_SIZE = 64 * 1024
+
+
+def get_boundary(content_type: str) \
+        -> typing.Union[str, None]:
+    """
+    :param content_type: the value of a Content-Type header
+    :type content_type: str
+    :return: the boundary parameter of a multipart content type, or None if it is not multipart
+    :rtype: str | None
+    """
+    m = email.message.Message()
+    m["Content-Type"] = content_type
+    if m.get_content_maintype() != "multipart":
+        return None
+    return m.get_param("boundary")
+
+
+class Base64Writer:
+    """
+    Decodes base64 data written in arbitrary pieces, and writes the result to another sink.
+    """
+
+    def __init__(self,
+                 sink: typing.BinaryIO):
+        self.sink = sink
+        self.pending = b""
+
+    def write(self,
+              data: bytes) \
+            -> None:
+        data = self.pending + b"".join(bytes(data).split())
+        usable = len(data) - len(data) % 4
+        self.pending = data[usable:]
+        if usable:
+            self.sink.write(base64.b64decode(data[:usable]))
+
+    def flush(self) \
+            -> None:
+        if self.pending:
+            self.sink.write(base64.b64decode(self.pending + b"=" * (-len(self.pending) % 4)))
+            self.pending = b""
+
+
+class MultipartParser:
+    """
+    A push parser for multipart bodies. Call feed() with each chunk received, then close().
+
+    The sink_factory is called with the index and the headers (an email.message.Message) of every part, and
+    returns an object with a write() method receiving the part body, or None to discard it.
+    Base64-encoded parts are decoded on the fly; other transfer encodings are passed through unchanged.
+    """
+
+    PREAMBLE, DELIMITER, HEADERS, BODY, EPILOGUE = range(5)
+
+    def __init__(self,
+                 boundary: str,
+                 sink_factory: typing.Callable[[int, email.message.Message], typing.Any]):
+        self.delimiter = b"\r\n--" + boundary.encode("ASCII")
+        self.sink_factory = sink_factory
+        self.state = self.PREAMBLE
+        # a leading CRLF lets the first delimiter be found like the following ones
+        self.buffer = b"\r\n"
+        self.pos = 0  # start of the unparsed data in the buffer
+        self.parts = []  # (headers, sink) of every part, in order
+        self.sink = None
+
+    def feed(self,
+             data: bytes) \
+            -> None:
+        self.buffer = self.buffer[self.pos:] + data if self.pos < len(self.buffer) else data
+        self.pos = 0
+        while self.step():
+            pass
+
+    def step(self) \
+            -> bool:
+        """
+        Consume as much of the buffer as the current state allows.
+        Parsed data is skipped by moving pos forward, and part bodies are written through memoryviews,
+        so that a large chunk is never copied.
+
+        :return: True if the state changed and parsing can go on, False if more data is needed
+        :rtype: bool
+        """
+        if self.state == self.PREAMBLE:
+            i = self.buffer.find(self.delimiter, self.pos)
+            if i < 0:
+                self.pos = max(self.pos, len(self.buffer) - len(self.delimiter))
+                return False
+            self.pos = i + len(self.delimiter)
+            self.state = self.DELIMITER
+            return True
+
+        if self.state == self.DELIMITER:
+            if self.buffer.startswith(b"--", self.pos):
+                self.state = self.EPILOGUE
+                return True
+            i = self.buffer.find(b"\r\n", self.pos)
+            if i < 0:
+                return False
+            self.pos = i + 2
+            self.state = self.HEADERS
+            return True
+
+        if self.state == self.HEADERS:
+            if self.buffer.startswith(b"\r\n", self.pos):
+                raw = b""
+                self.pos += 2
+            else:
+                i = self.buffer.find(b"\r\n\r\n", self.pos)
+                if i < 0:
+                    if len(self.buffer) - self.pos > MAX_HEADERS_SIZE:
+                        raise ValueError("multipart part headers too large")
+                    return False
+                raw = self.buffer[self.pos:i + 2]
+                self.pos = i + 4
+            headers = email.parser.BytesHeaderParser().parsebytes(raw)
+            sink = self.sink_factory(len(self.parts), headers)
+            if sink is not None and headers.get("Content-Transfer-Encoding", "").lower() == "base64":
+                sink = Base64Writer(sink)
+            self.parts.append((headers, sink))
+            self.sink = sink
+            self.state = self.BODY
+            return True
+
+        if self.state == self.BODY:
+            i = self.buffer.find(self.delimiter, self.pos)
+            if i < 0:
+                # keep enough bytes to recognize a delimiter split across two chunks
+                end = len(self.buffer) - (len(self.delimiter) - 1)
+                if end > self.pos:
+                    self.write(self.pos, end)
+                    self.pos = end
+                return False
+            self.write(self.pos, i)
+            self.end_part()
+            self.pos = i + len(self.delimiter)
+            self.state = self.DELIMITER
+            return True
+
+        self.pos = len(self.buffer)
+        return False
+
+    def write(self,
+              start: int,
+              end: int) \
+            -> None:
+        if self.sink is not None and end > start:
+            self.sink.write(memoryview(self.buffer)[start:end])
+
+    def end_part(self) \
+            -> None:
+        if isinstance(self.sink, Base64Writer):
+            self.sink.flush()
+        self.sink = None
+
+    def close(self) \
+            -> None:
+        """
+        Signal the end of the data.
+
+        :raises ValueError: if the body ended before the closing delimiter
+        """
+        if self.state != self.EPILOGUE:
+            raise ValueError("truncated multipart body")
+
+
+def parse(content_type: str,
+          chunks: typing.Iterable[bytes],
+          sink_factory: typing.Callable[[int, email.message.Message], typing.Any]) \
+        -> typing.List[typing.Tuple[email.message.Message, typing.Any]]:
+    """
+    Parse a whole multipart body, read from an iterable of chunks.
+
+    :param content_type: the value of the Content-Type header, holding the boundary
+    :type content_type: str
+    :param chunks: the body, as successive pieces of bytes
+    :type chunks: iterable of bytes
+    :param sink_factory: see MultipartParser
+    :type sink_factory: callable
+    :return: the headers and the sink of every part
+    :rtype: [(email.message.Message, object)]
+    :raises ValueError: if the content type is not multipart, or the body is malformed
+    """
+    boundary = get_boundary(content_type)
+    if boundary is None:
+        raise ValueError("not a multipart content type: %s" % content_type)
+    p = MultipartParser(boundary, sink_factory)
+    for chunk in chunks:
+        p.feed(chunk)
+    p.close()
+    return p.parts
+
+
+def root_and_attachment(attachment: typing.BinaryIO) \
+        -> typing.Callable[[int, email.message.Message], typing.Any]:
+    """
+    A sink factory keeping the first part (the SOAP envelope of an MTOM message) in memory,
+    and writing the second one (the attachment) to the given sink. Other parts are discarded.
+    """
+
+    def factory(index: int, headers: email.message.Message):
+        if index == 0:
+            return io.BytesIO()
+        if index == 1:
+            return attachment
+        return None
+
+    return factory
+
+
+def __check():
+    import random
+    import time
+    import tracemalloc
+
+    boundary = b"uuid:2c2b1d4e-31a7-4e3a-9d5b-1f0c2b6e9a11"
+    content_type = 'multipart/related; type="application/xop+xml"; boundary="%s"' % boundary.decode()
+    envelope = b"<soap:Envelope xmlns:soap='http://www.w3.org/2003/05/soap-envelope'/>"
+    payload = bytes(random.getrandbits(8) for _ in range(1 << 16))
+
+    def body(image, repeat, encoding=b"binary"):
+        yield (b"preamble\r\n--%s\r\nContent-Type: application/xop+xml\r\n\r\n%s\r\n"
+               b"--%s\r\nContent-Type: application/binary\r\nContent-Transfer-Encoding: %s\r\n\r\n"
+               % (boundary, envelope, boundary, encoding))
+        for _ in range(repeat):
+            yield image
+        yield b"\r\n--%s--\r\n" % boundary
+
+    def rechunk(pieces, size):
+        data = b""
+        for p in pieces:
+            data += p
+            while len(data) >= size:
+                yield data[:size]
+                data = data[size:]
+        if data:
+            yield data
+
+    # small bodies, split at every possible position
+    for encoding, image in [(b"binary", payload[:3000]), (b"base64", base64.encodebytes(payload[:3000]))]:
+        for size in (1, 2, 7, 41, 4096):
+            sink = io.BytesIO()
+            parts = parse(content_type, rechunk(body(image, 1, encoding), size), root_and_attachment(sink))
+            assert parts[0][1].getvalue() == envelope
+            assert sink.getvalue() == payload[:3000]
+
+    class Counter:
+        def __init__(self):
+            self.n = 0
+
+        def write(self, b):
+            self.n += len(b)
+
+    repeat = 1600  # 100 MiB
+    sink = Counter()
+    tracemalloc.start()
+    start = time.perf_counter()
+    parse(content_type, rechunk(body(payload, repeat), 65536), root_and_attachment(sink))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert sink.n == len(payload) * repeat
+    print("%d MiB streamed in %.2f s, peak memory %.2f MiB" % (sink.n >> 20, elapsed, peak / 2 ** 20))
+
+
+if __name__ == "__main__":
+    __check()
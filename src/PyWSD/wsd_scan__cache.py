@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# A cache of the parsed scanner elements (description, configuration, status, default ticket) of each
+# scan service. While the client is subscribed to the events of a scanner, its entry is kept up to date by
+# ScannerElementsChangeEvent and the status events received by wsd_scan__events, and never expires;
+# otherwise entries are refreshed after a time to live.
+# Cached objects are shared between callers and must be treated as read-only.
+#
+# The outcome of ValidateScanTicket depends only on the document parameters of the ticket and on the
+# configuration of the scanner, so it is cached as well, and dropped when the configuration changes.
+# Tickets are first checked locally by wsd_scan__validator; the device is only asked about the ones passing.
+
+import collections
+import copy
+import hashlib
+import threading
+import time
+import typing
+
+from PyWSD import wsd_scan__operations, \
+    wsd_scan__schema, \
+    wsd_scan__validator, \
+    wsd_scan__structures, \
+    wsd_transfer__structures
+
+
+class CacheEntry:
+    def __init__(self,
+                 elements: tuple):
+        (self.description,
+         self.configuration,
+         self.status,
+         self.std_ticket) = elements
+        self.time = time.monotonic()
+
+    def elements(self) \
+            -> tuple:
+        return self.description, self.configuration, self.status, self.std_ticket
+
+
+class ScannerElementsCache:
+    """
+    Maps the address of each scan service to its parsed scanner elements.
+
+    :param ttl: the number of seconds an entry is valid for, when no event subscription keeps it up to date
+    """
+
+    def __init__(self,
+                 ttl: float = 30.0):
+        self.ttl = ttl
+        self.entries = {}
+        self.subscribed = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.patches = 0
+
+    def get(self,
+            hosted_scan_service: wsd_transfer__structures.HostedService) \
+            -> typing.Tuple[wsd_scan__structures.ScannerDescription,
+                            wsd_scan__structures.ScannerConfiguration,
+                            wsd_scan__structures.ScannerStatus,
+                            wsd_scan__structures.ScanTicket]:
+        """
+        Return the scanner elements of a service, querying the device only if the cached ones are missing
+        or expired.
+
+        :param hosted_scan_service: the wsd scan service to query
+        :type hosted_scan_service: wsd_transfer__structures.HostedService
+        :return: a tuple of the form (ScannerDescription, ScannerConfiguration, ScannerStatus, ScanTicket)
+        """
+        addr = hosted_scan_service.ep_ref_addr
+        with self.lock:
+            e = self.entries.get(addr)
+            if e is not None and (addr in self.subscribed or time.monotonic() - e.time < self.ttl):
+                self.hits += 1
+                return e.elements()
+            self.misses += 1
+
+        elements = wsd_scan__operations.wsd_get_scanner_elements(hosted_scan_service)
+        with self.lock:
+            self.entries[addr] = CacheEntry(elements)
+        return elements
+
+    def invalidate(self,
+                   addr: typing.Union[str, None] = None) \
+            -> None:
+        """
+        Drop the entry of a scan service, or all of them.
+
+        :param addr: the address of the scan service, or None to clear the cache
+        :type addr: str | None
+        """
+        with self.lock:
+            self.invalidations += 1
+            if addr is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(addr, None)
+
+    def set_subscribed(self,
+                       addr: str,
+                       subscribed: bool) \
+            -> None:
+        """
+        Tell whether events of a scan service are being received. Entries of subscribed services do not expire.
+        """
+        with self.lock:
+            if subscribed:
+                self.subscribed.add(addr)
+            else:
+                self.subscribed.discard(addr)
+                e = self.entries.get(addr)
+                if e is not None:
+                    # events may have been missed: start the time to live from now on
+                    e.time = time.monotonic()
+
+    def patch(self,
+              addr: str,
+              description: typing.Union[wsd_scan__structures.ScannerDescription, None] = None,
+              configuration: typing.Union[wsd_scan__structures.ScannerConfiguration, None] = None,
+              std_ticket: typing.Union[wsd_scan__structures.ScanTicket, None] = None) \
+            -> None:
+        """
+        Replace some of the cached elements of a scan service, as received with a ScannerElementsChangeEvent.
+        """
+        with self.lock:
+            e = self.entries.get(addr)
+            if e is None:
+                return
+            self.patches += 1
+            if description is not None:
+                e.description = description
+            if configuration is not None:
+                e.configuration = configuration
+            if std_ticket is not None:
+                e.std_ticket = std_ticket
+
+    def patch_status(self,
+                     addr: str,
+                     state: typing.Union[str, None] = None,
+                     reasons: typing.Union[typing.List[str], None] = None,
+                     condition: typing.Union[wsd_scan__structures.ScannerCondition, None] = None,
+                     cleared: typing.Union[typing.Tuple[int, str], None] = None) \
+            -> None:
+        """
+        Update the cached status of a scan service, from the content of a status event.
+        A new status object is stored, so that status objects already returned are left untouched.
+
+        :param addr: the address of the scan service
+        :type addr: str
+        :param state: the new scanner state, from a ScannerStatusSummaryEvent
+        :type state: str | None
+        :param reasons: the new state reasons, from a ScannerStatusSummaryEvent
+        :type reasons: [str] | None
+        :param condition: a condition raised, from a ScannerStatusConditionEvent
+        :type condition: wsd_scan__structures.ScannerCondition | None
+        :param cleared: the (id, clear time) of a condition cleared, from a ScannerStatusConditionClearedEvent
+        :type cleared: (int, str) | None
+        """
+        with self.lock:
+            e = self.entries.get(addr)
+            if e is None:
+                return
+            self.patches += 1
+            status = copy.copy(e.status)
+            status.active_conditions = dict(status.active_conditions)
+            status.conditions_history = dict(status.conditions_history)
+            if state is not None:
+                status.state = state
+            if reasons is not None:
+                status.reasons = list(reasons)
+            if condition is not None:
+                status.active_conditions[condition.id] = condition
+            if cleared is not None:
+                c_id, c_time = cleared
+                c = status.active_conditions.pop(c_id, None)
+                if c is not None:
+                    status.conditions_history[c_time] = c
+            e.status = status
+
+    def stats(self) \
+            -> typing.Dict[str, int]:
+        """
+        :return: the number of hits, misses, invalidations and patches, and the number of entries
+        :rtype: {str: int}
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "patches": self.patches,
+                    "entries": len(self.entries)}
+
+
+def ticket_digest(tkt: wsd_scan__structures.ScanTicket) \
+        -> bytes:
+    """
+    :param tkt: a scan ticket
+    :type tkt: wsd_scan__structures.ScanTicket
+    :return: a digest of the document parameters of the ticket, in their serialized form. \
+    The job description (name, user, information) is left out, as it does not take part in validation.
+    :rtype: bytes
+    """
+    out = []
+    if tkt.doc_params is not None:
+        wsd_scan__schema.document_params.serialize(tkt.doc_params, out)
+    return hashlib.sha256("".join(out).encode("UTF-8")).digest()
+
+
+def configuration_fingerprint(configuration: wsd_scan__structures.ScannerConfiguration) \
+        -> bytes:
+    """
+    :param configuration: the configuration of a scanner
+    :type configuration: wsd_scan__structures.ScannerConfiguration
+    :return: a digest of every setting of the configuration
+    :rtype: bytes
+    """
+    return hashlib.sha256(repr(canonical(configuration)).encode("UTF-8")).digest()
+
+
+def canonical(o):
+    # a representation of a structure made of plain values only, with attributes and keys in a stable order
+    if hasattr(o, "__dict__"):
+        return type(o).__name__, tuple((k, canonical(v)) for k, v in sorted(vars(o).items()))
+    if isinstance(o, dict):
+        return tuple(sorted((k, canonical(v)) for k, v in o.items()))
+    if isinstance(o, (list, tuple)):
+        return tuple(canonical(v) for v in o)
+    return o
+
+
+class ValidationCache:
+    """
+    Remembers the result of ValidateScanTicket for each scan service and ticket, evicting the least recently
+    used results when more than capacity are stored. Results of a service are dropped as soon as its
+    configuration, as known to the ScannerElementsCache, differs from the one they were obtained with.
+
+    :param elements: the cache providing the current configuration of the scanners
+    :param capacity: the number of results kept at most, for all services
+    """
+
+    def __init__(self,
+                 elements: ScannerElementsCache,
+                 capacity: int = 1024):
+        self.elements = elements
+        self.capacity = capacity
+        self.results = collections.OrderedDict()  # (address, ticket digest) -> (valid, corrected DocumentParams)
+        self.fingerprints = {}  # address -> (configuration, fingerprint)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.local_rejections = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def check_configuration(self,
+                            addr: str,
+                            configuration: wsd_scan__structures.ScannerConfiguration) \
+            -> None:
+        # fingerprints are computed again only when a different configuration object is cached
+        known = self.fingerprints.get(addr)
+        if known is not None and known[0] is configuration:
+            return
+        fingerprint = configuration_fingerprint(configuration)
+        with self.lock:
+            known = self.fingerprints.get(addr)
+            self.fingerprints[addr] = (configuration, fingerprint)
+            if known is None or known[1] == fingerprint:
+                return
+            stale = [k for k in self.results if k[0] == addr]
+            for k in stale:
+                del self.results[k]
+            self.evictions += len(stale)
+
+    def validate(self,
+                 hosted_scan_service: wsd_transfer__structures.HostedService,
+                 tkt: wsd_scan__structures.ScanTicket) \
+            -> typing.Tuple[bool, wsd_scan__structures.ScanTicket]:
+        """
+        Cached counterpart of wsd_scan__operations.wsd_validate_scan_ticket().
+
+        :param hosted_scan_service: the wsd scan service to query
+        :type hosted_scan_service: wsd_transfer__structures.HostedService
+        :param tkt: the ScanTicket to validate
+        :type tkt: wsd_scan__structures.ScanTicket
+        :return: a tuple of the form (boolean, ScanTicket): True and the ticket submitted, or False and a \
+        corrected ticket, carrying the job description of the ticket submitted
+        """
+        addr = hosted_scan_service.ep_ref_addr
+        configuration = self.elements.get(hosted_scan_service)[1]
+        self.check_configuration(addr, configuration)
+        key = (addr, ticket_digest(tkt))
+        with self.lock:
+            r = self.results.get(key)
+            if r is not None:
+                self.results.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if r is None:
+            # the device is queried only for tickets that its advertised configuration supports
+            valid, fixed = wsd_scan__validator.validate_scan_ticket(configuration, tkt)
+            if valid:
+                valid, fixed = wsd_scan__operations.wsd_validate_scan_ticket(hosted_scan_service, tkt)
+            else:
+                with self.lock:
+                    self.local_rejections += 1
+            r = (valid, None if valid else fixed.doc_params)
+            with self.lock:
+                self.results[key] = r
+                if len(self.results) > self.capacity:
+                    self.results.popitem(last=False)
+
+        valid, doc_params = r
+        if valid:
+            return True, tkt
+        fixed = copy.copy(tkt)
+        # the caller may alter the ticket, which must not affect the cached result
+        fixed.doc_params = copy.deepcopy(doc_params)
+        return False, fixed
+
+    def invalidate(self,
+                   addr: typing.Union[str, None] = None) \
+            -> None:
+        """
+        Drop the results of a scan service, or all of them.
+        """
+        with self.lock:
+            if addr is None:
+                self.results.clear()
+                self.fingerprints.clear()
+            else:
+                for k in [k for k in self.results if k[0] == addr]:
+                    del self.results[k]
+                self.fingerprints.pop(addr, None)
+
+    def stats(self) \
+            -> typing.Dict[str, int]:
+        """
+        :return: the number of hits, misses, tickets corrected without querying the device and results evicted \
+        by configuration changes, and the number of results
+        :rtype: {str: int}
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "local_rejections": self.local_rejections,
+                    "entries": len(self.results)}
+
+
+scanner_elements = ScannerElementsCache()
+validations = ValidationCache(scanner_elements)
+
+
+def wsd_get_scanner_elements(hosted_scan_service: wsd_transfer__structures.HostedService) \
+        -> typing.Tuple[wsd_scan__structures.ScannerDescription,
+                        wsd_scan__structures.ScannerConfiguration,
+                        wsd_scan__structures.ScannerStatus,
+                        wsd_scan__structures.ScanTicket]:
+    """
+    Cached counterpart of wsd_scan__operations.wsd_get_scanner_elements(), using the shared cache.
+    """
+    return scanner_elements.get(hosted_scan_service)
+
+
+def wsd_validate_scan_ticket(hosted_scan_service: wsd_transfer__structures.HostedService,
+                             tkt: wsd_scan__structures.ScanTicket) \
+        -> typing.Tuple[bool, wsd_scan__structures.ScanTicket]:
+    """
+    Cached counterpart of wsd_scan__operations.wsd_validate_scan_ticket(), using the shared cache.
+    """
+    return validations.validate(hosted_scan_service, tkt)
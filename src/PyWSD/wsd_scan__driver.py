@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Drives a scan job from creation to the last image, overlapping the retrieval of the next image with the
+# handling (saving, encoding) of the previous ones. Images travel from the retrieving thread to the consumer
+# through a bounded queue: when the consumer falls behind, retrieval pauses until a buffer is free.
+
+import queue
+import threading
+import time
+import typing
+from io import BytesIO
+
+from PyWSD import wsd_scan__images, \
+    wsd_scan__operations, \
+    wsd_scan__postprocess, \
+    wsd_scan__structures, \
+    wsd_transfer__structures
+
+
+class JobStats:
+    """
+    Throughput figures of a driven scan job.
+    """
+
+    def __init__(self):
+        self.images = 0
+        self.pages = 0
+        self.bytes = 0
+        self.start = None
+        self.end = None
+
+    @property
+    def elapsed(self) \
+            -> float:
+        if self.start is None:
+            return 0.0
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+    @property
+    def pages_per_minute(self) \
+            -> float:
+        return self.pages * 60 / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        s = ""
+        s += "Images retrieved:     %d\n" % self.images
+        s += "Pages retrieved:      %d\n" % self.pages
+        s += "Bytes retrieved:      %d\n" % self.bytes
+        s += "Elapsed time:         %.1f s\n" % self.elapsed
+        s += "Pages per minute:     %.1f\n" % self.pages_per_minute
+        return s
+
+
+class ScanJobDriver:
+    """
+    Creates a scan job and retrieves its images in a background thread, handing them over, still encoded,
+    through a queue of at most max_buffered images. Iterate over the driver, or call run(), to consume them.
+
+    Retrieval stops once the number of images requested by the ticket has been received or, when the ticket
+    asks for as many images as available (images_num = 0, typical of ADF scans), when the device reports
+    that no more images are available.
+    """
+
+    def __init__(self,
+                 hosted_scan_service: wsd_transfer__structures.HostedService,
+                 ticket: wsd_scan__structures.ScanTicket,
+                 docname: str = "scan",
+                 max_buffered: int = 2):
+        self.hosted_scan_service = hosted_scan_service
+        self.ticket = ticket
+        self.docname = docname
+        self.buffers = queue.Queue(maxsize=max_buffered)
+        self.stats = JobStats()
+        self.job = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self,
+              scan_identifier: str = "",
+              dest_token: str = "") \
+            -> wsd_scan__structures.ScanJob:
+        """
+        Create the scan job and start retrieving images.
+
+        :param scan_identifier: a string identifying the device-initiated scan to handle, if any
+        :type scan_identifier: str
+        :param dest_token: a token assigned by the scanner to this client, needed for device-initiated scans
+        :type dest_token: str
+        :return: the job created
+        :rtype: wsd_scan__structures.ScanJob
+        """
+        self.job = wsd_scan__operations.wsd_create_scan_job(self.hosted_scan_service, self.ticket,
+                                                             scan_identifier, dest_token)
+        self.stats.start = time.monotonic()
+        self.thread = threading.Thread(target=self.retrieve, daemon=True)
+        self.thread.start()
+        return self.job
+
+    def retrieve(self) \
+            -> None:
+        wanted = self.ticket.doc_params.images_num if self.ticket.doc_params is not None else 0
+        try:
+            while not self.stopped.is_set() and (wanted <= 0 or self.stats.pages < wanted):
+                payload = BytesIO()
+                got = wsd_scan__operations.wsd_retrieve_image_to(self.hosted_scan_service, self.job, self.docname,
+                                                                 payload)
+                if got is False:
+                    # ClientErrorNoImagesAvailable: the job is over
+                    break
+                if got is None:
+                    raise RuntimeError("RetrieveImage failed for job %s" % self.job.id)
+                raw = wsd_scan__images.RawImage(payload.getbuffer())
+                self.stats.images += 1
+                self.stats.pages += raw.pages or 1
+                self.stats.bytes += len(raw.data)
+                self.put(raw)
+        except Exception as e:
+            self.put(e)
+        finally:
+            self.stats.end = time.monotonic()
+            self.finish()
+
+    def put(self,
+            item) \
+            -> bool:
+        # blocks while the consumer is behind, unless the driver has been stopped
+        while not self.stopped.is_set():
+            try:
+                self.buffers.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def finish(self) \
+            -> None:
+        # the end of the job must reach the consumer even once stopped, or it would wait for it forever
+        if self.put(None):
+            return
+        # images not consumed are dropped, which frees room for the end marker. Only this thread puts items
+        # in the queue, so it cannot be filled again meanwhile
+        try:
+            while True:
+                self.buffers.get_nowait()
+        except queue.Empty:
+            pass
+        self.buffers.put_nowait(None)
+
+    def __iter__(self) \
+            -> typing.Iterator[wsd_scan__images.RawImage]:
+        if self.thread is None:
+            self.start()
+        while True:
+            item = self.buffers.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def run(self,
+            handler: typing.Callable[[wsd_scan__images.RawImage, int], typing.Any]) \
+            -> JobStats:
+        """
+        Consume every image of the job, calling handler with each image and the number of its first page.
+
+        :param handler: a function saving or processing an image
+        :type handler: callable
+        :return: the statistics of the job
+        :rtype: JobStats
+        """
+        first_page = 0
+        try:
+            for raw in self:
+                handler(raw, first_page)
+                first_page += raw.pages or 1
+        finally:
+            self.stop()
+        return self.stats
+
+    def stop(self) \
+            -> None:
+        """
+        Stop retrieving images. Images already received and not consumed are dropped.
+
+        May be called from any thread: by the consumer, including from a handler of run(), or by another thread,
+        in which case the iteration of the consumer ends after at most the image it is handling.
+        Returns once the retrieving thread has ended.
+        """
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+def save_raw(path_pattern: str) \
+        -> typing.Callable[[wsd_scan__images.RawImage, int], None]:
+    """
+    A handler for ScanJobDriver.run() writing each image to a file as received, without decoding it.
+
+    :param path_pattern: the path of the files to write, with a %d placeholder for the number of the first page
+    :type path_pattern: str
+    """
+
+    def handler(raw: wsd_scan__images.RawImage, first_page: int):
+        raw.save(path_pattern % first_page)
+
+    return handler
+
+
+def save_pages(path_pattern: str,
+               fmt: typing.Union[str, None] = None,
+               pending: typing.Union[list, None] = None,
+               **kwargs) \
+        -> typing.Callable[[wsd_scan__images.RawImage, int], None]:
+    """
+    A handler for ScanJobDriver.run() decoding each page and encoding it to a file in the shared PostProcessor.
+
+    :param path_pattern: the path of the files to write, with a %d placeholder for the page number
+    :type path_pattern: str
+    :param fmt: the output format, see wsd_scan__postprocess.PostProcessor.submit()
+    :type fmt: str | None
+    :param pending: if given, the futures of the pages submitted are appended to this list
+    :type pending: list | None
+    :param kwargs: further arguments of wsd_scan__postprocess.PostProcessor.submit()
+    """
+
+    def handler(raw: wsd_scan__images.RawImage, first_page: int):
+        futures = wsd_scan__postprocess.get_processor().map(raw.lazy_pages(), path_pattern, fmt,
+                                                            start=first_page, **kwargs)
+        if pending is not None:
+            pending.extend(futures)
+
+    return handler
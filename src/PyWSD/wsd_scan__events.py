@@ -15,6 +15,8 @@ from PyWSD import wsd_common, \
     wsd_transfer__structures, \
     wsd_eventing__operations, \
     wsd_scan__operations, \
+    wsd_scan__cache, \
+    wsd_scan__driver, \
     wsd_scan__parsers, \
     xml_helpers, \
     wsd_globals
@@ -277,16 +279,16 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             self.handle_scan_available_event(x)
 
         elif action == 'ScannerElementsChangeEvent':
-            self.handle_scanner_elements_change_event(context['queues'], x)
+            self.handle_scanner_elements_change_event(context['queues'], x, context.get("service"))
 
         elif action == 'ScannerStatusSummaryEvent':
-            self.handle_scanner_status_summary_event(context['queues'], x)
+            self.handle_scanner_status_summary_event(context['queues'], x, context.get("service"))
 
         elif action == 'ScannerStatusConditionEvent':
-            self.handle_scanner_status_condition_event(context['queues'], x)
+            self.handle_scanner_status_condition_event(context['queues'], x, context.get("service"))
 
         elif action == 'ScannerStatusConditionClearedEvent':
-            self.handle_scanner_status_condition_cleared_event(context['queues'], x)
+            self.handle_scanner_status_condition_cleared_event(context['queues'], x, context.get("service"))
 
         elif action == 'JobStatusEvent':
             self.handle_job_status_event(context['queues'], x)
@@ -308,7 +310,7 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         t.start()
 
     @staticmethod
-    def handle_scanner_elements_change_event(queues, xml_tree):
+    def handle_scanner_elements_change_event(queues, xml_tree, service=None):
         if wsd_globals.debug is True:
             print('##\n## SCANNER ELEMENTS CHANGE EVENT\n##\n')
             print(etree.tostring(xml_tree, pretty_print=True, xml_declaration=True))
@@ -317,16 +319,22 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         sca_descr = wsd_common.xml_find(xml_tree, ".//sca:ScannerDescription")
         std_ticket = wsd_common.xml_find(xml_tree, ".//sca:DefaultScanTicket")
 
-        description = wsd_scan__parsers.parse_scan_description(sca_descr)
-        configuration = wsd_scan__parsers.parse_scan_configuration(sca_config)
-        std_ticket = wsd_scan__parsers.parse_scan_ticket(std_ticket)
+        # the event carries only the elements that changed
+        description = wsd_scan__parsers.parse_scan_description(sca_descr) if sca_descr is not None else None
+        configuration = wsd_scan__parsers.parse_scan_configuration(sca_config) if sca_config is not None else None
+        std_ticket = wsd_scan__parsers.parse_scan_ticket(std_ticket) if std_ticket is not None else None
 
-        queues.sc_descr_q.put(description)
-        queues.sc_conf_q.put(configuration)
-        queues.sc_ticket_q.put(std_ticket)
+        if service is not None:
+            wsd_scan__cache.scanner_elements.patch(service, description, configuration, std_ticket)
+        if description is not None:
+            queues.sc_descr_q.put(description)
+        if configuration is not None:
+            queues.sc_conf_q.put(configuration)
+        if std_ticket is not None:
+            queues.sc_ticket_q.put(std_ticket)
 
     @staticmethod
-    def handle_scanner_status_summary_event(queues, xml_tree):
+    def handle_scanner_status_summary_event(queues, xml_tree, service=None):
         if wsd_globals.debug is True:
             print('##\n## SCANNER STATUS SUMMARY EVENT\n##\n')
             print(etree.tostring(xml_tree, pretty_print=True, xml_declaration=True))
@@ -338,20 +346,24 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             dsr = wsd_common.xml_findall(q, ".//sca:ScannerStateReason")
             for sr in dsr:
                 reasons.append(sr.text)
+        if service is not None:
+            wsd_scan__cache.scanner_elements.patch_status(service, state, reasons)
         queues.sc_stat_sum_q.put((state, reasons))
 
     @staticmethod
-    def handle_scanner_status_condition_event(queues, xml_tree):
+    def handle_scanner_status_condition_event(queues, xml_tree, service=None):
         if wsd_globals.debug is True:
             print('##\n## SCANNER STATUS CONDITION EVENT\n##\n')
             print(etree.tostring(xml_tree, pretty_print=True, xml_declaration=True))
 
         cond = wsd_common.xml_find(xml_tree, ".//sca:DeviceCondition")
         cond = wsd_scan__parsers.parse_scanner_condition(cond)
+        if service is not None:
+            wsd_scan__cache.scanner_elements.patch_status(service, condition=cond)
         queues.sc_cond_q.put(cond)
 
     @staticmethod
-    def handle_scanner_status_condition_cleared_event(queues, xml_tree):
+    def handle_scanner_status_condition_cleared_event(queues, xml_tree, service=None):
         if wsd_globals.debug is True:
             print('##\n## SCANNER STATUS CONDITION CLEARED EVENT\n##\n')
             print(etree.tostring(xml_tree, pretty_print=True, xml_declaration=True))
@@ -359,6 +371,8 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         cond = wsd_common.xml_find(xml_tree, ".//sca:DeviceConditionCleared")
         cond_id = int(wsd_common.xml_find(cond, ".//sca:ConditionId").text)
         clear_time = wsd_common.xml_find(cond, ".//sca:ConditionClearTime").text
+        if service is not None:
+            wsd_scan__cache.scanner_elements.patch_status(service, cleared=(cond_id, clear_time))
         queues.sc_cond_clr_q.put((cond_id, clear_time))
 
     @staticmethod
@@ -391,10 +405,6 @@ class WSDScannerMonitor:
                  listen_addr,
                  port):
         self.service = service
-        (self.description,
-         self.configuration,
-         self.status,
-         self.std_ticket) = wsd_scan__operations.wsd_get_scanner_elements(service)
         self.active_jobs = {}
         for aj in wsd_scan__operations.wsd_get_active_jobs(service):
             self.active_jobs[aj.status.id] = wsd_scan__operations.wsd_get_job_elements(service, aj.status.id)
@@ -407,13 +417,24 @@ class WSDScannerMonitor:
         self.queues = QueuesSet()
 
         context = {"allow_device_initiated_scans": False,
-                   "queues": self.queues}
+                   "queues": self.queues,
+                   "service": service.ep_ref_addr}
 
         self.server = HTTPServerWithContext(('', port), RequestHandler, context)
         self.listener = threading.Thread(target=self.server.serve_forever, args=())
         self.listener.start()
+        # from now on, the cached elements of the service are kept up to date by events. Those cached before
+        # may have missed changes, so they are fetched again
+        wsd_scan__cache.scanner_elements.invalidate(service.ep_ref_addr)
+        wsd_scan__cache.scanner_elements.set_subscribed(service.ep_ref_addr, True)
+        # the monitor applies events to its own copy, since cached objects are shared and read-only
+        (self.description,
+         self.configuration,
+         self.status,
+         self.std_ticket) = copy.deepcopy(wsd_scan__cache.scanner_elements.get(service))
 
     def close(self):
+        wsd_scan__cache.scanner_elements.set_subscribed(self.service.ep_ref_addr, False)
         self.server.shutdown()
         self.listener.join()
         wsd_eventing__operations.wsd_unsubscribe(self.service, self.subscription_id)
@@ -463,8 +484,9 @@ class WSDScannerMonitor:
             self.queues.sc_cond_q.task_done()
         while self.queues.sc_cond_clr_q.empty() is not True:
             (c_id, c_time) = self.queues.sc_cond_clr_q.get()
-            self.status.conditions_history[c_time] = copy.deepcopy(self.status.active_conditions[c_id])
-            del self.status.active_conditions[c_id]
+            # the condition may have been cleared already when the elements were fetched
+            if c_id in self.status.active_conditions:
+                self.status.conditions_history[c_time] = self.status.active_conditions.pop(c_id)
             self.queues.sc_cond_clr_q.task_done()
         while self.queues.sc_stat_sum_q.empty() is not True:
             (self.status.state, self.status.reasons) = self.queues.sc_stat_sum_q.get()
@@ -554,17 +576,14 @@ def device_initiated_scan_worker(client_context: str,
     """
     host = host_map[client_context]
     dest_token = token_map[client_context]
-    ticket = wsd_scan__operations.wsd_get_scanner_elements(host).std_ticket
-    job = wsd_scan__operations.wsd_create_scan_job(host, ticket, scan_identifier, dest_token)
-
-    o = 0
-    images = []
-    while o < ticket.doc_params.images_num:
-        imgnum, imglist = wsd_scan__operations.wsd_retrieve_image(host, job, file_name)
-        for i in imglist:
-            i.save("%s_%d.jpeg" % (file_name, o), "BMP")
-            o += 1
-        images += imglist
+    ticket = wsd_scan__cache.scanner_elements.get(host)[3]
+    driver = wsd_scan__driver.ScanJobDriver(host, ticket, file_name)
+    driver.start(scan_identifier, dest_token)
+
+    pending = []
+    driver.run(wsd_scan__driver.save_pages(file_name + "_%d.jpeg", "BMP", pending))
+    for f in pending:
+        f.result()
 
 
 def __demo_simple_listener():
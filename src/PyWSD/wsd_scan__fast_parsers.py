@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Single-pass parsers for the ScannerElements family of messages.
+# Each element is visited once: containers iterate over their direct children and dispatch on the tag,
+# instead of running a .// query for every field. The output is the same of wsd_scan__parsers.
+# The default scan ticket is parsed by the code generated by wsd_scan__schema, which works the same way.
+
+import copy
+
+from PyWSD import wsd_common, \
+    wsd_scan__schema, \
+    wsd_scan__structures
+
+SCA = "{%s}" % wsd_common.NSMAP["sca"]
+
+
+def is_true(e):
+    return e.text == 'true' or e.text == '1'
+
+
+def as_text(e):
+    return e.text
+
+
+def as_int(e):
+    return int(e.text)
+
+
+def walk(el, fields, handlers, o):
+    """
+    Fill o with the direct children of el. fields maps a tag to an (attribute, converter) pair, and only
+    the first occurrence of a tag is kept; handlers maps a tag to a function(o, child) for nested elements.
+    """
+    seen = set()
+    for c in el:
+        t = c.tag
+        f = fields.get(t)
+        if f is not None:
+            if t not in seen:
+                seen.add(t)
+                setattr(o, f[0], f[1](c))
+            continue
+        h = handlers.get(t)
+        if h is not None:
+            h(o, c)
+    return o
+
+
+def texts(el, tag):
+    return [c.text for c in el if c.tag == tag]
+
+
+def int_pair(el, first=SCA + "Width", second=SCA + "Height"):
+    v1 = v2 = None
+    for c in el:
+        if c.tag == first and v1 is None:
+            v1 = c
+        elif c.tag == second and v2 is None:
+            v2 = c
+    return int(v1.text), int(v2.text)
+
+
+def min_max(el):
+    return int_pair(el, SCA + "MinValue", SCA + "MaxValue")
+
+
+####################
+# CONFIGURATION    #
+####################
+
+def h_scaling_range(o, e):
+    for c in e:
+        if c.tag == SCA + "ScalingWidth":
+            o.scaling_range_w = min_max(c)
+        elif c.tag == SCA + "ScalingHeight":
+            o.scaling_range_h = min_max(c)
+
+
+scanner_settings_fields = {
+    SCA + "FormatsSupported": ("formats", lambda e: texts(e, SCA + "FormatValue")),
+    SCA + "CompressionQualityFactorSupported": ("compression_factor", min_max),
+    SCA + "ContentTypesSupported": ("content_types", lambda e: texts(e, SCA + "ContentTypeValue")),
+    SCA + "DocumentSizeAutoDetectSupported": ("size_autodetect_sup", is_true),
+    SCA + "AutoExposureSupported": ("auto_exposure_sup", is_true),
+    SCA + "BrightnessSupported": ("brightness_sup", is_true),
+    SCA + "ContrastSupported": ("contrast_sup", is_true),
+    SCA + "RotationsSupported": ("rotations", lambda e: texts(e, SCA + "RotationValue"))}
+scanner_settings_handlers = {SCA + "ScalingRangeSupported": h_scaling_range}
+
+
+def h_resolutions(o, e):
+    for c in e:
+        if c.tag == SCA + "Widths":
+            o.width_res = texts(c, SCA + "Width")
+        elif c.tag == SCA + "Heights":
+            o.height_res = texts(c, SCA + "Height")
+
+
+def source_settings_tables(name):
+    fields = {SCA + name + "OpticalResolution": ("optical_res", int_pair),
+              SCA + name + "Color": ("color_modes", lambda e: texts(e, SCA + "ColorEntry")),
+              SCA + name + "MinimumSize": ("min_size", int_pair),
+              SCA + name + "MaximumSize": ("max_size", int_pair)}
+    handlers = {SCA + name + "Resolutions": h_resolutions}
+    return fields, handlers
+
+
+source_settings = {"Platen": source_settings_tables("Platen"),
+                   "ADF": source_settings_tables("ADF")}
+
+
+def parse_scanner_source_settings(se, name):
+    fields, handlers = source_settings[name]
+    return walk(se, fields, handlers, wsd_scan__structures.ScannerSourceSettings())
+
+
+adf_fields = {SCA + "ADFSupportsDuplex": ("adf_duplex", is_true),
+              SCA + "ADFFront": ("front_adf", lambda e: parse_scanner_source_settings(e, "ADF")),
+              SCA + "ADFBack": ("back_adf", lambda e: parse_scanner_source_settings(e, "ADF"))}
+configuration_fields = {
+    SCA + "DeviceSettings": ("settings", lambda e: walk(e,
+                                                        scanner_settings_fields,
+                                                        scanner_settings_handlers,
+                                                        wsd_scan__structures.ScannerSettings())),
+    SCA + "Platen": ("platen", lambda e: parse_scanner_source_settings(e, "Platen"))}
+configuration_handlers = {SCA + "ADF": lambda o, e: walk(e, adf_fields, {}, o)}
+
+
+def parse_scan_configuration(sca_config):
+    return walk(sca_config, configuration_fields, configuration_handlers,
+                wsd_scan__structures.ScannerConfiguration())
+
+
+####################
+# STATUS           #
+####################
+
+condition_fields = {SCA + "Time": ("time", as_text),
+                    SCA + "Name": ("name", as_text),
+                    SCA + "Component": ("component", as_text),
+                    SCA + "Severity": ("severity", as_text)}
+
+
+def parse_scanner_condition(scond):
+    c = wsd_scan__structures.ScannerCondition()
+    c.id = int(scond.get("Id"))
+    return walk(scond, condition_fields, {}, c)
+
+
+def h_active_conditions(o, e):
+    for c in e:
+        if c.tag == SCA + "DeviceCondition":
+            cond = parse_scanner_condition(c)
+            o.active_conditions[cond.id] = cond
+
+
+def h_state_reasons(o, e):
+    o.reasons.extend(texts(e, SCA + "ScannerStateReason"))
+
+
+def h_condition_history(o, e):
+    for c in e:
+        if c.tag == SCA + "ConditionHistoryEntry":
+            cond = parse_scanner_condition(c)
+            clear_time = next(x.text for x in c if x.tag == SCA + "ClearTime")
+            o.conditions_history[clear_time] = cond
+
+
+status_fields = {SCA + "ScannerCurrentTime": ("time", as_text),
+                 SCA + "ScannerState": ("state", as_text)}
+status_handlers = {SCA + "ActiveConditions": h_active_conditions,
+                   SCA + "ScannerStateReasons": h_state_reasons,
+                   SCA + "ConditionHistory": h_condition_history}
+
+
+def parse_scan_status(sca_status):
+    return walk(sca_status, status_fields, status_handlers, wsd_scan__structures.ScannerStatus())
+
+
+####################
+# DESCRIPTION      #
+####################
+
+description_fields = {SCA + "ScannerName": ("name", as_text),
+                      SCA + "ScannerInfo": ("info", as_text),
+                      SCA + "ScannerLocation": ("location", as_text)}
+
+
+def parse_scan_description(sca_descr):
+    return walk(sca_descr, description_fields, {}, wsd_scan__structures.ScannerDescription())
+
+
+####################
+# SCANNER ELEMENTS #
+####################
+
+scanner_elements_parts = {SCA + "ScannerDescription": parse_scan_description,
+                          SCA + "ScannerConfiguration": parse_scan_configuration,
+                          SCA + "ScannerStatus": parse_scan_status,
+                          SCA + "DefaultScanTicket": wsd_scan__schema.parse_scan_ticket}
+
+
+def collect_parts(el, tags, found):
+    for c in el:
+        if c.tag in tags:
+            found.setdefault(c.tag, c)
+        elif len(c):
+            collect_parts(c, tags, found)
+    return found
+
+
+def parse_scanner_elements(x):
+    re = collect_parts(x, {SCA + "ScannerElements"}, {})[SCA + "ScannerElements"]
+    parts = collect_parts(re, scanner_elements_parts, {})
+    results = {tag: f(parts[tag]) for tag, f in scanner_elements_parts.items()}
+
+    return (results[SCA + "ScannerDescription"],
+            results[SCA + "ScannerConfiguration"],
+            results[SCA + "ScannerStatus"],
+            results[SCA + "DefaultScanTicket"])
+
+
+SAMPLE_SCANNER_ELEMENTS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"
+               xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing"
+               xmlns:sca="http://schemas.microsoft.com/windows/2006/08/wdp/scan">
+<soap:Header>
+<wsa:Action>http://schemas.microsoft.com/windows/2006/08/wdp/scan/GetScannerElementsResponse</wsa:Action>
+<wsa:MessageID>urn:uuid:00000000-0000-0000-0000-000000000001</wsa:MessageID>
+</soap:Header>
+<soap:Body>
+<sca:GetScannerElementsResponse><sca:ScannerElements>
+<sca:ElementData Name="sca:ScannerDescription" Valid="true"><sca:ScannerDescription>
+<sca:ScannerName xml:lang="en">Office scanner</sca:ScannerName>
+<sca:ScannerName xml:lang="it">Scanner ufficio</sca:ScannerName>
+<sca:ScannerInfo>Second floor</sca:ScannerInfo>
+<sca:ScannerLocation>Room 42</sca:ScannerLocation>
+</sca:ScannerDescription></sca:ElementData>
+<sca:ElementData Name="sca:ScannerConfiguration" Valid="true"><sca:ScannerConfiguration>
+<sca:DeviceSettings>
+<sca:FormatsSupported><sca:FormatValue>jfif</sca:FormatValue><sca:FormatValue>tiff-single-uncompressed</sca:FormatValue>
+<sca:FormatValue>pdf-a</sca:FormatValue></sca:FormatsSupported>
+<sca:CompressionQualityFactorSupported><sca:MinValue>0</sca:MinValue><sca:MaxValue>100</sca:MaxValue>
+</sca:CompressionQualityFactorSupported>
+<sca:ContentTypesSupported><sca:ContentTypeValue>Auto</sca:ContentTypeValue><sca:ContentTypeValue>Text</sca:ContentTypeValue>
+<sca:ContentTypeValue>Photo</sca:ContentTypeValue></sca:ContentTypesSupported>
+<sca:DocumentSizeAutoDetectSupported>false</sca:DocumentSizeAutoDetectSupported>
+<sca:AutoExposureSupported>true</sca:AutoExposureSupported>
+<sca:BrightnessSupported>1</sca:BrightnessSupported>
+<sca:ContrastSupported>0</sca:ContrastSupported>
+<sca:ScalingRangeSupported>
+<sca:ScalingWidth><sca:MinValue>100</sca:MinValue><sca:MaxValue>100</sca:MaxValue></sca:ScalingWidth>
+<sca:ScalingHeight><sca:MinValue>50</sca:MinValue><sca:MaxValue>200</sca:MaxValue></sca:ScalingHeight>
+</sca:ScalingRangeSupported>
+<sca:RotationsSupported><sca:RotationValue>0</sca:RotationValue><sca:RotationValue>180</sca:RotationValue>
+</sca:RotationsSupported>
+</sca:DeviceSettings>
+<sca:Platen>
+<sca:PlatenColor><sca:ColorEntry>BlackAndWhite1</sca:ColorEntry><sca:ColorEntry>Grayscale8</sca:ColorEntry>
+<sca:ColorEntry>RGB24</sca:ColorEntry></sca:PlatenColor>
+<sca:PlatenMinimumSize><sca:Width>1</sca:Width><sca:Height>1</sca:Height></sca:PlatenMinimumSize>
+<sca:PlatenMaximumSize><sca:Width>8500</sca:Width><sca:Height>11690</sca:Height></sca:PlatenMaximumSize>
+<sca:PlatenOpticalResolution><sca:Width>600</sca:Width><sca:Height>600</sca:Height></sca:PlatenOpticalResolution>
+<sca:PlatenResolutions>
+<sca:Widths><sca:Width>75</sca:Width><sca:Width>150</sca:Width><sca:Width>300</sca:Width><sca:Width>600</sca:Width></sca:Widths>
+<sca:Heights><sca:Height>75</sca:Height><sca:Height>150</sca:Height><sca:Height>300</sca:Height><sca:Height>600</sca:Height>
+</sca:Heights>
+</sca:PlatenResolutions>
+</sca:Platen>
+<sca:ADF>
+<sca:ADFSupportsDuplex>true</sca:ADFSupportsDuplex>
+<sca:ADFFront>
+<sca:ADFColor><sca:ColorEntry>Grayscale8</sca:ColorEntry><sca:ColorEntry>RGB24</sca:ColorEntry></sca:ADFColor>
+<sca:ADFMinimumSize><sca:Width>2000</sca:Width><sca:Height>2000</sca:Height></sca:ADFMinimumSize>
+<sca:ADFMaximumSize><sca:Width>8500</sca:Width><sca:Height>14000</sca:Height></sca:ADFMaximumSize>
+<sca:ADFOpticalResolution><sca:Width>300</sca:Width><sca:Height>300</sca:Height></sca:ADFOpticalResolution>
+<sca:ADFResolutions>
+<sca:Widths><sca:Width>150</sca:Width><sca:Width>300</sca:Width></sca:Widths>
+<sca:Heights><sca:Height>150</sca:Height><sca:Height>300</sca:Height></sca:Heights>
+</sca:ADFResolutions>
+</sca:ADFFront>
+<sca:ADFBack>
+<sca:ADFColor><sca:ColorEntry>Grayscale8</sca:ColorEntry></sca:ADFColor>
+<sca:ADFMinimumSize><sca:Width>2000</sca:Width><sca:Height>2000</sca:Height></sca:ADFMinimumSize>
+<sca:ADFMaximumSize><sca:Width>8500</sca:Width><sca:Height>14000</sca:Height></sca:ADFMaximumSize>
+<sca:ADFOpticalResolution><sca:Width>300</sca:Width><sca:Height>300</sca:Height></sca:ADFOpticalResolution>
+<sca:ADFResolutions>
+<sca:Widths><sca:Width>300</sca:Width></sca:Widths>
+<sca:Heights><sca:Height>300</sca:Height></sca:Heights>
+</sca:ADFResolutions>
+</sca:ADFBack>
+</sca:ADF>
+</sca:ScannerConfiguration></sca:ElementData>
+<sca:ElementData Name="sca:ScannerStatus" Valid="true"><sca:ScannerStatus>
+<sca:ScannerCurrentTime>2026-10-17T10:00:00Z</sca:ScannerCurrentTime>
+<sca:ScannerState>Idle</sca:ScannerState>
+<sca:ActiveConditions>
+<sca:DeviceCondition Id="7"><sca:Time>2026-10-17T09:00:00Z</sca:Time><sca:Name>InputTrayEmpty</sca:Name>
+<sca:Component>ADF</sca:Component><sca:Severity>Informational</sca:Severity></sca:DeviceCondition>
+</sca:ActiveConditions>
+<sca:ScannerStateReasons><sca:ScannerStateReason>None</sca:ScannerStateReason></sca:ScannerStateReasons>
+<sca:ConditionHistory>
+<sca:ConditionHistoryEntry Id="3"><sca:ClearTime>2026-10-17T08:30:00Z</sca:ClearTime>
+<sca:Time>2026-10-17T08:00:00Z</sca:Time><sca:Name>MediaJam</sca:Name><sca:Component>ADF</sca:Component>
+<sca:Severity>Critical</sca:Severity></sca:ConditionHistoryEntry>
+</sca:ConditionHistory>
+</sca:ScannerStatus></sca:ElementData>
+<sca:ElementData Name="sca:DefaultScanTicket" Valid="true"><sca:DefaultScanTicket>
+<sca:JobDescription><sca:JobName>Scan</sca:JobName><sca:JobOriginatingUserName>user</sca:JobOriginatingUserName>
+</sca:JobDescription>
+<sca:DocumentParameters>
+<sca:Format>jfif</sca:Format>
+<sca:CompressionQualityFactor>80</sca:CompressionQualityFactor>
+<sca:ImagesToTransfer>1</sca:ImagesToTransfer>
+<sca:InputSource>Platen</sca:InputSource>
+<sca:ContentType>Auto</sca:ContentType>
+<sca:InputSize><sca:InputMediaSize><sca:Width>8500</sca:Width><sca:Height>11690</sca:Height></sca:InputMediaSize>
+</sca:InputSize>
+<sca:Exposure><sca:AutoExposure>false</sca:AutoExposure><sca:ExposureSettings><sca:Contrast>0</sca:Contrast>
+<sca:Brightness>10</sca:Brightness><sca:Sharpness>0</sca:Sharpness></sca:ExposureSettings></sca:Exposure>
+<sca:Scaling><sca:ScalingWidth>100</sca:ScalingWidth><sca:ScalingHeight>100</sca:ScalingHeight></sca:Scaling>
+<sca:Rotation>0</sca:Rotation>
+<sca:MediaSides><sca:MediaFront>
+<sca:ScanRegion><sca:ScanRegionXOffset>10</sca:ScanRegionXOffset><sca:ScanRegionWidth>8500</sca:ScanRegionWidth>
+<sca:ScanRegionHeight>11690</sca:ScanRegionHeight></sca:ScanRegion>
+<sca:ColorProcessing>RGB24</sca:ColorProcessing>
+<sca:Resolution><sca:Width>300</sca:Width><sca:Height>300</sca:Height></sca:Resolution>
+</sca:MediaFront></sca:MediaSides>
+</sca:DocumentParameters>
+</sca:DefaultScanTicket></sca:ElementData>
+</sca:ScannerElements></sca:GetScannerElementsResponse>
+</soap:Body>
+</soap:Envelope>"""
+
+
+def as_plain(o):
+    """
+    Turn a structure into nested builtins, so that two parser outputs can be compared with ==.
+    """
+    if isinstance(o, (list, tuple)):
+        return type(o)(as_plain(v) for v in o)
+    if isinstance(o, dict):
+        return {k: as_plain(v) for k, v in o.items()}
+    if hasattr(o, "__dict__"):
+        return (o.__class__.__name__, as_plain(vars(o)))
+    return o
+
+
+def __check_equivalence():
+    import lxml.etree as etree
+    from PyWSD import wsd_scan__parsers
+
+    x = etree.fromstring(SAMPLE_SCANNER_ELEMENTS)
+    ref = wsd_scan__parsers.parse_scanner_elements(x)
+    new = parse_scanner_elements(x)
+    for name, a, b in zip(["description", "configuration", "status", "ticket"], ref, new):
+        assert as_plain(a) == as_plain(b), "%s differs:\n%s\n%s" % (name, a, b)
+        assert str(a) == str(b)
+
+    # Optional parts and defaults
+    for tag in ["ScannerInfo", "ScannerLocation", "ADFBack", "Platen", "ActiveConditions", "ConditionHistory",
+                "ScanRegionXOffset", "Exposure", "MediaSides", "InputSize", "Scaling", "JobInformation"]:
+        y = etree.fromstring(SAMPLE_SCANNER_ELEMENTS)
+        for e in wsd_common.xml_findall(y, ".//sca:%s" % tag):
+            e.getparent().remove(e)
+        assert as_plain(wsd_scan__parsers.parse_scanner_elements(y)) == as_plain(parse_scanner_elements(y)), tag
+
+    # Empty and repeated elements: None and the first occurrence are kept
+    for tag in ["JobOriginatingUserName", "Format", "ColorProcessing"]:
+        y = etree.fromstring(SAMPLE_SCANNER_ELEMENTS)
+        e = wsd_common.xml_find(y, ".//sca:DefaultScanTicket//sca:%s" % tag)
+        e.text = None
+        assert as_plain(wsd_scan__parsers.parse_scanner_elements(y)) == as_plain(parse_scanner_elements(y)), tag
+    for tag in ["Format", "ImagesToTransfer", "JobName", "MediaFront", "Resolution"]:
+        y = etree.fromstring(SAMPLE_SCANNER_ELEMENTS)
+        e = wsd_common.xml_find(y, ".//sca:DefaultScanTicket//sca:%s" % tag)
+        dup = copy.deepcopy(e)
+        for c in dup.iter():
+            if c.text is not None and c.text.strip():
+                c.text = "4242" if c.text.strip().isdigit() else "other"
+        e.addnext(dup)
+        assert as_plain(wsd_scan__parsers.parse_scanner_elements(y)) == as_plain(parse_scanner_elements(y)), tag
+    print("Single-pass parser output matches wsd_scan__parsers")
+
+
+def __benchmark():
+    import time
+    import lxml.etree as etree
+    from PyWSD import wsd_scan__parsers
+
+    x = etree.fromstring(SAMPLE_SCANNER_ELEMENTS)
+    rounds = 2000
+    for name, f in [("wsd_scan__parsers", wsd_scan__parsers.parse_scanner_elements),
+                    ("single pass", parse_scanner_elements)]:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            f(x)
+        elapsed = time.perf_counter() - start
+        print("%-20s %8.1f us/message" % (name, elapsed / rounds * 1e6))
+
+
+if __name__ == "__main__":
+    __check_equivalence()
+    __benchmark()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Handling of the encoded images sent by scanners, without decoding them.
+# The format is detected from the leading bytes of the data, and the number of pages is read from the
+# container structure (TIFF directories, PDF page objects, XPS fixed pages), never from the pixels.
+# Images without a known signature, such as DIBs sent without the BMP file header, are identified by PIL
+# from their header instead. XPS documents are counted but cannot be decoded, PIL having no XPS support.
+
+import io
+import mmap
+import re
+import struct
+import typing
+import zipfile
+
+from PIL import Image
+
+SIGNATURES = [(b"\xff\xd8\xff", "jpeg"),
+              (b"II*\x00", "tiff"),
+              (b"MM\x00*", "tiff"),
+              (b"II+\x00", "tiff"),
+              (b"MM\x00+", "tiff"),
+              (b"\x89PNG\r\n\x1a\n", "png"),
+              (b"%PDF-", "pdf"),
+              (b"BM", "bmp"),
+              (b"\x00\x00\x00\x0cjP  \r\n\x87\n", "jpeg2000"),
+              (b"\xff\x4f\xff\x51", "jpeg2000"),
+              (b"PK\x03\x04", "xps")]
+
+PDF_PAGE = re.compile(rb"/Type\s*/Page\b")
+PDF_COUNT = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b")
+PDF_OBJ = re.compile(rb"\d+\s+\d+\s+obj\b")
+PDF_STREAM = re.compile(rb"\bstream\r?\n")
+PDF_ENDSTREAM = re.compile(rb"\r?\n?endstream\b")
+
+
+def detect_format(data: typing.Union[bytes, memoryview]) \
+        -> typing.Union[str, None]:
+    """
+    :param data: an encoded image, or at least its first 16 bytes
+    :type data: bytes | memoryview
+    :return: the name of the image format, or None if it is not recognized
+    :rtype: str | None
+    """
+    head = bytes(data[:16])
+    for signature, name in SIGNATURES:
+        if head.startswith(signature):
+            return name
+    return None
+
+
+def tiff_ifd_offsets(data: typing.Union[bytes, memoryview]) \
+        -> typing.List[int]:
+    """
+    Walk the chain of image file directories of a TIFF file (classic or BigTIFF).
+
+    :param data: the whole TIFF file
+    :type data: bytes | memoryview
+    :return: the offset of the directory of each page, in order
+    :rtype: [int]
+    """
+    order = "<" if bytes(data[:2]) == b"II" else ">"
+    magic, = struct.unpack_from(order + "H", data, 2)
+    if magic == 43:
+        count_fmt, entry_size, offset_fmt = "Q", 20, "Q"
+        offset, = struct.unpack_from(order + "Q", data, 8)
+    else:
+        count_fmt, entry_size, offset_fmt = "H", 12, "I"
+        offset, = struct.unpack_from(order + "I", data, 4)
+    count_size = struct.calcsize(count_fmt)
+    offset_size = struct.calcsize(offset_fmt)
+
+    offsets = []
+    seen = set()
+    while offset and offset not in seen and offset + count_size <= len(data):
+        seen.add(offset)
+        offsets.append(offset)
+        n, = struct.unpack_from(order + count_fmt, data, offset)
+        next_at = offset + count_size + n * entry_size
+        if next_at + offset_size > len(data):
+            break
+        offset, = struct.unpack_from(order + offset_fmt, data, next_at)
+    return offsets
+
+
+def tiff_header(data: typing.Union[bytes, memoryview],
+                ifd_offset: int) \
+        -> bytes:
+    """
+    :param data: the whole TIFF file, or at least its header
+    :type data: bytes | memoryview
+    :param ifd_offset: the offset of an image file directory
+    :type ifd_offset: int
+    :return: the header of the file, modified to point to the given directory as the first one
+    :rtype: bytes
+    """
+    order = "<" if bytes(data[:2]) == b"II" else ">"
+    magic, = struct.unpack_from(order + "H", data, 2)
+    if magic == 43:
+        return bytes(data[:8]) + struct.pack(order + "Q", ifd_offset)
+    return bytes(data[:4]) + struct.pack(order + "I", ifd_offset)
+
+
+def count_pages(data: typing.Union[bytes, memoryview],
+                fmt: str) \
+        -> typing.Union[int, None]:
+    """
+    :param data: an encoded image
+    :type data: bytes | memoryview
+    :param fmt: the format of the image, as returned by detect_format()
+    :type fmt: str
+    :return: the number of pages of the image, or None if it cannot be determined without decoding it
+    :rtype: int | None
+    """
+    if fmt in ("jpeg", "png", "bmp", "jpeg2000"):
+        return 1
+    if fmt == "tiff":
+        return len(tiff_ifd_offsets(data))
+    if fmt == "pdf":
+        pages = sum(1 for _ in PDF_PAGE.finditer(data))
+        if pages:
+            return pages
+        # page objects can be hidden in compressed object streams, while the page tree root usually is not
+        counts = [int(a or b) for a, b in PDF_COUNT.findall(data)]
+        return max(counts) if counts else None
+    if fmt == "xps":
+        # the pages are counted, but PageSequence cannot decode them
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            return sum(1 for n in z.namelist() if n.lower().endswith(".fpage"))
+    return None
+
+
+def identify(data: typing.Union[bytes, memoryview]) \
+        -> typing.Tuple[str, int]:
+    """
+    Identify an image whose signature is not known to detect_format(), reading its header with PIL.
+    No pixel is decoded.
+
+    :param data: an encoded image
+    :type data: bytes | memoryview
+    :return: the name of the image format, as reported by PIL, and the number of its pages
+    :rtype: (str, int)
+    :raises ValueError: if the format is not recognized
+    """
+    try:
+        with Image.open(ViewReader(data)) as img:
+            return img.format.lower(), getattr(img, "n_frames", 1)
+    except (OSError, SyntaxError) as e:
+        raise ValueError("image format not recognized") from e
+
+
+def pdf_jpeg_streams(data: typing.Union[bytes, memoryview]) \
+        -> typing.List[typing.Tuple[int, int]]:
+    """
+    Find the JPEG-encoded (DCTDecode) image streams of a PDF file, which is how scanners embed the pages of the
+    documents they produce.
+
+    :param data: the whole PDF file
+    :type data: bytes | memoryview
+    :return: the start and end offsets of each JPEG stream, in file order
+    :rtype: [(int, int)]
+    """
+    streams = []
+    pos = 0
+    while True:
+        s = PDF_STREAM.search(data, pos)
+        if s is None:
+            return streams
+        e = PDF_ENDSTREAM.search(data, s.end())
+        if e is None:
+            return streams
+        # the dictionary of the stream lies between the beginning of its object and the stream keyword
+        objects = [m.end() for m in PDF_OBJ.finditer(data, max(pos, s.start() - 4096), s.start())]
+        header = bytes(data[objects[-1] if objects else pos:s.start()])
+        if b"/DCTDecode" in header and re.search(rb"/Subtype\s*/Image\b", header):
+            streams.append((s.end(), e.start()))
+        pos = e.end()
+
+
+class PageSequence:
+    """
+    The pages of a RawImage, decoded one at a time when accessed.
+    The position of every page in the encoded data is indexed when the sequence is created, so that len()
+    and random access never decode more than the requested page. The encoded data is read in place: a TIFF
+    page is opened as if its directory were the first of the file, and a PDF page from its JPEG stream.
+    Decoded pages are not kept.
+    """
+
+    def __init__(self,
+                 raw: "RawImage"):
+        self.raw = raw
+        self.offsets = []  # TIFF directories, or (start, end) of PDF page images
+        if raw.format == "tiff":
+            with raw.view() as data:
+                self.offsets = tiff_ifd_offsets(data)
+        elif raw.format == "pdf":
+            with raw.view() as data:
+                self.offsets = pdf_jpeg_streams(data)
+        elif raw.pages is not None:
+            self.offsets = [0] * raw.pages
+        self.count = raw.pages if raw.pages is not None else len(self.offsets)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("page index out of range")
+        return self.decode(i)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.decode(i)
+
+    def decode(self,
+               i: int) \
+            -> Image.Image:
+        """
+        :param i: the index of the page
+        :type i: int
+        :return: the decoded page
+        :rtype: PIL.Image
+        :raises ValueError: if the pages of the image cannot be located, or the format cannot be decoded
+        """
+        if self.raw.format == "xps":
+            raise ValueError("XPS pages cannot be decoded")
+        if self.raw.format == "pdf":
+            if len(self.offsets) != self.count:
+                raise ValueError("PDF pages are not stored as one JPEG image each")
+            start, end = self.offsets[i]
+            with self.raw.view() as data, Image.open(ViewReader(data[start:end])) as img:
+                return img.copy()
+        if self.raw.format == "tiff":
+            with self.raw.view() as data, \
+                    Image.open(ViewReader(data, tiff_header(data, self.offsets[i]))) as img:
+                return img.copy()
+        with self.raw.view() as data, Image.open(ViewReader(data)) as img:
+            if i:
+                img.seek(i)
+            return img.copy()
+
+
+class RawImage:
+    """
+    An image as encoded by the scanner, kept either in memory or in a file, along with its format and
+    number of pages. Pixels are decoded only when decode() is called.
+
+    :raises ValueError: if the format of the image is not recognized
+    """
+
+    def __init__(self,
+                 data: typing.Union[memoryview, None] = None,
+                 path: typing.Union[str, None] = None):
+        self.data = data
+        self.path = path
+        self.format = None
+        self.pages = None
+        if data is not None or path is not None:
+            with self.view() as v:
+                self.format = detect_format(v)
+                if self.format is not None:
+                    self.pages = count_pages(v, self.format)
+                else:
+                    self.format, self.pages = identify(v)
+
+    def __str__(self):
+        s = ""
+        s += "Format:               %s\n" % self.format
+        s += "Pages:                %s\n" % self.pages
+        if self.path is not None:
+            s += "File:                 %s\n" % self.path
+        else:
+            s += "Size:                 %d bytes\n" % len(self.data)
+        return s
+
+    def open(self) \
+            -> typing.BinaryIO:
+        """
+        :return: a binary file object reading the encoded image
+        :rtype: typing.BinaryIO
+        """
+        if self.path is not None:
+            return open(self.path, "rb")
+        return ViewReader(memoryview(self.data))
+
+    def view(self) \
+            -> typing.ContextManager[memoryview]:
+        """
+        :return: a memoryview over the encoded image, to be used as a context manager, \
+        mapping the file in memory if the image is not already there
+        :rtype: memoryview
+        """
+        if self.path is None:
+            return memoryview(self.data)
+        return MappedView(self.path)
+
+    def save(self,
+             path: str) \
+            -> None:
+        """
+        Write the encoded image to a file, as received.
+
+        :param path: the path of the file to create
+        :type path: str
+        """
+        with self.open() as src, open(path, "wb") as dst:
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                dst.write(chunk)
+
+    def decode(self) \
+            -> typing.List[Image.Image]:
+        """
+        Decode every page of the image.
+
+        :return: one image for each page
+        :rtype: [PIL.Image]
+        """
+        return list(self.lazy_pages())
+
+    def lazy_pages(self) \
+            -> PageSequence:
+        """
+        :return: the pages of the image, decoded on access
+        :rtype: PageSequence
+        """
+        return PageSequence(self)
+
+
+class MappedView:
+    """
+    A read-only memory mapping of a file, seen as a memoryview for the duration of a with block.
+    """
+
+    def __init__(self,
+                 path: str):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.view = None
+
+    def __enter__(self):
+        self.file = open(self.path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        return self.view
+
+    def __exit__(self, *args):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+class ViewReader(io.RawIOBase):
+    """
+    A seekable binary file object reading a memoryview in place, where io.BytesIO would copy it.
+    The first bytes can be replaced by a patch, such as the header built by tiff_header().
+    """
+
+    def __init__(self,
+                 view: memoryview,
+                 patch: bytes = b""):
+        super().__init__()
+        self.view = view
+        self.patch = patch
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        if offset < 0:
+            raise ValueError("negative seek position %d" % offset)
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self.view) - self.pos))
+        b[:n] = self.view[self.pos:self.pos + n]
+        if self.pos < len(self.patch):
+            k = min(n, len(self.patch) - self.pos)
+            b[:k] = self.patch[self.pos:self.pos + k]
+        self.pos += n
+        return n
@@ -1,22 +1,40 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
 
-import email
 import typing
 from io import BytesIO
 
 import lxml.etree as etree
-import requests
-from PIL import Image, ImageSequence
 
 from PyWSD import wsd_common, \
     wsd_discovery__operations, \
+    wsd_multipart, \
+    wsd_scan__fast_parsers, \
+    wsd_scan__images, \
     wsd_scan__parsers, \
+    wsd_scan__schema, \
     wsd_scan__structures, \
     wsd_transfer__operations, \
     wsd_transfer__structures, \
+    wsd_transport, \
     wsd_globals
 
+scanner_elements_parser = wsd_scan__fast_parsers.parse_scanner_elements
+
+
+def set_scanner_elements_parser(single_pass: bool = True) \
+        -> None:
+    """
+    Choose the parser backend used for GetScannerElements responses. Both produce the same structures.
+
+    :param single_pass: True for the single tree walk of wsd_scan__fast_parsers, \
+    False for the query-based parsers of wsd_scan__parsers
+    :type single_pass: bool
+    """
+    global scanner_elements_parser
+    scanner_elements_parser = wsd_scan__fast_parsers.parse_scanner_elements if single_pass \
+        else wsd_scan__parsers.parse_scanner_elements
+
 
 def wsd_get_scanner_elements(hosted_scan_service: wsd_transfer__structures.HostedService):
     """
@@ -34,18 +52,7 @@ def wsd_get_scanner_elements(hosted_scan_service: wsd_transfer__structures.Hoste
                                   "ws-scan__get_scanner_elements.xml",
                                   fields)
 
-    re = wsd_common.xml_find(x, ".//sca:ScannerElements")
-    sca_status = wsd_common.xml_find(re, ".//sca:ScannerStatus")
-    sca_config = wsd_common.xml_find(re, ".//sca:ScannerConfiguration")
-    sca_descr = wsd_common.xml_find(re, ".//sca:ScannerDescription")
-    std_ticket = wsd_common.xml_find(re, ".//sca:DefaultScanTicket")
-
-    description = wsd_scan__parsers.parse_scan_description(sca_descr)
-    status = wsd_scan__parsers.parse_scan_status(sca_status)
-    config = wsd_scan__parsers.parse_scan_configuration(sca_config)
-    std_ticket = wsd_scan__parsers.parse_scan_ticket(std_ticket)
-
-    return description, config, status, std_ticket
+    return scanner_elements_parser(x)
 
 
 def wsd_validate_scan_ticket(hosted_scan_service: wsd_transfer__structures.HostedService,
@@ -68,14 +75,9 @@ def wsd_validate_scan_ticket(hosted_scan_service: wsd_transfer__structures.Hoste
               "TO": hosted_scan_service.ep_ref_addr}
     x = wsd_common.submit_request({hosted_scan_service.ep_ref_addr},
                                   "ws-scan__validate_scan_ticket.xml",
-                                  {**fields, **tkt.as_map()})
-
-    v = wsd_common.xml_find(x, ".//sca:ValidTicket")
+                                  {**fields, "SCAN_TICKET": wsd_scan__schema.serialize_scan_ticket(tkt)})
 
-    if v.text == 'true' or v.text == '1':
-        return True, tkt
-    else:
-        return False, wsd_scan__parsers.parse_scan_ticket(wsd_common.xml_find(x, ".//sca::ValidScanTicket"))
+    return wsd_scan__parsers.parse_validate_scan_ticket_response(x, tkt)
 
 
 def wsd_create_scan_job(hosted_scan_service: wsd_transfer__structures.HostedService,
@@ -105,11 +107,9 @@ def wsd_create_scan_job(hosted_scan_service: wsd_transfer__structures.HostedServ
               "DEST_TOKEN": dest_token}
     x = wsd_common.submit_request({hosted_scan_service.ep_ref_addr},
                                   "ws-scan__create_scan_job.xml",
-                                  {**fields, **tkt.as_map()})
+                                  {**fields, "SCAN_TICKET": wsd_scan__schema.serialize_scan_ticket(tkt)})
 
-    x = wsd_common.xml_find(x, ".//sca:CreateScanJobResponse")
-
-    return wsd_scan__parsers.parse_scan_job(x)
+    return wsd_scan__parsers.parse_create_scan_job_response(x)
 
 
 def wsd_cancel_job(hosted_scan_service: wsd_transfer__structures.HostedService,
@@ -133,8 +133,7 @@ def wsd_cancel_job(hosted_scan_service: wsd_transfer__structures.HostedService,
                                   "ws-scan__cancel_job.xml",
                                   fields)
 
-    wsd_common.xml_find(x, ".//sca:ClientErrorJobIdNotFound")
-    return x is None
+    return wsd_scan__parsers.parse_cancel_job_response(x)
 
 
 def wsd_get_job_elements(hosted_scan_service: wsd_transfer__structures.HostedService,
@@ -158,17 +157,7 @@ def wsd_get_job_elements(hosted_scan_service: wsd_transfer__structures.HostedSer
                                   "ws-scan__get_job_elements.xml",
                                   fields)
 
-    q = wsd_common.xml_find(x, ".//sca:JobStatus")
-    jstatus = wsd_scan__parsers.parse_job_status(q)
-
-    st = wsd_common.xml_find(x, ".//sca:ScanTicket")
-    tkt = wsd_scan__parsers.parse_scan_ticket(st)
-
-    dfp = wsd_common.xml_find(x, ".//sca:Documents/sca:DocumentFinalParameters")
-    dps = wsd_scan__parsers.parse_document_params(dfp)
-    dlist = [x.text for x in wsd_common.xml_findall(dfp, "sca:Document/sca:DocumentDescription/sca:DocumentName")]
-
-    return jstatus, tkt, dps, dlist
+    return wsd_scan__parsers.parse_job_elements(x)
 
 
 def wsd_get_active_jobs(hosted_scan_service: wsd_transfer__structures.HostedService) \
@@ -188,11 +177,7 @@ def wsd_get_active_jobs(hosted_scan_service: wsd_transfer__structures.HostedServ
                                   "ws-scan__get_active_jobs.xml",
                                   fields)
 
-    jsl = []
-    for y in wsd_common.xml_findall(x, ".//sca:JobSummary"):
-        jsl.append(wsd_scan__parsers.parse_job_summary(y))
-
-    return jsl
+    return wsd_scan__parsers.parse_job_summaries(x)
 
 
 def wsd_get_job_history(hosted_scan_service: wsd_transfer__structures.HostedService) \
@@ -212,17 +197,67 @@ def wsd_get_job_history(hosted_scan_service: wsd_transfer__structures.HostedServ
                                   "ws-scan__get_job_history.xml",
                                   fields)
 
-    jsl = []
-    for y in wsd_common.xml_findall(x, ".//sca:JobSummary"):
-        jsl.append(wsd_scan__parsers.parse_job_summary(y))
+    return wsd_scan__parsers.parse_job_summaries(x)
 
-    return jsl
+
+def retrieve_image_request(hosted_scan_service: wsd_transfer__structures.HostedService,
+                           job: wsd_scan__structures.ScanJob,
+                           docname: str) \
+        -> bytes:
+    fields = {"FROM": wsd_globals.urn,
+              "TO": hosted_scan_service.ep_ref_addr,
+              "JOB_ID": job.id,
+              "JOB_TOKEN": job.token,
+              "DOC_DESCR": docname}
+    data = wsd_common.render_template("ws-scan__retrieve_image.xml", fields)
+
+    if wsd_globals.debug:
+        r = etree.fromstring(data, parser=wsd_common.parser)
+        print('##\n## RETRIEVE IMAGE REQUEST\n##\n')
+        print(etree.tostring(r, pretty_print=True, xml_declaration=True).decode("ASCII"))
+
+    return data
+
+
+def wsd_retrieve_image_to(hosted_scan_service: wsd_transfer__structures.HostedService,
+                          job: wsd_scan__structures.ScanJob,
+                          docname: str,
+                          sink: typing.Union[str, typing.BinaryIO]) \
+        -> typing.Union[bool, None]:
+    """
+    Submit a RetrieveImage request, and stream the image received to a file, without decoding it.
+    The reply is read from the network in chunks, so the memory used does not depend on the image size.
+
+    :param hosted_scan_service: the wsd scan service to query
+    :type hosted_scan_service: wsd_transfer__structures.HostedService
+    :param job: the ScanJob instance representing the queried job.
+    :type job: wsd_scan__structures.ScanJob
+    :param docname: the name assigned to the image to retrieve.
+    :type docname: str
+    :param sink: the path of the file to create, or a binary file-like object to write the image to
+    :type sink: str | typing.BinaryIO
+    :return: True if an image was written, False if the job has no more images available, None if the reply \
+    was a different fault.
+    :rtype: bool | None
+    """
+    data = retrieve_image_request(hosted_scan_service, job, docname)
+    r = wsd_transport.post(hosted_scan_service.ep_ref_addr, data, headers=wsd_common.headers, stream=True)
+    try:
+        if isinstance(sink, str):
+            # the file is created only once it is known that an image is coming
+            if wsd_multipart.get_boundary(r.headers['Content-Type']) is None:
+                return stream_retrieve_image_response(r.headers['Content-Type'], r.iter_content(65536), None)
+            with open(sink, "wb") as f:
+                return stream_retrieve_image_response(r.headers['Content-Type'], r.iter_content(65536), f)
+        return stream_retrieve_image_response(r.headers['Content-Type'], r.iter_content(65536), sink)
+    finally:
+        r.close()
 
 
 def wsd_retrieve_image(hosted_scan_service: wsd_transfer__structures.HostedService,
                        job: wsd_scan__structures.ScanJob,
                        docname: str) \
-        -> typing.Tuple[int, typing.List[Image.Image]]:
+        -> typing.Tuple[int, wsd_scan__images.PageSequence]:
     """
     Submit a RetrieveImage request, and parse the response.
     Retrieves a single image from the scanner, if the job has available images to send. If the file format
@@ -235,56 +270,124 @@ def wsd_retrieve_image(hosted_scan_service: wsd_transfer__structures.HostedServi
     :type job: wsd_scan__structures.ScanJob
     :param docname: the name assigned to the image to retrieve.
     :type docname: str
-    :return: the number of images retrieved, and an array of images
-    :rtype: (int, list[PIL.Image])
+    :return: the number of images retrieved, and a sequence of images, each decoded only when accessed
+    :rtype: (int, wsd_scan__images.PageSequence)
     """
+    raw = wsd_retrieve_image_raw(hosted_scan_service, job, docname)
+    if raw is None:
+        return 0, []
+    pages = raw.lazy_pages()
+    return len(pages), pages
+
+
+def wsd_retrieve_image_raw(hosted_scan_service: wsd_transfer__structures.HostedService,
+                           job: wsd_scan__structures.ScanJob,
+                           docname: str,
+                           path: typing.Union[str, None] = None) \
+        -> typing.Union[wsd_scan__images.RawImage, None]:
+    """
+    Submit a RetrieveImage request, and return the image exactly as encoded by the device.
+    The format and the number of pages are detected without decoding the image, so that archiving it
+    costs no more than writing the bytes received.
 
-    data = wsd_common.message_from_file(wsd_common.abs_path("../templates/ws-scan__retrieve_image.xml"),
-                                        FROM=wsd_globals.urn,
-                                        TO=hosted_scan_service.ep_ref_addr,
-                                        JOB_ID=job.id,
-                                        JOB_TOKEN=job.token,
-                                        DOC_DESCR=docname)
+    :param hosted_scan_service: the wsd scan service to query
+    :type hosted_scan_service: wsd_transfer__structures.HostedService
+    :param job: the ScanJob instance representing the queried job.
+    :type job: wsd_scan__structures.ScanJob
+    :param docname: the name assigned to the image to retrieve.
+    :type docname: str
+    :param path: if given, the image is streamed to this file instead of being kept in memory
+    :type path: str | None
+    :return: the encoded image, or None if the job has no images available
+    :rtype: wsd_scan__images.RawImage | None
+    """
+    if path is not None:
+        if not wsd_retrieve_image_to(hosted_scan_service, job, docname, path):
+            return None
+        return wsd_scan__images.RawImage(path=path)
 
-    if wsd_globals.debug:
-        r = etree.fromstring(data.encode("ASCII"), parser=wsd_common.parser)
-        print('##\n## RETRIEVE IMAGE REQUEST\n##\n')
-        print(etree.tostring(r, pretty_print=True, xml_declaration=True).decode("ASCII"))
+    payload = BytesIO()
+    if not wsd_retrieve_image_to(hosted_scan_service, job, docname, payload):
+        return None
+    return wsd_scan__images.RawImage(payload.getbuffer())
 
-    r = requests.post(hosted_scan_service.ep_ref_addr, headers=wsd_common.headers, data=data)
 
-    try:
-        x = etree.fromstring(r.text)
+def stream_retrieve_image_response(content_type: str,
+                                   chunks: typing.Iterable[bytes],
+                                   sink: typing.Union[typing.BinaryIO, None]) \
+        -> typing.Union[bool, None]:
+    """
+    Parse the reply to a RetrieveImage request, read in chunks: either a SOAP fault, or a multipart message
+    whose attachment is the image, written to sink as it is received.
+
+    :param content_type: the value of the Content-Type header of the reply
+    :type content_type: str
+    :param chunks: the body of the reply
+    :type chunks: iterable of bytes
+    :param sink: a binary file-like object to write the image to
+    :type sink: typing.BinaryIO
+    :return: True if an image was written, False if the job has no more images available, None if the reply \
+    was a different fault.
+    :rtype: bool | None
+    """
+    if wsd_multipart.get_boundary(content_type) is None:
+        x = etree.fromstring(b"".join(chunks))
         q = wsd_common.xml_find(x, ".//soap:Fault")
         if q is not None:
             e = wsd_common.xml_find(q, ".//soap:Code/soap:Subcode/soap:Value").text
             if e == "wscn:ClientErrorNoImagesAvailable":
-                return 0, []
-    except etree.ParseError:
-        content_with_header = b'Content-type: ' + r.headers['Content-Type'].encode('ascii') + r.content
-        m = email.message_from_bytes(content_with_header)
+                return False
+        return None
 
-        ls = list(m.walk())
+    parts = wsd_multipart.parse(content_type, chunks, wsd_multipart.root_and_attachment(sink))
 
-        if wsd_globals.debug:
-            print('##\n## RETRIEVE IMAGE RESPONSE\n##\n%s\n' % ls[1])
+    if wsd_globals.debug:
+        print('##\n## RETRIEVE IMAGE RESPONSE\n##\n%s\n' % parts[0][1].getvalue().decode("UTF-8", "replace"))
+
+    return len(parts) > 1
 
-        img = Image.open(BytesIO(ls[2].get_payload(decode=True)))
-        print("%s %s %s" % (img.format, img.size, img.mode))
 
-        count = 0
-        imglist = []
+def parse_retrieve_image_response(content_type: str,
+                                  content: bytes) \
+        -> typing.Tuple[int, wsd_scan__images.PageSequence]:
+    """
+    Parse the reply to a RetrieveImage request: either a SOAP fault or a multipart message carrying the image.
+
+    :param content_type: the value of the Content-Type header of the reply
+    :type content_type: str
+    :param content: the body of the reply
+    :type content: bytes
+    :return: the number of images retrieved, and a sequence of images, each decoded only when accessed
+    :rtype: (int, wsd_scan__images.PageSequence)
+    """
+    raw = parse_retrieve_image_raw(content_type, content)
+    if raw is None:
+        return 0, []
+    pages = raw.lazy_pages()
+    return len(pages), pages
 
-        for page in ImageSequence.Iterator(img):
-            count += 1
-            a = Image.new(page.mode, page.size)
-            a.putdata(page.getdata())
-            imglist.append(a)
 
-        return count, imglist
+def parse_retrieve_image_raw(content_type: str,
+                             content: bytes) \
+        -> typing.Union[wsd_scan__images.RawImage, None]:
+    """
+    Like parse_retrieve_image_response(), but return the image as encoded by the device.
+
+    :param content_type: the value of the Content-Type header of the reply
+    :type content_type: str
+    :param content: the body of the reply
+    :type content: bytes
+    :return: the encoded image, or None if the job has no images available
+    :rtype: wsd_scan__images.RawImage | None
+    """
+    payload = BytesIO()
+    if not stream_retrieve_image_response(content_type, [content], payload):
+        return None
+    return wsd_scan__images.RawImage(payload.getbuffer())
 
 
 def __demo():
+    from PyWSD import wsd_scan__driver
     wsd_common.init()
     wsd_globals.debug = False
     tsl = wsd_discovery__operations.get_devices()
@@ -304,7 +407,8 @@ def __demo():
                 # t.doc_params.images_num = 0
                 (valid, ticket) = wsd_validate_scan_ticket(b, std_ticket)
                 if valid:
-                    j = wsd_create_scan_job(b, ticket)
+                    driver = wsd_scan__driver.ScanJobDriver(b, ticket, "prova.bmp")
+                    j = driver.start()
                     print(j)
                     (js, t, dp, dl) = wsd_get_job_elements(b, j)
                     print(js)
@@ -317,12 +421,10 @@ def __demo():
                     jobs = wsd_get_job_history(b)
                     for i in jobs:
                         print(i)
-                    o = 0
-                    while o < ticket.doc_params.images_num:
-                        imgnum, imglist = wsd_retrieve_image(b, j, "prova.bmp")
-                        for i in imglist:
-                            i.save("prova_%d.bmp" % o, "BMP")
-                            o += 1
+                    pending = []
+                    print(driver.run(wsd_scan__driver.save_pages("prova_%d.bmp", "BMP", pending)))
+                    for f in pending:
+                        f.result()
 
 
 if __name__ == "__main__":
@@ -4,13 +4,28 @@
 import copy
 
 from PyWSD import wsd_common, \
+    wsd_scan__schema, \
     wsd_scan__structures
 
 
-# try to use declxml https://github.com/gatkin/declxml
-# NB: declxml do not support namespaces AFAIK
+# scan tickets and document parameters are described once in wsd_scan__schema, which generates their parsers
 
 def parse_scan_ticket(std_ticket):
+    return wsd_scan__schema.parse_scan_ticket(std_ticket)
+
+
+def parse_media_side(ms):
+    return wsd_scan__schema.media_side.parse(ms)
+
+
+def parse_document_params(dps):
+    return wsd_scan__schema.parse_document_params(dps)
+
+
+# the query-based ticket parsers, used by parse_scanner_elements() so that it stays independent of
+# wsd_scan__schema, and kept as the reference the generated parsers are checked against
+
+def query_parse_scan_ticket(std_ticket):
     st = wsd_scan__structures.ScanTicket()
     st.job_name = wsd_common.xml_find(std_ticket, ".//sca:JobDescription/sca:JobName").text
     st.job_user_name = wsd_common.xml_find(std_ticket, ".//sca:JobDescription/sca:JobOriginatingUserName").text
@@ -18,11 +33,11 @@ def parse_scan_ticket(std_ticket):
     if q is not None:
         st.job_info = q.text
     dps = wsd_common.xml_find(std_ticket, ".//sca:DocumentParameters")
-    st.doc_params = parse_document_params(dps)
+    st.doc_params = query_parse_document_params(dps)
     return st
 
 
-def parse_media_side(ms):
+def query_parse_media_side(ms):
     s = wsd_scan__structures.MediaSide()
     r = wsd_common.xml_find(ms, ".//sca:ScanRegion")
     if r is not None:
@@ -45,7 +60,7 @@ def parse_media_side(ms):
     return s
 
 
-def parse_document_params(dps):
+def query_parse_document_params(dps):
     dest = wsd_scan__structures.DocumentParams()
     q = wsd_common.xml_find(dps, ".//sca:Format")
     if q is not None:
@@ -64,7 +79,7 @@ def parse_document_params(dps):
         dest.content_type = q.text
     q = wsd_common.xml_find(dps, ".//sca:InputSize")
     if q is not None:
-        autod = wsd_common.xml_find(q, ".//sca:DocumentAutoDetect")
+        autod = wsd_common.xml_find(q, ".//sca:DocumentSizeAutoDetect")
         if autod is not None:
             dest.size_autodetect = True if autod.text == 'true' or autod.text == '1' else False
         v1 = wsd_common.xml_find(q, ".//sca:InputMediaSize/sca:Width")
@@ -89,11 +104,11 @@ def parse_document_params(dps):
     q = wsd_common.xml_find(dps, ".//sca:MediaSides")
     if q is not None:
         f = wsd_common.xml_find(q, ".//sca:MediaFront")
-        dest.front = parse_media_side(f)
+        dest.front = query_parse_media_side(f)
 
         f = wsd_common.xml_find(q, ".//sca:MediaBack")
         if f is not None:
-            dest.back = parse_media_side(f)
+            dest.back = query_parse_media_side(f)
         else:
             dest.back = copy.deepcopy(dest.front)
     return dest
@@ -252,3 +267,57 @@ def parse_scan_job(x):
     dpf = wsd_common.xml_find(x, ".//sca:DocumentFinalParameters")
     scnj.doc_params = parse_document_params(dpf)
     return scnj
+
+
+def parse_scanner_elements(x):
+    re = wsd_common.xml_find(x, ".//sca:ScannerElements")
+    sca_status = wsd_common.xml_find(re, ".//sca:ScannerStatus")
+    sca_config = wsd_common.xml_find(re, ".//sca:ScannerConfiguration")
+    sca_descr = wsd_common.xml_find(re, ".//sca:ScannerDescription")
+    std_ticket = wsd_common.xml_find(re, ".//sca:DefaultScanTicket")
+
+    description = parse_scan_description(sca_descr)
+    status = parse_scan_status(sca_status)
+    config = parse_scan_configuration(sca_config)
+    std_ticket = query_parse_scan_ticket(std_ticket)
+
+    return description, config, status, std_ticket
+
+
+def parse_validate_scan_ticket_response(x, tkt):
+    v = wsd_common.xml_find(x, ".//sca:ValidTicket")
+
+    if v.text == 'true' or v.text == '1':
+        return True, tkt
+    else:
+        return False, parse_scan_ticket(wsd_common.xml_find(x, ".//sca:ValidScanTicket"))
+
+
+def parse_create_scan_job_response(x):
+    x = wsd_common.xml_find(x, ".//sca:CreateScanJobResponse")
+    return parse_scan_job(x)
+
+
+def parse_cancel_job_response(x):
+    return wsd_common.xml_find(x, ".//sca:ClientErrorJobIdNotFound") is None
+
+
+def parse_job_elements(x):
+    q = wsd_common.xml_find(x, ".//sca:JobStatus")
+    jstatus = parse_job_status(q)
+
+    st = wsd_common.xml_find(x, ".//sca:ScanTicket")
+    tkt = parse_scan_ticket(st)
+
+    dfp = wsd_common.xml_find(x, ".//sca:Documents/sca:DocumentFinalParameters")
+    dps = parse_document_params(dfp)
+    dlist = [x.text for x in wsd_common.xml_findall(dfp, "sca:Document/sca:DocumentDescription/sca:DocumentName")]
+
+    return jstatus, tkt, dps, dlist
+
+
+def parse_job_summaries(x):
+    jsl = []
+    for y in wsd_common.xml_findall(x, ".//sca:JobSummary"):
+        jsl.append(parse_job_summary(y))
+    return jsl
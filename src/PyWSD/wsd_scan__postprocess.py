@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Post-processing of scanned pages (rotation, mode conversion, encoding to a file) in a pool of processes.
+# The raster of each page is pasted straight into a shared memory block, which the worker maps instead of
+# receiving a pickled copy, so the parent copies it only once. Pages in a mode PIL cannot map (such as "1" or
+# "LA") are packed with tobytes() first, which costs a second copy. A bounded number of pages is in flight at any time, so that a fast producer
+# (the network) waits for the encoders instead of filling the memory with pending pages.
+
+import concurrent.futures
+import os
+import threading
+import typing
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+# modes whose raster can be shared as is: the layout mapped by Image.frombuffer(), and its bytes per pixel.
+# PIL stores RGB pixels on four bytes, exactly like RGBX
+SHARED_LAYOUTS = {"L": ("L", 1),
+                  "P": ("P", 1),
+                  "RGB": ("RGBX", 4),
+                  "RGBX": ("RGBX", 4),
+                  "RGBA": ("RGBA", 4),
+                  "CMYK": ("CMYK", 4),
+                  "I;16": ("I;16", 2),
+                  "I;16L": ("I;16L", 2),
+                  "I;16B": ("I;16B", 2)}
+
+
+def process_page(shm_name: str,
+                 layout: str,
+                 mode: str,
+                 size: typing.Tuple[int, int],
+                 palette: typing.Union[typing.List[int], None],
+                 path: str,
+                 fmt: typing.Union[str, None],
+                 rotate: int,
+                 convert: typing.Union[str, None],
+                 save_args: typing.Dict[str, typing.Any]) \
+        -> str:
+    """
+    Runs in a worker process: map a page from shared memory, transform it and save it to a file.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        img = Image.frombuffer(layout, size, shm.buf, "raw", layout, 0, 1)
+        if convert is None and layout != mode:
+            convert = mode
+        if palette is not None:
+            img.putpalette(palette)
+        if rotate:
+            img = img.rotate(rotate, expand=True)
+        if convert is not None and convert != img.mode:
+            img = img.convert(convert)
+        img.save(path, fmt, **save_args)
+        # the image may still reference the shared buffer, which cannot be closed while exported
+        del img
+    finally:
+        shm.close()
+    return path
+
+
+class PostProcessor:
+    """
+    Encodes pages to files in a ProcessPoolExecutor, handing the rasters over through shared memory.
+    submit() blocks while max_pending pages are already queued or being processed.
+    """
+
+    def __init__(self,
+                 workers: typing.Union[int, None] = None,
+                 max_pending: typing.Union[int, None] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        self.slots = threading.BoundedSemaphore(max_pending or 2 * self.workers)
+
+    def submit(self,
+               page: Image.Image,
+               path: str,
+               fmt: typing.Union[str, None] = None,
+               rotate: int = 0,
+               convert: typing.Union[str, None] = None,
+               **save_args) \
+            -> concurrent.futures.Future:
+        """
+        Queue a page for processing.
+
+        :param page: the page to process
+        :type page: PIL.Image
+        :param path: the path of the file to write
+        :type path: str
+        :param fmt: the output format, as understood by PIL; if None, it is deduced from the file extension
+        :type fmt: str | None
+        :param rotate: the counter-clockwise rotation to apply, in degrees
+        :type rotate: int
+        :param convert: the mode to convert the page to before saving, such as "L" or "RGB"
+        :type convert: str | None
+        :param save_args: further options of PIL.Image.save(), such as quality
+        :return: a future resolving to the path of the file written
+        :rtype: concurrent.futures.Future
+        """
+        page.load()
+        palette = page.getpalette() if page.mode in ("P", "PA") else None
+        if page.mode in SHARED_LAYOUTS:
+            data = None
+            layout, pixel_size = SHARED_LAYOUTS[page.mode]
+            size = page.width * page.height * pixel_size
+        else:
+            data = page.tobytes()
+            layout = page.mode
+            size = len(data)
+
+        self.slots.acquire()
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        except BaseException:
+            self.slots.release()
+            raise
+        try:
+            if data is None:
+                # the shared block is mapped as an image, and the page pasted into it pixel for pixel
+                Image.frombuffer(layout, page.size, shm.buf, "raw", layout, 0, 1).im.paste(page.im,
+                                                                                          (0, 0) + page.size)
+            else:
+                shm.buf[:size] = data
+                del data
+            f = self.executor.submit(process_page, shm.name, layout, page.mode, page.size, palette,
+                                     path, fmt, rotate, convert, save_args)
+        except BaseException:
+            self.release(shm)
+            raise
+        f.add_done_callback(lambda _: self.release(shm))
+        return f
+
+    def release(self,
+                shm: shared_memory.SharedMemory) \
+            -> None:
+        shm.close()
+        shm.unlink()
+        self.slots.release()
+
+    def map(self,
+            pages: typing.Iterable[Image.Image],
+            path_pattern: str,
+            fmt: typing.Union[str, None] = None,
+            start: int = 0,
+            **kwargs) \
+            -> typing.List[concurrent.futures.Future]:
+        """
+        Queue every page of a sequence, numbering the files from start.
+        With a lazy sequence, the next page is decoded while the previous ones are being encoded.
+
+        :param pages: the pages to process
+        :type pages: iterable of PIL.Image
+        :param path_pattern: the path of the files to write, with a %d placeholder for the page number
+        :type path_pattern: str
+        :param fmt: see submit()
+        :type fmt: str | None
+        :param start: the number of the first page
+        :type start: int
+        :param kwargs: further arguments of submit()
+        :return: one future for each page
+        :rtype: [concurrent.futures.Future]
+        """
+        return [self.submit(page, path_pattern % n, fmt, **kwargs) for n, page in enumerate(pages, start)]
+
+    def shutdown(self,
+                 wait: bool = True) \
+            -> None:
+        self.executor.shutdown(wait=wait)
+
+
+processor = None
+processor_lock = threading.Lock()
+
+
+def configure(workers: typing.Union[int, None] = None,
+              max_pending: typing.Union[int, None] = None) \
+        -> None:
+    """
+    Replace the shared PostProcessor with a new one using the given settings.
+
+    :param workers: the number of worker processes, by default the number of CPUs
+    :type workers: int | None
+    :param max_pending: the number of pages queued at most, by default twice the number of workers
+    :type max_pending: int | None
+    """
+    global processor
+    with processor_lock:
+        old = processor
+        processor = PostProcessor(workers, max_pending)
+    if old is not None:
+        old.shutdown()
+
+
+def get_processor() \
+        -> PostProcessor:
+    """
+    :return: the shared PostProcessor, created on first use
+    :rtype: PostProcessor
+    """
+    global processor
+    with processor_lock:
+        if processor is None:
+            processor = PostProcessor()
+        return processor
+
+
+def __benchmark():
+    import tempfile
+    import time
+
+    pages = [Image.new("RGB", (2480, 3508), (i * 20, 100, 30)) for i in range(16)]
+    with tempfile.TemporaryDirectory() as d:
+        start = time.perf_counter()
+        for n, page in enumerate(pages):
+            page.save(os.path.join(d, "inline_%d.png" % n), compress_level=6)
+        inline = time.perf_counter() - start
+
+        p = PostProcessor()
+        p.submit(pages[0], os.path.join(d, "warmup.png")).result()
+        start = time.perf_counter()
+        for f in p.map(pages, os.path.join(d, "pooled_%d.png"), compress_level=6):
+            f.result()
+        pooled = time.perf_counter() - start
+        p.shutdown()
+    print("%d A4 300 dpi pages to PNG: inline %.2f s, %d processes %.2f s" % (len(pages), inline, p.workers, pooled))
+
+
+if __name__ == "__main__":
+    __benchmark()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# A scheduler running scan requests on a fleet of scanners.
+# Each request is placed on a scanner able to honor its ticket (input source, format, color mode, resolution),
+# which is not stopped and runs less jobs than its concurrency limit. Among those, the scanner expected to
+# finish first is chosen, from the number of jobs it is running and the throughput it reached in the past.
+#
+# Devices drop a job whose images are not requested within about 60 seconds from its creation. For this
+# reason a job is created only once a worker thread is free to handle it, and its images are requested
+# right away by a ScanJobDriver: requests never wait in a queue between job creation and retrieval.
+#
+# A scanner last seen stopped is queried again once its status is older than status_ttl, as long as a pending
+# request needs it, so requests waiting for it are placed as soon as it comes back.
+
+import collections
+import concurrent.futures
+import threading
+import time
+import typing
+
+from PyWSD import wsd_scan__cache, \
+    wsd_scan__driver, \
+    wsd_scan__images, \
+    wsd_scan__operations, \
+    wsd_scan__structures, \
+    wsd_transfer__structures
+
+RETRIEVAL_WINDOW = 60.0
+
+
+class FleetScanner:
+    """
+    A scanner managed by the scheduler, with its capabilities, its last known status and its throughput.
+    """
+
+    def __init__(self,
+                 hosted_scan_service: wsd_transfer__structures.HostedService,
+                 max_concurrent: int = 1):
+        self.hosted_scan_service = hosted_scan_service
+        self.max_concurrent = max_concurrent
+        self.description = None
+        self.configuration = None
+        self.status = None
+        self.status_time = 0.0
+        self.active = 0
+        self.jobs_done = 0
+        self.failures = 0
+        self.ppm = None  # exponentially weighted average of the pages per minute of past jobs
+        self.refreshing = False
+
+    def __str__(self):
+        s = ""
+        s += "Scanner:              %s\n" % self.hosted_scan_service.ep_ref_addr
+        s += "State:                %s\n" % (self.status.state if self.status is not None else "unknown")
+        s += "Active jobs:          %d/%d\n" % (self.active, self.max_concurrent)
+        s += "Jobs done:            %d (%d failed)\n" % (self.jobs_done, self.failures)
+        s += "Pages per minute:     %s\n" % ("%.1f" % self.ppm if self.ppm is not None else "unknown")
+        return s
+
+    def update(self,
+               description: wsd_scan__structures.ScannerDescription,
+               configuration: wsd_scan__structures.ScannerConfiguration,
+               status: wsd_scan__structures.ScannerStatus) \
+            -> None:
+        self.description = description
+        self.configuration = configuration
+        self.status = status
+        self.status_time = time.monotonic()
+
+    def source(self,
+               input_src: str) \
+            -> typing.Union[wsd_scan__structures.ScannerSourceSettings, None]:
+        c = self.configuration
+        if input_src == "Platen":
+            return c.platen
+        if input_src == "ADF":
+            return c.front_adf
+        if input_src == "ADFDuplex":
+            return c.front_adf if c.adf_duplex else None
+        return None
+
+    def supports(self,
+                 ticket: wsd_scan__structures.ScanTicket) \
+            -> bool:
+        """
+        :return: True if the configuration of the scanner can honor the ticket
+        :rtype: bool
+        """
+        if self.configuration is None:
+            return False
+        dp = ticket.doc_params
+        if dp is None:
+            return True
+        if dp.format and dp.format not in self.configuration.settings.formats:
+            return False
+        src = self.source(dp.input_src or "Platen")
+        if src is None:
+            return False
+        for side in (dp.front, dp.back):
+            if side is None:
+                continue
+            if side.color and side.color not in src.color_modes:
+                return False
+            if str(side.res[0]) not in src.width_res or str(side.res[1]) not in src.height_res:
+                return False
+        return True
+
+    def stopped(self) \
+            -> bool:
+        return self.status is not None and self.status.state == "Stopped"
+
+    def available(self) \
+            -> bool:
+        return self.active < self.max_concurrent and not self.stopped()
+
+    def expected_ppm(self,
+                     default: float) \
+            -> float:
+        return self.ppm if self.ppm else default
+
+
+class ScanRequest:
+    def __init__(self,
+                 ticket: wsd_scan__structures.ScanTicket,
+                 handler: typing.Callable[[wsd_scan__images.RawImage, int], typing.Any],
+                 docname: str,
+                 validate: bool):
+        self.ticket = ticket
+        self.handler = handler
+        self.docname = docname
+        self.validate = validate
+        self.future = concurrent.futures.Future()
+        self.submitted = time.monotonic()
+
+
+class FleetScheduler:
+    """
+    Accepts scan requests and runs each of them on the most suitable scanner of the fleet, in worker threads.
+
+    :param max_workers: the number of jobs run at the same time on the whole fleet
+    :param status_ttl: the number of seconds after which the status of a scanner is refreshed before use
+    :param default_ppm: the throughput assumed for scanners that have not completed any job yet
+    :param smoothing: the weight of the last job in the throughput average of a scanner
+    """
+
+    def __init__(self,
+                 max_workers: int = 16,
+                 status_ttl: float = 30.0,
+                 default_ppm: float = 20.0,
+                 smoothing: float = 0.3):
+        self.max_workers = max_workers
+        self.status_ttl = status_ttl
+        self.default_ppm = default_ppm
+        self.smoothing = smoothing
+        self.scanners = {}  # scan service address -> FleetScanner
+        self.pending = collections.deque()
+        self.running = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.thread = threading.Thread(target=self.dispatch, daemon=True)
+        self.thread.start()
+
+    def add_scanner(self,
+                    hosted_scan_service: wsd_transfer__structures.HostedService,
+                    max_concurrent: int = 1,
+                    elements: typing.Union[tuple, None] = None) \
+            -> FleetScanner:
+        """
+        Add a scanner to the fleet.
+
+        :param hosted_scan_service: the wsd scan service of the scanner
+        :type hosted_scan_service: wsd_transfer__structures.HostedService
+        :param max_concurrent: the number of jobs the scanner is allowed to run at once
+        :type max_concurrent: int
+        :param elements: the result of wsd_get_scanner_elements() for this scanner, queried if not given
+        :type elements: (ScannerDescription, ScannerConfiguration, ScannerStatus, ScanTicket) | None
+        :return: the scanner added
+        :rtype: FleetScanner
+        """
+        if elements is None:
+            elements = wsd_scan__operations.wsd_get_scanner_elements(hosted_scan_service)
+        s = FleetScanner(hosted_scan_service, max_concurrent)
+        s.update(*elements[:3])
+        with self.cond:
+            self.scanners[hosted_scan_service.ep_ref_addr] = s
+            self.cond.notify_all()
+        return s
+
+    def remove_scanner(self,
+                       addr: str) \
+            -> None:
+        with self.cond:
+            self.scanners.pop(addr, None)
+
+    def update_status(self,
+                      addr: str,
+                      status: wsd_scan__structures.ScannerStatus) \
+            -> None:
+        """
+        Record a status received from a scanner, for instance through a ScannerStatusSummaryEvent.
+        """
+        with self.cond:
+            s = self.scanners.get(addr)
+            if s is not None:
+                s.status = status
+                s.status_time = time.monotonic()
+                self.cond.notify_all()
+
+    def submit(self,
+               ticket: wsd_scan__structures.ScanTicket,
+               handler: typing.Callable[[wsd_scan__images.RawImage, int], typing.Any],
+               docname: str = "scan",
+               validate: bool = True) \
+            -> concurrent.futures.Future:
+        """
+        Queue a scan request.
+
+        :param ticket: the ticket of the scan
+        :type ticket: wsd_scan__structures.ScanTicket
+        :param handler: called with every image retrieved, see wsd_scan__driver.ScanJobDriver.run()
+        :type handler: callable
+        :param docname: the name assigned to the images to retrieve
+        :type docname: str
+        :param validate: True to validate the ticket on the chosen scanner before creating the job
+        :type validate: bool
+        :return: a future resolving to the (FleetScanner, wsd_scan__driver.JobStats) of the job
+        :rtype: concurrent.futures.Future
+        :raises ValueError: if no scanner of the fleet can honor the ticket
+        """
+        r = ScanRequest(ticket, handler, docname, validate)
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("scheduler is shut down")
+            if not any(s.supports(ticket) for s in self.scanners.values()):
+                raise ValueError("no scanner supports the requested ticket")
+            self.pending.append(r)
+            self.cond.notify_all()
+        return r.future
+
+    def place(self,
+              r: ScanRequest) \
+            -> typing.Union[FleetScanner, None]:
+        """
+        Choose the scanner for a request, among the ones able to start it now. Called with the lock held.
+
+        :return: the scanner expected to complete the job first, or None if none is available
+        :rtype: FleetScanner | None
+        """
+        best = None
+        best_score = None
+        for addr, s in self.scanners.items():
+            if not s.available() or not s.supports(r.ticket):
+                continue
+            # the time needed to clear the jobs already running plus this one, per page
+            score = (s.active + 1) / s.expected_ppm(self.default_ppm)
+            if best is None or (score, addr) < best_score:
+                best, best_score = s, (score, addr)
+        return best
+
+    def refresh(self,
+                s: FleetScanner) \
+            -> None:
+        """
+        Query the elements of a scanner again, outside of the lock, and wake the dispatcher with the result.
+        """
+        try:
+            elements = wsd_scan__operations.wsd_get_scanner_elements(s.hosted_scan_service)
+        except Exception:
+            elements = None
+        with self.cond:
+            if elements is not None:
+                s.update(*elements[:3])
+            else:
+                # unreachable: keep the last status, and try again after another status_ttl
+                s.status_time = time.monotonic()
+            s.refreshing = False
+            self.cond.notify_all()
+
+    def refresh_stale(self) \
+            -> typing.Union[float, None]:
+        """
+        Start refreshing the stopped scanners whose status is stale and that a pending request could use.
+        Called with the lock held.
+
+        :return: the number of seconds until the next stopped scanner becomes stale, or None if there is none
+        :rtype: float | None
+        """
+        now = time.monotonic()
+        timeout = None
+        for s in self.scanners.values():
+            if not s.stopped() or s.refreshing or not any(s.supports(r.ticket) for r in self.pending):
+                continue
+            left = s.status_time + self.status_ttl - now
+            if left > 0:
+                timeout = left if timeout is None else min(timeout, left)
+                continue
+            s.refreshing = True
+            threading.Thread(target=self.refresh, args=(s, ), daemon=True).start()
+        return timeout
+
+    def dispatch(self) \
+            -> None:
+        with self.cond:
+            while not self.closed:
+                started = False
+                if self.running < self.max_workers:
+                    for r in list(self.pending):
+                        s = self.place(r)
+                        if s is None:
+                            continue
+                        self.pending.remove(r)
+                        s.active += 1
+                        self.running += 1
+                        self.executor.submit(self.run, s, r)
+                        started = True
+                        if self.running >= self.max_workers:
+                            break
+                if not started:
+                    self.cond.wait(self.refresh_stale())
+
+    def run(self,
+            s: FleetScanner,
+            r: ScanRequest) \
+            -> None:
+        if r.future.cancelled():
+            self.release(s)
+            return
+        if time.monotonic() - s.status_time > self.status_ttl:
+            # the request was placed on a stale status: refresh it before creating the job, and place the
+            # request again if the scanner turns out to be unable to run it
+            try:
+                elements = wsd_scan__operations.wsd_get_scanner_elements(s.hosted_scan_service)
+            except BaseException as e:
+                with self.cond:
+                    s.failures += 1
+                self.release(s)
+                if r.future.set_running_or_notify_cancel():
+                    r.future.set_exception(e)
+                return
+            with self.cond:
+                s.update(*elements[:3])
+                if s.stopped() or not s.supports(r.ticket):
+                    self.pending.appendleft(r)
+                    self.release(s)
+                    return
+
+        if not r.future.set_running_or_notify_cancel():
+            self.release(s)
+            return
+        try:
+            ticket = r.ticket
+            if r.validate:
+                valid, ticket = wsd_scan__cache.wsd_validate_scan_ticket(s.hosted_scan_service, ticket)
+            driver = wsd_scan__driver.ScanJobDriver(s.hosted_scan_service, ticket, r.docname)
+            # the driver requests the first image as soon as the job exists, well within RETRIEVAL_WINDOW
+            driver.start()
+            stats = driver.run(r.handler)
+        except BaseException as e:
+            with self.cond:
+                s.failures += 1
+            self.release(s)
+            r.future.set_exception(e)
+            return
+
+        with self.cond:
+            s.jobs_done += 1
+            if stats.pages and stats.elapsed > 0:
+                ppm = stats.pages_per_minute
+                s.ppm = ppm if s.ppm is None else self.smoothing * ppm + (1 - self.smoothing) * s.ppm
+        self.release(s)
+        r.future.set_result((s, stats))
+
+    def release(self,
+                s: FleetScanner) \
+            -> None:
+        with self.cond:
+            s.active -= 1
+            self.running -= 1
+            self.cond.notify_all()
+
+    def shutdown(self,
+                 wait: bool = True) \
+            -> None:
+        """
+        Stop accepting requests, cancel the ones not started yet, and optionally wait for the running ones.
+        """
+        with self.cond:
+            self.closed = True
+            for r in self.pending:
+                r.future.cancel()
+            self.pending.clear()
+            self.cond.notify_all()
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Local validation and correction of scan tickets against the configuration advertised by a scanner.
+# The capabilities of a configuration are indexed once: numeric values (resolutions, rotations) are kept
+# as sorted lists, so that the supported value closest to a requested one is found by bisection, and
+# enumerated values (formats, color modes, content types) as sets.
+# A ticket passing these checks may still be refused by the device, which remains the authority;
+# a ticket failing them is corrected without querying the device.
+
+import bisect
+import copy
+import threading
+import typing
+
+from PyWSD import wsd_scan__structures
+
+
+def nearest(values: typing.List[int],
+            v: int) \
+        -> int:
+    """
+    :param values: a non-empty sorted list of numbers
+    :type values: [int]
+    :param v: the number to look for
+    :type v: int
+    :return: the element of values closest to v, the greater one on ties
+    :rtype: int
+    """
+    i = bisect.bisect_left(values, v)
+    if i == len(values):
+        return values[-1]
+    if i == 0 or values[i] - v <= v - values[i - 1]:
+        return values[i]
+    return values[i - 1]
+
+
+def clamp(v: int,
+          bounds: typing.Tuple[int, int]) \
+        -> int:
+    return min(max(v, bounds[0]), bounds[1])
+
+
+def numbers(values: typing.Iterable[str]) \
+        -> typing.List[int]:
+    return sorted({int(v) for v in values if v is not None and v.strip().lstrip("-").isdigit()})
+
+
+class SourceIndex:
+    """
+    The capabilities of an input source (platen or ADF side), indexed for lookups.
+    """
+
+    def __init__(self,
+                 sss: wsd_scan__structures.ScannerSourceSettings):
+        self.width_res = numbers(sss.width_res)
+        self.height_res = numbers(sss.height_res)
+        self.color_modes = list(sss.color_modes)
+        self.color_set = frozenset(sss.color_modes)
+        self.min_size = sss.min_size
+        self.max_size = sss.max_size
+
+
+class CapabilityIndex:
+    """
+    The capabilities of a ScannerConfiguration, indexed for lookups.
+    """
+
+    def __init__(self,
+                 configuration: wsd_scan__structures.ScannerConfiguration):
+        s = configuration.settings
+        self.formats = list(s.formats)
+        self.format_set = frozenset(s.formats)
+        self.content_types = list(s.content_types)
+        self.content_type_set = frozenset(s.content_types)
+        self.compression_factor = s.compression_factor
+        self.scaling_range_w = s.scaling_range_w
+        self.scaling_range_h = s.scaling_range_h
+        self.rotations = numbers(s.rotations)
+        self.size_autodetect_sup = s.size_autodetect_sup
+        self.auto_exposure_sup = s.auto_exposure_sup
+        # input source -> (front side, back side)
+        self.sources = {}
+        if configuration.platen is not None:
+            self.sources["Platen"] = (SourceIndex(configuration.platen), None)
+        if configuration.front_adf is not None:
+            front = SourceIndex(configuration.front_adf)
+            self.sources["ADF"] = (front, None)
+            if configuration.adf_duplex:
+                back = SourceIndex(configuration.back_adf) if configuration.back_adf is not None else front
+                self.sources["ADFDuplex"] = (front, back)
+
+    def check(self,
+              tkt: wsd_scan__structures.ScanTicket,
+              fix: bool = False) \
+            -> typing.List[str]:
+        """
+        Check the document parameters of a ticket, and optionally correct them in place.
+
+        :param tkt: the ticket to check
+        :type tkt: wsd_scan__structures.ScanTicket
+        :param fix: True to replace every unsupported value with the closest supported one
+        :type fix: bool
+        :return: a description of every problem found
+        :rtype: [str]
+        """
+        problems = []
+        dp = tkt.doc_params
+        if dp is None:
+            return problems
+
+        if dp.format and dp.format not in self.format_set:
+            problems.append("format %s not supported" % dp.format)
+            if fix and self.formats:
+                dp.format = self.formats[0]
+        if dp.content_type and self.content_type_set and dp.content_type not in self.content_type_set:
+            problems.append("content type %s not supported" % dp.content_type)
+            if fix:
+                dp.content_type = self.content_types[0]
+        if dp.compression_factor and dp.compression_factor.isdigit() and self.compression_factor != (0, 0):
+            v = int(dp.compression_factor)
+            if v != clamp(v, self.compression_factor):
+                problems.append("compression factor %d out of range" % v)
+                if fix:
+                    dp.compression_factor = str(clamp(v, self.compression_factor))
+        if dp.rotation and self.rotations and dp.rotation not in self.rotations:
+            problems.append("rotation %d not supported" % dp.rotation)
+            if fix:
+                dp.rotation = nearest(self.rotations, dp.rotation)
+        if self.scaling_range_w != (0, 0) and self.scaling_range_h != (0, 0):
+            scaling = (clamp(dp.scaling[0], self.scaling_range_w), clamp(dp.scaling[1], self.scaling_range_h))
+            if scaling != tuple(dp.scaling):
+                problems.append("scaling (%d, %d) out of range" % tuple(dp.scaling))
+                if fix:
+                    dp.scaling = scaling
+        if dp.size_autodetect and not self.size_autodetect_sup:
+            problems.append("document size autodetection not supported")
+            if fix:
+                dp.size_autodetect = False
+        if dp.auto_exposure and not self.auto_exposure_sup:
+            problems.append("auto exposure not supported")
+            if fix:
+                dp.auto_exposure = False
+
+        input_src = dp.input_src or "Platen"
+        if input_src not in self.sources:
+            problems.append("input source %s not available" % input_src)
+            if not fix or not self.sources:
+                return problems
+            input_src = dp.input_src = next(iter(self.sources))
+        front, back = self.sources[input_src]
+
+        if dp.input_size != (0, 0) and front.max_size != (0, 0):
+            size = (clamp(dp.input_size[0], (0, front.max_size[0])), clamp(dp.input_size[1], (0, front.max_size[1])))
+            if size != tuple(dp.input_size):
+                problems.append("input size (%d, %d) too large" % tuple(dp.input_size))
+                if fix:
+                    dp.input_size = size
+
+        for name, side, src in (("front", dp.front, front), ("back", dp.back, back)):
+            if side is None or src is None:
+                continue
+            problems.extend(self.check_side(name, side, src, fix))
+        return problems
+
+    @staticmethod
+    def check_side(name: str,
+                   side: wsd_scan__structures.MediaSide,
+                   src: SourceIndex,
+                   fix: bool) \
+            -> typing.List[str]:
+        problems = []
+        if side.color and src.color_set and side.color not in src.color_set:
+            problems.append("%s color mode %s not supported" % (name, side.color))
+            if fix:
+                side.color = src.color_modes[0]
+
+        if src.width_res and src.height_res:
+            res = (nearest(src.width_res, side.res[0]), nearest(src.height_res, side.res[1]))
+            if res != tuple(side.res):
+                problems.append("%s resolution (%d, %d) not supported" % ((name,) + tuple(side.res)))
+                if fix:
+                    side.res = res
+
+        # a region of size 0 lets the device use the whole input size. The offset is only checked to start
+        # within the maximum size: devices commonly accept, and advertise, regions ending past it
+        if side.size != (0, 0) and src.max_size != (0, 0):
+            size = tuple(clamp(side.size[i], (src.min_size[i], src.max_size[i])) for i in (0, 1))
+            offset = tuple(clamp(side.offset[i], (0, src.max_size[i] - src.min_size[i])) for i in (0, 1))
+            if size != tuple(side.size) or offset != tuple(side.offset):
+                problems.append("%s region (%d, %d) + (%d, %d) out of bounds"
+                                % ((name,) + tuple(side.offset) + tuple(side.size)))
+                if fix:
+                    side.size = size
+                    side.offset = offset
+        return problems
+
+    def validate(self,
+                 tkt: wsd_scan__structures.ScanTicket) \
+            -> typing.Tuple[bool, wsd_scan__structures.ScanTicket]:
+        """
+        Local counterpart of wsd_scan__operations.wsd_validate_scan_ticket().
+
+        :param tkt: the ticket to validate
+        :type tkt: wsd_scan__structures.ScanTicket
+        :return: a tuple of the form (boolean, ScanTicket): True and the same ticket if no problem was found, \
+        False and a corrected copy of the ticket otherwise
+        """
+        if not self.check(tkt):
+            return True, tkt
+        fixed = copy.copy(tkt)
+        fixed.doc_params = copy.deepcopy(tkt.doc_params)
+        self.check(fixed, fix=True)
+        return False, fixed
+
+
+indexes = {}  # id of the configuration -> (configuration, CapabilityIndex)
+indexes_lock = threading.Lock()
+
+
+def get_index(configuration: wsd_scan__structures.ScannerConfiguration) \
+        -> CapabilityIndex:
+    """
+    :param configuration: the configuration of a scanner
+    :type configuration: wsd_scan__structures.ScannerConfiguration
+    :return: the index of the configuration, built on first use
+    :rtype: CapabilityIndex
+    """
+    with indexes_lock:
+        known = indexes.get(id(configuration))
+        if known is not None and known[0] is configuration:
+            return known[1]
+        index = CapabilityIndex(configuration)
+        # the configuration is kept alive by the entry, so that its id is not reused
+        indexes[id(configuration)] = (configuration, index)
+        if len(indexes) > 256:
+            del indexes[next(iter(indexes))]
+        return index
+
+
+def validate_scan_ticket(configuration: wsd_scan__structures.ScannerConfiguration,
+                         tkt: wsd_scan__structures.ScanTicket) \
+        -> typing.Tuple[bool, wsd_scan__structures.ScanTicket]:
+    """
+    Validate a ticket against a scanner configuration, without querying the device.
+
+    :param configuration: the configuration of the scanner
+    :type configuration: wsd_scan__structures.ScannerConfiguration
+    :param tkt: the ticket to validate
+    :type tkt: wsd_scan__structures.ScanTicket
+    :return: see CapabilityIndex.validate()
+    """
+    return get_index(configuration).validate(tkt)
@@ -1,21 +1,45 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
 
+import threading
+import typing
+
+import lxml.etree as etree
+
 from PyWSD import wsd_common, \
     wsd_discovery__operations, \
     wsd_discovery__structures, \
+    wsd_transfer__parsers, \
     wsd_transfer__structures, \
     wsd_globals
 
 
-def wsd_get(target_service: wsd_discovery__structures.TargetService):
+metadata = {}  # endpoint address -> (metadata version, (TargetInfo, [HostedService]))
+metadata_lock = threading.Lock()
+
+
+def wsd_get(target_service: wsd_discovery__structures.TargetService,
+            use_cache: bool = True):
     """
     Query wsd target for information about model/device and hosted services.
 
+    The metadata of a device only changes along with the MetadataVersion it announces during discovery, so the
+    result is cached, in memory and in the discovery cache database, for each endpoint and metadata version.
+    A Get is sent only if no result is cached for the version of the target. Targets with a metadata version
+    of 0, the default of TargetService instances not obtained from discovery, are always queried.
+    The objects returned may be shared with other callers, and must be treated as read-only.
+
     :param target_service: A wsd target
     :type target_service: wsd_discovery__structures.TargetService
+    :param use_cache: False to query the device even if its metadata is cached
+    :type use_cache: bool
     :return: A tuple containing a TargetInfo and a list of HostedService instances.
     """
+    if use_cache:
+        result = cached_get_response(target_service)
+        if result is not None:
+            return result
+
     fields = {"FROM": wsd_globals.urn,
               "TO": target_service.ep_ref_addr}
     x = wsd_common.submit_request(target_service.xaddrs,
@@ -25,72 +49,54 @@ def wsd_get(target_service: wsd_discovery__structures.TargetService):
     if x is False:
         return False
 
-    meta = wsd_common.xml_find(x, ".//mex:Metadata")
-    meta_model = wsd_common.xml_find(meta,
-                                     ".//mex:MetadataSection[@Dialect=\
-                                     'http://schemas.xmlsoap.org/ws/2006/02/devprof/ThisModel']")
-    meta_dev = wsd_common.xml_find(meta,
-                                   ".//mex:MetadataSection[@Dialect=\
-                                   'http://schemas.xmlsoap.org/ws/2006/02/devprof/ThisDevice']")
-    meta_rel = wsd_common.xml_find(meta,
-                                   ".//mex:MetadataSection[@Dialect=\
-                                   'http://schemas.xmlsoap.org/ws/2006/02/devprof/Relationship']")
-
-    tinfo = wsd_transfer__structures.TargetInfo()
-    # WSD-Profiles section 5.1 (+ PNP-X)
-    tinfo.manufacturer = wsd_common.xml_find(meta_model, ".//wsdp:Manufacturer").text
-    q = wsd_common.xml_find(meta_model, ".//wsdp:ManufacturerUrl")
-    if q is not None:
-        tinfo.manufacturer_url = q.text
-    tinfo.model_name = wsd_common.xml_find(meta_model, ".//wsdp:ModelName").text
-    q = wsd_common.xml_find(meta_model, ".//wsdp:ModelNumber")
-    if q is not None:
-        tinfo.model_number = q.text
-    q = wsd_common.xml_find(meta_model, ".//wsdp:ModelUrl")
-    if q is not None:
-        tinfo.model_url = q.text
-    q = wsd_common.xml_find(meta_model, ".//wsdp:PresentationUrl")
-    if q is not None:
-        tinfo.presentation_url = q.text
-    tinfo.device_cat = wsd_common.xml_find(meta_model, ".//pnpx:DeviceCategory").text.split()
-
-    tinfo.friendly_name = wsd_common.xml_find(meta_dev, ".//wsdp:FriendlyName").text
-    tinfo.fw_ver = wsd_common.xml_find(meta_dev, ".//wsdp:FirmwareVersion").text
-    tinfo.serial_num = wsd_common.xml_find(meta_dev, ".//wsdp:SerialNumber").text
-
-    hservices = []
-    # WSD-Profiles section 5.2 (+ PNP-X)
-    wsd_common.xml_findall(meta_rel, ".//wsdp:Relationship[@Type='http://schemas.xmlsoap.org/ws/2006/02/devprof/host']")
-
-    for r in meta_rel:
-        # UNCLEAR how the host item should differ from the target endpoint, and how to manage multiple host items
-        # TBD - need some real-case examples
-        # host = xml_find(r, ".//wsdp:Host")
-        # if host is not None:    #"if omitted, implies the same endpoint reference of the targeted service"
-        #    xml_find(host, ".//wsdp:Types").text
-        #    xml_find(host, ".//wsdp:ServiceId").text
-        #    er = xml_find(host, ".//wsa:EndpointReference")
-        #    xml_find(er, ".//wsa:Address").text  #Optional endpoint fields not implemented yet
-        hosted = wsd_common.xml_findall(r, ".//wsdp:Hosted")
-        for h in hosted:
-            hs = wsd_transfer__structures.HostedService()
-            hs.types = wsd_common.xml_find(h, ".//wsdp:Types").text.split()
-            hs.service_id = wsd_common.xml_find(h, ".//wsdp:ServiceId").text
-            q = wsd_common.xml_find(h, ".//pnpx:HardwareId")
-            if q is not None:
-                hs.hardware_id = q.text
-            q = wsd_common.xml_find(h, ".//pnpx:CompatibleId")
-            if q is not None:
-                hs.compatible_id = q.text
-            q = wsd_common.xml_find(h, ".//wsdp:ServiceAddress")
-            if q is not None:
-                hs.service_address = q.text
-            er = wsd_common.xml_find(h, ".//wsa:EndpointReference")
-            hs.ep_ref_addr = wsd_common.xml_find(er, ".//wsa:Address").text
-            hservices.append(hs)
-
-    # WSD-Profiles section 5.3 and 5.4 omitted
-    return tinfo, hservices
+    return store_get_response(target_service, x)
+
+
+def cached_get_response(target_service: wsd_discovery__structures.TargetService) \
+        -> typing.Union[typing.Tuple[wsd_transfer__structures.TargetInfo,
+                                     typing.List[wsd_transfer__structures.HostedService]], None]:
+    """
+    :return: the parsed Get response cached for the target and its metadata version, if any
+    """
+    if not target_service.meta_ver:
+        return None
+    with metadata_lock:
+        known = metadata.get(target_service.ep_ref_addr)
+    if known is not None and known[0] == target_service.meta_ver:
+        return known[1]
+
+    db = wsd_discovery__operations.open_db()
+    try:
+        response = wsd_discovery__operations.read_metadata_from_db(db, target_service)
+    finally:
+        db.close()
+    if response is None:
+        return None
+    result = wsd_transfer__parsers.parse_get_response(etree.fromstring(response))
+    with metadata_lock:
+        metadata[target_service.ep_ref_addr] = (target_service.meta_ver, result)
+    return result
+
+
+def store_get_response(target_service: wsd_discovery__structures.TargetService,
+                       x: etree.ElementTree) \
+        -> typing.Tuple[wsd_transfer__structures.TargetInfo, typing.List[wsd_transfer__structures.HostedService]]:
+    """
+    Parse a Get response and cache it for the metadata version of the target.
+
+    :return: the parsed response
+    """
+    result = wsd_transfer__parsers.parse_get_response(x)
+    if not target_service.meta_ver:
+        return result
+    with metadata_lock:
+        metadata[target_service.ep_ref_addr] = (target_service.meta_ver, result)
+    db = wsd_discovery__operations.open_db()
+    try:
+        wsd_discovery__operations.add_metadata_to_db(db, target_service, etree.tostring(x))
+    finally:
+        db.close()
+    return result
 
 
 def __demo():
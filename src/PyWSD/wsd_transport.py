@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import collections
+import concurrent.futures
+import threading
+import time
+import typing
+from urllib.parse import urlsplit
+
+import requests
+import requests.adapters
+
+
+class PooledEndpoint:
+    """
+    A keep-alive HTTP session bound to a single device endpoint (scheme + host + port).
+    """
+
+    def __init__(self,
+                 pool_size: int):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=pool_size,
+                                                max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.last_used = time.monotonic()
+        self.in_use = 0
+
+
+class ConnectionPool:
+    """
+    Keeps one HTTP session, and thus a pool of persistent connections, for each device endpoint.
+    Sessions left unused for more than idle_timeout seconds are closed. Safe to use from many threads.
+    """
+
+    def __init__(self,
+                 pool_size: int = 4,
+                 idle_timeout: float = 60.0):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.last_reap = time.monotonic()
+
+    @staticmethod
+    def endpoint_key(addr: str) \
+            -> str:
+        u = urlsplit(addr)
+        return "%s://%s" % (u.scheme, u.netloc)
+
+    def acquire(self,
+                addr: str) \
+            -> PooledEndpoint:
+        key = self.endpoint_key(addr)
+        with self.lock:
+            self.reap_locked()
+            e = self.endpoints.get(key)
+            if e is None:
+                e = PooledEndpoint(self.pool_size)
+                self.endpoints[key] = e
+            e.in_use += 1
+            return e
+
+    def release(self,
+                e: PooledEndpoint) \
+            -> None:
+        with self.lock:
+            e.in_use -= 1
+            e.last_used = time.monotonic()
+
+    def post(self,
+             addr: str,
+             data: bytes,
+             headers: typing.Dict[str, str] = None,
+             timeout: typing.Union[float, None] = None,
+             stream: bool = False) \
+            -> requests.Response:
+        """
+        Send an HTTP POST request over a persistent connection to the device.
+
+        :param addr: the address to send the message to
+        :type addr: str
+        :param data: the request body
+        :type data: bytes
+        :param headers: the HTTP headers of the request
+        :type headers: {str: str}
+        :param timeout: the timeout in seconds, or None to wait forever
+        :type timeout: float | None
+        :param stream: if True, the body is not downloaded until accessed, and the response must be closed
+        :type stream: bool
+        :return: the HTTP response
+        :rtype: requests.Response
+        """
+        e = self.acquire(addr)
+        try:
+            r = e.session.post(addr, headers=headers, data=data, timeout=timeout, stream=stream)
+        except BaseException:
+            self.release(e)
+            raise
+        if not stream:
+            self.release(e)
+            return r
+
+        # the body is still to be read: the session stays in use, so that it is not reaped, until the response
+        # is closed
+        close = r.close
+        released = threading.Event()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    self.release(e)
+
+        r.close = close_and_release
+        return r
+
+    def reap(self) \
+            -> None:
+        """
+        Close the sessions that have been idle for longer than idle_timeout.
+        """
+        with self.lock:
+            self.last_reap = 0
+            self.reap_locked()
+
+    def reap_locked(self) \
+            -> None:
+        now = time.monotonic()
+        if now - self.last_reap < self.idle_timeout / 2:
+            return
+        self.last_reap = now
+        for key, e in list(self.endpoints.items()):
+            if e.in_use == 0 and now - e.last_used > self.idle_timeout:
+                e.session.close()
+                del self.endpoints[key]
+
+    def close(self) \
+            -> None:
+        """
+        Close all the sessions, along with their connections.
+        """
+        with self.lock:
+            for e in self.endpoints.values():
+                e.session.close()
+            self.endpoints.clear()
+
+
+class Dispatcher:
+    """
+    Sends a request to the transport addresses of a device, racing them instead of trying one at a time.
+    Addresses are started with a short stagger, the first one that answers wins and is remembered, so that
+    later requests to the same device try it first. If the first address has not replied within its recent
+    95th percentile latency, a single hedged duplicate of the request is sent to that same address, while the
+    other addresses keep being started by the stagger.
+    """
+
+    def __init__(self,
+                 stagger: float = 0.2,
+                 hedge: bool = True,
+                 history_len: int = 50,
+                 max_workers: int = 32):
+        self.stagger = stagger
+        self.hedge = hedge
+        self.history_len = history_len
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.winners = {}  # frozenset of device addresses -> last winning address
+        self.latencies = {}  # address -> recent reply times, in seconds
+        self.lock = threading.Lock()
+
+    def record_latency(self,
+                       addr: str,
+                       latency: float) \
+            -> None:
+        with self.lock:
+            h = self.latencies.get(addr)
+            if h is None:
+                h = collections.deque(maxlen=self.history_len)
+                self.latencies[addr] = h
+            h.append(latency)
+
+    def p95(self,
+            addr: str) \
+            -> typing.Union[float, None]:
+        """
+        :param addr: a transport address
+        :type addr: str
+        :return: the 95th percentile of the recent reply times of the address, or None if too few are known
+        :rtype: float | None
+        """
+        with self.lock:
+            h = self.latencies.get(addr)
+            if h is None or len(h) < 5:
+                return None
+            ordered = sorted(h)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def order(self,
+              addrs: typing.Iterable[str]) \
+            -> typing.List[str]:
+        """
+        Sort the addresses of a device: the last winner first, then by median reply time. Unknown ones go last.
+        """
+        key = frozenset(addrs)
+        with self.lock:
+            winner = self.winners.get(key)
+            medians = {a: sorted(h)[len(h) // 2] for a, h in self.latencies.items() if a in key and h}
+        return sorted(key, key=lambda a: (a != winner, a not in medians, medians.get(a, 0), a))
+
+    def attempt(self,
+                send: typing.Callable[[str], typing.Union[bytes, None]],
+                addr: str) \
+            -> typing.Tuple[str, typing.Union[bytes, None]]:
+        start = time.monotonic()
+        r = send(addr)
+        if r is not None:
+            self.record_latency(addr, time.monotonic() - start)
+        return addr, r
+
+    def dispatch(self,
+                 addrs: typing.Iterable[str],
+                 send: typing.Callable[[str], typing.Union[bytes, None]]) \
+            -> typing.Union[bytes, None]:
+        """
+        Race a request across the given addresses.
+
+        :param addrs: the transport addresses of a single device
+        :type addrs: {str}
+        :param send: a function sending the request to one address, returning the reply or None on failure
+        :type send: callable
+        :return: the first reply received, or None if no address replied
+        :rtype: bytes | None
+        """
+        key = frozenset(addrs)
+        candidates = collections.deque(self.order(key))
+        if not candidates:
+            return None
+
+        primary = candidates[0]
+        hedge_after = self.p95(primary) if self.hedge else None
+        start = time.monotonic()
+        next_launch = start
+        pending = set()
+        while pending or candidates:
+            now = time.monotonic()
+            if candidates and (now >= next_launch or not pending):
+                pending.add(self.executor.submit(self.attempt, send, candidates.popleft()))
+                next_launch = now + self.stagger
+            elif hedge_after is not None and now - start >= hedge_after:
+                pending.add(self.executor.submit(self.attempt, send, primary))
+                hedge_after = None
+
+            deadlines = []
+            if candidates:
+                deadlines.append(next_launch)
+            if hedge_after is not None:
+                deadlines.append(start + hedge_after)
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+            done, pending = concurrent.futures.wait(pending, timeout=timeout,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                addr, r = f.result()
+                if r is not None:
+                    with self.lock:
+                        self.winners[key] = addr
+                    return r
+        return None
+
+    def close(self) \
+            -> None:
+        """
+        Release the worker threads. Requests already started are completed.
+        """
+        self.executor.shutdown(wait=False)
+
+
+pool = ConnectionPool()
+dispatcher = None
+
+
+def configure(pool_size: int = 4,
+              idle_timeout: float = 60.0) \
+        -> None:
+    """
+    Replace the shared connection pool with a new one using the given settings.
+
+    :param pool_size: the maximum number of connections kept open to each endpoint
+    :type pool_size: int
+    :param idle_timeout: the number of seconds after which an unused endpoint is closed
+    :type idle_timeout: float
+    """
+    global pool
+    old = pool
+    pool = ConnectionPool(pool_size, idle_timeout)
+    old.close()
+
+
+def set_dispatch_mode(race: bool = True,
+                      stagger: float = 0.2,
+                      hedge: bool = True) \
+        -> None:
+    """
+    Choose how wsd_common.submit_request() handles devices with several transport addresses.
+
+    :param race: True to race the addresses with a Dispatcher, False to try them one at a time
+    :type race: bool
+    :param stagger: the number of seconds to wait before starting the next address
+    :type stagger: float
+    :param hedge: True to send a duplicate request when a reply is slower than usual
+    :type hedge: bool
+    """
+    global dispatcher
+    old = dispatcher
+    dispatcher = Dispatcher(stagger, hedge) if race else None
+    if old is not None:
+        old.close()
+
+
+def post(addr: str,
+         data: bytes,
+         headers: typing.Dict[str, str] = None,
+         timeout: typing.Union[float, None] = None,
+         stream: bool = False) \
+        -> requests.Response:
+    """
+    Send an HTTP POST request through the shared connection pool. See ConnectionPool.post().
+    """
+    return pool.post(addr, data, headers, timeout, stream)